@@ -0,0 +1,124 @@
+""" Validation and normalization of the IP addresses clients report
+
+A client's 'myip' is a comma separated list of IPv4 and IPv6 addresses, and
+each address goes in the hostname's A or AAAA record set. Addresses are
+normalized, so '2001:DB8:0::1' and '2001:db8::1' are the same address, and
+record sets are compared as sets of addresses, so a record set which only
+differs in its order or formatting isn't updated.
+
+Routers report the same few addresses over and over, so the result for each
+'myip' value is cached, and checking a request is a dictionary lookup.
+"""
+
+from functools import lru_cache
+import ipaddress
+
+RECORD_TYPES = {4: 'A', 6: 'AAAA'}
+
+
+def is_bogon(address):
+    """ Check whether an address isn't reachable on the public internet
+
+    Covers private, loopback, link-local, shared, reserved, documentation and
+    multicast addresses.
+    """
+
+    return not address.is_global or address.is_multicast
+
+
+@lru_cache(maxsize=10000)
+def normalize_value(value):
+    """ Normalize a record value if it's an IP address """
+
+    try:
+        return str(ipaddress.ip_address(value))
+    except ValueError:
+        return value
+
+
+def record_values(resource_record):
+    """ The set of normalized values in a resource record set """
+
+    return frozenset(normalize_value(resource_record_value['Value'])
+                     for resource_record_value
+                     in resource_record['ResourceRecords'])
+
+
+def same_values(resource_record, values):
+    """ Check whether a record set holds exactly the given values """
+
+    return record_values(resource_record) == frozenset(
+        normalize_value(value) for value in values)
+
+
+def format_addresses(addresses):
+    """ Format parsed addresses as a comma separated list, A before AAAA """
+
+    return ','.join(address for _, values in addresses for address in values)
+
+
+class AddressParser(object):
+    """ Parses 'myip' values, with a bounded cache of the results
+
+    With `reject_bogons`, addresses which aren't reachable on the public
+    internet are refused.
+    """
+
+    def __init__(self, reject_bogons=False, max_addresses=10,
+                 cache_size=10000):
+        self.reject_bogons = reject_bogons
+        self.max_addresses = max_addresses
+        self.cache_size = cache_size
+
+        self._parsed = {}  # value -> addresses, or None if invalid
+
+    def _parse(self, value):
+        by_version = {}
+
+        for item in value.split(','):
+            address = ipaddress.ip_address(item.strip())
+
+            if self.reject_bogons and is_bogon(address):
+                raise ValueError("{} is not a public address".format(address))
+
+            by_version.setdefault(address.version, set()).add(address)
+
+        if sum(len(values) for values in by_version.values()) > (
+                self.max_addresses):
+            raise ValueError("Too many addresses")
+
+        return tuple((RECORD_TYPES[version],
+                      tuple(str(address)
+                            for address in sorted(by_version[version])))
+                     for version in sorted(by_version))
+
+    def parse(self, value):
+        """ Parse a comma separated list of addresses
+
+        Returns a tuple of (record type, addresses) pairs, A before AAAA, with
+        each type's addresses normalized, without duplicates and sorted.
+        Raises ValueError if any of the addresses is invalid or refused.
+        """
+
+        if not value:
+            raise ValueError("No address")
+
+        try:
+            addresses = self._parsed[value]
+        except KeyError:
+            try:
+                addresses = self._parse(value)
+            except ValueError:
+                addresses = None
+
+            if len(self._parsed) >= self.cache_size:
+                # Clients sending random values shouldn't grow the cache, and
+                # the real clients' values are back in it after one request
+                self._parsed.clear()
+
+            self._parsed[value] = addresses
+
+        if addresses is None:
+            raise ValueError("Invalid address {!r}".format(value))
+
+        return addresses
@@ -1,6 +1,17 @@
+""" The Flask app, and loading of its config
+
+Importing this module only creates the app. The config is loaded by
+load_config() the first time a module which needs it is imported, and
+create_app() also registers the views, so importing the package is quick and
+has no side effects. Serve it with a WSGI server using the factory, for
+example ``gunicorn 'route53_dyndns.app:create_app()'``.
+"""
+
 from __future__ import unicode_literals
 
 import os
+import threading
+import time
 
 try:
     basestring
@@ -9,8 +20,13 @@ except NameError:
 
 from flask import Flask
 
+from route53_dyndns.metrics import registry
+from route53_dyndns.resilience import DEFAULT_RETRYABLE_ERRORS
+
 CONFIG_ENVIRONMENT_VAR = 'ROUTE53_DYNDNS_CONFIG'
 
+_imported = time.time()
+
 
 class DynDnsFlask(Flask):
     def make_response(self, rv):
@@ -30,9 +46,25 @@ class DynDnsFlask(Flask):
     def sanity_check_config(self):
         # Required configuration settings
         required_settings = (
-            'USERNAME', 'PASSWORD', 'AWS_ACCESS_KEY', 'AWS_SECRET_ACCESS_KEY', 'bb'
+            'AWS_ACCESS_KEY', 'AWS_SECRET_ACCESS_KEY'
         )
 
+        # A single user is configured directly when there's no credentials file
+        if not app.config.get('CREDENTIALS_FILE'):
+            required_settings += ('USERNAME', 'PASSWORD')
+
+        # The shared cache needs somewhere to share it
+        if app.config.get('CACHE_BACKEND') == 'shared':
+            required_settings += ('CACHE_SHARED_FILE',)
+
+        # Zones are watched in the record cache
+        if app.config.get('ZONE_WATCH_ENABLED'):
+            required_settings += ('RECORD_CACHE_ENABLED',)
+
+        # Changes are only accepted early if they can be queued durably
+        if app.config.get('ASYNC_UPDATES'):
+            required_settings += ('WORK_QUEUE_FILE',)
+
         for setting in required_settings:
             if not app.config.get(setting, None):
                 raise RuntimeError(
@@ -40,20 +72,151 @@ class DynDnsFlask(Flask):
 
         # Optional settings
         app.config.setdefault('BAD_USER_AGENTS', [])
+        app.config.setdefault('BAD_USER_AGENTS_FILE', None)
+        app.config.setdefault('BAD_USER_AGENTS_RELOAD_INTERVAL', 5)
+        app.config.setdefault('BAD_USER_AGENTS_CACHE_SIZE', 1000)
+        app.config.setdefault('CREDENTIALS_FILE', None)
+        app.config.setdefault('CREDENTIALS_CACHE_TTL', 60)
+        app.config.setdefault('CREDENTIALS_CACHE_MAX_SIZE', 10000)
+        app.config.setdefault('CREDENTIALS_RELOAD_INTERVAL', 5)
+        app.config.setdefault('MAX_HOSTNAMES', 20)
+        app.config.setdefault('REJECT_BOGON_IPS', False)
+        app.config.setdefault('TRUSTED_PROXIES', [])
+        app.config.setdefault('CLIENT_NETWORKS', None)
+        app.config.setdefault('CLIENT_POLICY', 'log')
+        app.config.setdefault('RATE_LIMIT_ENABLED', False)
+        app.config.setdefault('RATE_LIMIT_RATE', 1 / 60.0)
+        app.config.setdefault('RATE_LIMIT_BURST', 5)
+        app.config.setdefault('RATE_LIMIT_MAX_SIZE', 100000)
+        app.config.setdefault('RATE_LIMIT_SHARED_FILE', None)
+        app.config.setdefault('ROUTE53_CONCURRENCY', 10)
+        app.config.setdefault('ASYNC_ROUTE53_THREADS', 32)
+        app.config.setdefault('AWS_MAX_POOL_CONNECTIONS', 10)
+        app.config.setdefault('AWS_TCP_KEEPALIVE', True)
+        app.config.setdefault('AWS_ENDPOINT_URL', None)
+        app.config.setdefault('AWS_MAX_ATTEMPTS', 1)
+        app.config.setdefault('ROUTE53_MAX_ATTEMPTS', 4)
+        app.config.setdefault('ROUTE53_BACKOFF_BASE', 0.1)
+        app.config.setdefault('ROUTE53_BACKOFF_MAX', 5.0)
+        app.config.setdefault('ROUTE53_RETRYABLE_ERRORS',
+                              list(DEFAULT_RETRYABLE_ERRORS))
+        app.config.setdefault('ROUTE53_FATAL_ERRORS', [])
+        app.config.setdefault('ROUTE53_RETRY_BUDGET_RATE', 1.0)
+        app.config.setdefault('ROUTE53_RETRY_BUDGET_BURST', 10)
+        app.config.setdefault('ROUTE53_BREAKER_THRESHOLD', 5)
+        app.config.setdefault('ROUTE53_BREAKER_RESET_TIMEOUT', 30)
+        app.config.setdefault('METRICS_DIR', None)
+        app.config.setdefault('METRICS_FLUSH_INTERVAL', 5)
+        app.config.setdefault('HOSTED_ZONES', [])
+        app.config.setdefault('ZONE_REFRESH_INTERVAL', 300)
+        app.config.setdefault('RECORD_CACHE_ENABLED', False)
+        app.config.setdefault('RECORD_CACHE_TTL', 300)
+        app.config.setdefault('RECORD_CACHE_MAX_SIZE', 10000)
+        app.config.setdefault('ZONE_WATCH_ENABLED', False)
+        app.config.setdefault('ZONE_WATCH_MIN_INTERVAL', 30)
+        app.config.setdefault('ZONE_WATCH_MAX_INTERVAL', 600)
+        app.config.setdefault('CACHE_BACKEND', None)
+        app.config.setdefault('CACHE_TTL', 60)
+        app.config.setdefault('CACHE_MAX_SIZE', 100000)
+        app.config.setdefault('CACHE_SHARED_FILE', None)
+        app.config.setdefault('CACHE_SHARED_SLOTS', 16384)
+        app.config.setdefault('CACHE_SHARED_SLOT_SIZE', 4096)
+        app.config.setdefault('CACHE_REDIS_URL', 'redis://localhost:6379/0')
+        app.config.setdefault('LOG_NOCHG_SAMPLE_RATE', 0.1)
+        app.config.setdefault('AUDIT_LOG_FILE', None)
+        app.config.setdefault('ADMIN_USERS', [])
+        app.config.setdefault('PROFILE_PHASES', False)
+        app.config.setdefault('PROFILE_DIR', None)
+        app.config.setdefault('PROFILE_THRESHOLD', 1.0)
+        app.config.setdefault('PROFILE_SAMPLE_RATE', 0.1)
+        app.config.setdefault('PROFILE_MAX_DUMPS', 100)
+        app.config.setdefault('SNAPSHOT_FILE', None)
+        app.config.setdefault('SNAPSHOT_INTERVAL', 60)
+        app.config.setdefault('SNAPSHOT_REVALIDATE_RATE', 1.0)
+        app.config.setdefault('SNAPSHOT_MAX_CLIENTS', 100000)
+        app.config.setdefault('FLAP_MAX_UPDATES', None)
+        app.config.setdefault('FLAP_WINDOW', 600)
+        app.config.setdefault('FLAP_HISTORY_MAX_SIZE', 1000000)
+        app.config.setdefault('FLAP_HISTORY_FILE', None)
+        app.config.setdefault('ASYNC_UPDATES', False)
+        app.config.setdefault('WORK_QUEUE_FILE', None)
+        app.config.setdefault('WORK_QUEUE_LEASE', 60)
+        app.config.setdefault('WORK_QUEUE_CONCURRENCY', 4)
+        app.config.setdefault('WORK_QUEUE_MAX_ATTEMPTS', 10)
+        app.config.setdefault('CHANGE_TRACKER_FILE', None)
+        app.config.setdefault('CHANGE_TRACKER_MIN_INTERVAL', 2)
+        app.config.setdefault('CHANGE_TRACKER_MAX_INTERVAL', 30)
+        app.config.setdefault('CHANGE_TRACKER_MAX_AGE', 3600)
+        app.config.setdefault('CHANGE_STATUS_MAX_WAIT', 60)
+        app.config.setdefault('BATCH_UPDATES', False)
+        app.config.setdefault('BATCH_WINDOW', 0.05)
+        app.config.setdefault('BATCH_MAX_CHANGES', 100)
+
+        if app.config['CACHE_BACKEND'] not in (None, 'memory', 'shared',
+                                               'redis'):
+            raise RuntimeError("'CACHE_BACKEND' must be 'memory', 'shared' "
+                               "or 'redis'")
+
+        if app.config['CLIENT_POLICY'] not in ('log', 'reject'):
+            raise RuntimeError("'CLIENT_POLICY' must be 'log' or 'reject'")
 
 
 app = DynDnsFlask('route53_dyndns')
 
-try:
-    if os.environ.get(CONFIG_ENVIRONMENT_VAR):
-        app.config.from_envvar(CONFIG_ENVIRONMENT_VAR)
-    else:
-        config_file = os.path.expanduser('~/.route53_dyndns.cfg')
-        app.config.from_pyfile(config_file)
-except Exception as e:
-    raise RuntimeError("Failed to load config: " + e.msg)
-else:
-    app.sanity_check_config()
-
-
-import route53_dyndns.views  # noqa
+_config_lock = threading.Lock()
+_config_loaded = False
+_startup_seconds = 0
+
+registry.gauge('startup_seconds',
+               "Seconds from importing the app to it being ready to serve",
+               lambda: _startup_seconds)
+
+
+def load_config():
+    """ Load and check the config, the first time it's needed
+
+    Returns the app. Raises RuntimeError if the config can't be loaded or is
+    missing a required setting.
+    """
+
+    global _config_loaded
+
+    if _config_loaded:
+        return app
+
+    with _config_lock:
+        if _config_loaded:
+            return app
+
+        try:
+            if os.environ.get(CONFIG_ENVIRONMENT_VAR):
+                app.config.from_envvar(CONFIG_ENVIRONMENT_VAR)
+            else:
+                config_file = os.path.expanduser('~/.route53_dyndns.cfg')
+                app.config.from_pyfile(config_file)
+        except Exception as e:
+            raise RuntimeError("Failed to load config: {}".format(e))
+
+        app.sanity_check_config()
+
+        registry.directory = app.config['METRICS_DIR']
+        registry.flush_interval = app.config['METRICS_FLUSH_INTERVAL']
+
+        _config_loaded = True
+
+    return app
+
+
+def create_app():
+    """ Application factory, returning the configured app with its views """
+
+    global _startup_seconds
+
+    load_config()
+
+    import route53_dyndns.views  # noqa
+
+    if not _startup_seconds:
+        _startup_seconds = time.time() - _imported
+
+    return app
@@ -0,0 +1,331 @@
+""" Asyncio serving mode for the update endpoint
+
+Serves the same '/nic/update' and '/nic/status' API as the WSGI app, with the
+same responses, but each request is a coroutine instead of a worker thread.
+Requests which are waiting on Route 53 don't hold a thread, so a few processes
+can keep thousands of requests in flight. Run it with any ASGI server, for
+example::
+
+    uvicorn route53_dyndns.asgi:application
+
+botocore has no asyncio transport, so the Route 53 calls themselves run on a
+dedicated thread pool of ``ASYNC_ROUTE53_THREADS`` threads, and the event loop
+only awaits their results.
+
+Since a waiting request is cheap here, '/nic/status' also takes a ``wait``
+parameter of up to ``CHANGE_STATUS_MAX_WAIT`` seconds, and only answers once
+none of the hostnames' changes are pending or the time is up.
+"""
+
+import asyncio
+from base64 import b64decode
+from concurrent.futures import ThreadPoolExecutor
+import os
+import threading
+import time
+
+from urllib.parse import parse_qsl
+
+from route53_dyndns.addresses import format_addresses
+from route53_dyndns.app import create_app
+from route53_dyndns.changes import PENDING
+from route53_dyndns.metrics import registry
+from route53_dyndns import route53, views
+
+app = create_app()
+
+UPDATE_PATH = '/nic/update'
+STATUS_PATH = '/nic/status'
+METRICS_PATH = '/metrics'
+HEALTH_PATH = '/health'
+
+PENDING_PREFIX = PENDING + ' '
+
+_executor = None  # (pid, executor) since threads don't survive a fork
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None or _executor[0] != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor[0] != os.getpid():
+                _executor = (os.getpid(), ThreadPoolExecutor(
+                    max_workers=app.config['ASYNC_ROUTE53_THREADS']))
+
+    return _executor[1]
+
+
+def parse_basic_auth(header):
+    """ Parse an HTTP Basic Auth header into (username, password), or None """
+
+    if not header:
+        return None
+
+    scheme, _, value = header.partition(' ')
+
+    if scheme.lower() != 'basic':
+        return None
+
+    try:
+        credentials = b64decode(value, validate=True).decode('utf-8')
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+    username, _, password = credentials.partition(':')
+
+    return username, password
+
+
+async def _run(function, *args):
+    """ Run a blocking Route 53 call without blocking the event loop """
+
+    loop = asyncio.get_event_loop()
+
+    return await loop.run_in_executor(_get_executor(), function, *args)
+
+
+async def _wait(futures):
+    """ Wait for concurrent futures to complete without blocking """
+
+    pending = [asyncio.wrap_future(future) for future in futures
+               if not future.done()]
+
+    if pending:
+        await asyncio.wait(pending)
+
+    return futures
+
+
+async def nic_update(args, headers, remote_addr):
+    """ Update the dynamic DNS records for one or more hostnames
+
+    Returns a (body, status, headers) tuple, like the WSGI view.
+    """
+
+    profiler = views.profiler
+
+    with profiler.phase('auth'):
+        user, response = await _authenticate(headers, args.get('hostname'))
+
+    if response:
+        return response
+
+    username, hostname = user.username, args.get('hostname')
+
+    with profiler.phase('request'):
+        response, hostnames = views.check_update_request(
+            args, headers.get('user-agent'))
+
+    if response:
+        return views.log_refused(username, hostname, response), 200, {}
+
+    with profiler.phase('client'):
+        response, client = views.check_client_address(
+            remote_addr, headers.get('forwarded'),
+            headers.get('x-forwarded-for'))
+
+        if not response:
+            response, addresses = views.check_myip(args.get('myip', client))
+
+    if response:
+        return views.log_refused(username, hostname, response, client), 200, {}
+
+    started = time.time()
+
+    with profiler.phase('find'):
+        lookups = await _wait(await _run(
+            views.find_resource_records, user, hostnames, client,
+            [record_type for record_type, _ in addresses]))
+        # The update history may be in a shared cache, so checking it can
+        # block on a socket or a file lock
+        responses, updates = await _run(views.check_resource_records,
+                                        lookups, addresses)
+
+    results = []
+
+    if updates:
+        with profiler.phase('update'):
+            results = await _wait(await _run(
+                route53.update_resource_records,
+                [(resource_record, list(values))
+                 for _, resource_record, values in updates], None, username))
+            await _run(views.check_update_results, responses, updates,
+                       results, format_addresses(addresses))
+
+    with profiler.phase('log'):
+        views.log_decisions(username, hostnames, responses, client, lookups,
+                            updates, results, time.time() - started)
+
+    return '\n'.join(responses), 200, {}
+
+
+async def _authenticate(headers, hostname=None):
+    """ The User for a request's credentials, or the response to refuse it
+
+    Checking a password hash takes a while, so it's done off the event loop.
+    """
+
+    auth = parse_basic_auth(headers.get('authorization'))
+
+    if not auth:  # Auth is required at all times
+        return None, views.authenticate_response()
+
+    user = await _run(views.verify_auth, *auth)
+
+    if not user:
+        views.log_refused(auth[0], hostname, views.BAD_AUTH)
+        return None, views.authenticate_response(forbidden=True)
+
+    return user, None
+
+
+async def nic_status(args, headers):
+    """ Whether the latest changes to hostnames are live on Route 53
+
+    Returns a (body, status, headers) tuple, like the WSGI view.
+    """
+
+    user, response = await _authenticate(headers)
+
+    if response:
+        return response
+
+    tracker = route53.change_tracker
+
+    if tracker is None:
+        return 'Not Found', 404, {}
+
+    hostnames = views.parse_hostnames(args.get('hostname'))
+
+    if not hostnames:
+        return views.NO_HOST, 200, {}
+
+    if len(hostnames) > app.config['MAX_HOSTNAMES']:
+        return views.TOO_MANY_HOSTS, 200, {}
+
+    try:
+        wait = min(float(args.get('wait', 0)),
+                   app.config['CHANGE_STATUS_MAX_WAIT'])
+    except ValueError:
+        wait = 0
+
+    deadline = time.time() + wait
+
+    while True:
+        responses = await _run(views.change_statuses, user, hostnames)
+        pending = any(response.startswith(PENDING_PREFIX)
+                      for response in responses)
+
+        if not pending or time.time() >= deadline:
+            return '\n'.join(responses), 200, {}
+
+        # The tracker polls Route 53 in the background, this only reads it
+        await asyncio.sleep(min(tracker.min_interval,
+                                max(0, deadline - time.time())))
+
+
+async def _send_response(send, body, status, headers, newline=True):
+    # Always include a newline and use text/plain, like DynDnsFlask
+    body = (body + '\r\n' if newline else body).encode('utf-8')
+    headers = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+               for name, value in headers.items()]
+    headers += [(b'content-type', b'text/plain'),
+                (b'content-length', str(len(body)).encode('latin-1'))]
+
+    await send({'type': 'http.response.start', 'status': status,
+                'headers': headers})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def _without_body(send):
+    """ Wraps send to leave out the body, for HEAD requests """
+
+    async def send_head(message):
+        if message['type'] == 'http.response.body':
+            message = dict(message, body=b'')
+
+        await send(message)
+
+    return send_head
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def application(scope, receive, send):
+    """ ASGI application for the update endpoint """
+
+    if scope['type'] == 'lifespan':
+        return await _lifespan(receive, send)
+
+    if scope['type'] != 'http':
+        return
+
+    path = scope['path'].rstrip('/')
+
+    if path not in (UPDATE_PATH, STATUS_PATH, METRICS_PATH, HEALTH_PATH):
+        return await _send_response(send, 'Not Found', 404, {})
+
+    if scope['method'] not in ('GET', 'HEAD'):
+        return await _send_response(send, 'Method Not Allowed', 405,
+                                    {'Allow': 'GET'})
+
+    if scope['method'] == 'HEAD':
+        send = _without_body(send)
+
+    if path == HEALTH_PATH:
+        return await _send_response(send, 'OK', 200, {})
+
+    if path == METRICS_PATH:
+        return await _send_response(send, registry.render(), 200, {},
+                                    newline=False)
+
+    # Like request.args.get, the first value wins for repeated parameters
+    args = {}
+
+    for name, value in parse_qsl(scope['query_string'].decode('latin-1')):
+        args.setdefault(name, value)
+
+    headers = {}
+
+    for name, value in scope['headers']:
+        name, value = name.decode('latin-1').lower(), value.decode('latin-1')
+
+        if name in headers:
+            # Repeated headers are combined into a list, like Forwarded hops
+            value = headers[name] + ', ' + value
+
+        headers[name] = value
+    remote_addr = scope['client'][0] if scope.get('client') else None
+
+    views.start_background_tasks()
+
+    if path == STATUS_PATH:
+        try:
+            body, status, headers = await nic_status(args, headers)
+        except Exception:
+            body, status, headers = views.GENERAL_ERROR, 200, {}
+
+        return await _send_response(send, body, status, headers)
+
+    # Requests share the event loop's thread, so they can't be profiled
+    with views.REQUEST_SECONDS.time(), views.profiler.request(profile=False):
+        try:
+            body, status, headers = await nic_update(args, headers,
+                                                     remote_addr)
+        except Exception:
+            body, status, headers = views.GENERAL_ERROR, 200, {}
+
+    views.count_responses(body)
+
+    await _send_response(send, body, status, headers)
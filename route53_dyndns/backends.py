@@ -0,0 +1,488 @@
+""" Cache backends shared by the worker processes
+
+Each worker process otherwise keeps its own view of the records, so the same
+lookup is made once per worker. A backend holds JSON serializable values with
+a TTL, and there are three of them:
+
+* MemoryBackend, in this process only, which coalesces lookups by its threads
+* SharedMemoryBackend, a memory mapped file shared by the workers on a host
+* RedisBackend, a local Redis (or Redis compatible) server
+
+get_or_load() coalesces misses, so while one worker loads a value from AWS the
+others wanting the same key wait for its result instead of loading it too.
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import mmap
+import os
+import socket
+import struct
+import threading
+import time
+from urllib.parse import urlparse
+
+from route53_dyndns.metrics import registry
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+HITS = registry.counter('cache_hits_total',
+                        "Shared cache lookups which were hits", 'backend')
+MISSES = registry.counter('cache_misses_total',
+                          "Shared cache lookups which were misses", 'backend')
+COALESCED = registry.counter(
+    'cache_coalesced_total',
+    "Shared cache misses answered by another thread or worker's load",
+    'backend')
+ERRORS = registry.counter('cache_errors_total',
+                          "Shared cache operations which failed", 'backend')
+
+LOADING_SUFFIX = '\0loading'
+
+
+def _dumps(value):
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+
+def _hash(key):
+    digest = hashlib.sha1(key.encode('utf-8')).digest()
+
+    # Zero is an empty slot
+    return struct.unpack('=Q', digest[:8])[0] or 1
+
+
+class CacheBackend(object):
+    """ Base class for the backends
+
+    Subclasses implement lookup(), which returns a (found, value) pair, and
+    set(), add() and delete(). A backend which can't be reached is treated as
+    empty, so the service keeps working without it.
+    """
+
+    name = None
+
+    def __init__(self, load_timeout=10, poll_interval=0.05, stripes=64,
+                 clock=time.time, sleep=time.sleep):
+        self.load_timeout = load_timeout
+        self.poll_interval = poll_interval
+
+        self._clock = clock
+        self._sleep = sleep
+        self._stripes = stripes
+        self._reset_locks()
+
+        if hasattr(os, 'register_at_fork'):  # pragma: nb
+            os.register_at_fork(after_in_child=self._reset_locks)
+
+    def _reset_locks(self):
+        # Striped, so the threads loading different keys rarely wait on each
+        # other without keeping a lock per key
+        self._locks = [threading.Lock() for _ in range(self._stripes)]
+
+    def lookup(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl):
+        """ Set a key unless it is already set, returning whether it was """
+
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def _lookup(self, key):
+        try:
+            return self.lookup(key)
+        except Exception:
+            ERRORS.inc(self.name)
+            return False, None
+
+    def get(self, key, default=None):
+        """ Get a value, counting it as a hit or a miss """
+
+        found, value = self._lookup(key)
+
+        if found:
+            HITS.inc(self.name)
+            return value
+
+        MISSES.inc(self.name)
+
+        return default
+
+    def put(self, key, value, ttl):
+        """ Set a value, carrying on if the backend fails """
+
+        self._try(self.set, key, value, ttl)
+
+    def discard(self, key):
+        """ Delete a value, carrying on if the backend fails """
+
+        self._try(self.delete, key)
+
+    def get_or_load(self, key, load, ttl):
+        """ Get a value, calling `load` to get it on a miss
+
+        Only one thread or worker loads a key at a time, and the others wait
+        up to `load_timeout` seconds for its result before loading it
+        themselves. `load` can return None, which is cached too.
+        """
+
+        found, value = self._lookup(key)
+
+        if found:
+            HITS.inc(self.name)
+            return value
+
+        MISSES.inc(self.name)
+
+        with self._locks[_hash(key) % self._stripes]:
+            found, value = self._lookup(key)
+
+            if found:
+                COALESCED.inc(self.name)
+                return value
+
+            loading_key = key + LOADING_SUFFIX
+            deadline = self._clock() + self.load_timeout
+
+            while not self._try(self.add, loading_key, os.getpid(),
+                                self.load_timeout):
+                # Another worker is loading it, so wait for its result
+                self._sleep(self.poll_interval)
+                found, value = self._lookup(key)
+
+                if found:
+                    COALESCED.inc(self.name)
+                    return value
+
+                if self._clock() >= deadline:
+                    break
+
+            try:
+                value = load()
+                self._try(self.set, key, value, ttl)
+            finally:
+                self._try(self.delete, loading_key)
+
+            return value
+
+    def _try(self, method, *args):
+        try:
+            return method(*args)
+        except Exception:
+            ERRORS.inc(self.name)
+            return True  # Carry on without the backend
+
+
+class MemoryBackend(CacheBackend):
+    """ Bounded LRU of values in this process """
+
+    name = 'memory'
+
+    def __init__(self, max_size=100000, **kwargs):
+        super(MemoryBackend, self).__init__(**kwargs)
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._values = OrderedDict()  # key -> (expires, value)
+
+    def __len__(self):
+        return len(self._values)
+
+    def lookup(self, key):
+        with self._lock:
+            entry = self._values.get(key)
+
+            if entry is None or entry[0] <= self._clock():
+                return False, None
+
+            self._values.move_to_end(key)
+
+            return True, entry[1]
+
+    def _set(self, key, value, ttl):
+        self._values.pop(key, None)
+        self._values[key] = (self._clock() + ttl, value)
+
+        while len(self._values) > self.max_size:
+            self._values.popitem(last=False)
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._set(key, value, ttl)
+
+    def add(self, key, value, ttl):
+        with self._lock:
+            entry = self._values.get(key)
+
+            if entry is not None and entry[0] > self._clock():
+                return False
+
+            self._set(key, value, ttl)
+
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._values.pop(key, None)
+
+
+class SharedMemoryBackend(CacheBackend):
+    """ Values in a memory mapped file, shared by the workers on a host
+
+    Like SharedTokenBuckets, the file has a fixed number of `slots` and each
+    key hashes to a slot, replacing whatever was in it. Each slot holds up to
+    `slot_size` bytes of JSON, and larger values aren't cached. Put the file
+    on a memory backed filesystem, like '/dev/shm'.
+    """
+
+    name = 'shared'
+    HEADER = struct.Struct('=QdI')  # Key hash, expires, length
+
+    def __init__(self, path, slots=16384, slot_size=4096, **kwargs):
+        if fcntl is None:  # pragma: no cover
+            raise RuntimeError("The shared cache needs fcntl, not available "
+                               "on this platform")
+
+        super(SharedMemoryBackend, self).__init__(**kwargs)
+        self.path = path
+        self.slots = slots
+        self.slot_size = slot_size
+
+        self._stride = self.HEADER.size + slot_size
+        size = slots * self._stride
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()  # Record locks don't exclude threads
+
+        if hasattr(os, 'register_at_fork'):  # pragma: nb
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+    def _locked(self, key, update):
+        """ Call `update` with the slot's entry for a key, holding its lock """
+
+        key_hash = _hash(key)
+        offset = key_hash % self.slots * self._stride
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self._stride, offset)
+
+            try:
+                stored, expires, length = self.HEADER.unpack_from(self._map,
+                                                                  offset)
+                entry = None
+
+                if stored == key_hash and expires > self._clock():
+                    start = offset + self.HEADER.size
+                    stored_key, value = json.loads(
+                        self._map[start:start + length].decode('utf-8'))
+
+                    if stored_key == key:
+                        entry = (value,)
+
+                return update(entry, offset, key_hash)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self._stride, offset)
+
+    def _write(self, offset, key_hash, key, value, ttl):
+        data = _dumps([key, value])
+
+        if len(data) > self.slot_size:
+            # Too large to share, and the slot mustn't keep an old value
+            self.HEADER.pack_into(self._map, offset, 0, 0, 0)
+            return
+
+        start = offset + self.HEADER.size
+        self._map[start:start + len(data)] = data
+        self.HEADER.pack_into(self._map, offset, key_hash,
+                              self._clock() + ttl, len(data))
+
+    def lookup(self, key):
+        entry = self._locked(key, lambda entry, offset, key_hash: entry)
+
+        return (True, entry[0]) if entry else (False, None)
+
+    def set(self, key, value, ttl):
+        self._locked(key, lambda entry, offset, key_hash: self._write(
+            offset, key_hash, key, value, ttl))
+
+    def add(self, key, value, ttl):
+        def update(entry, offset, key_hash):
+            if entry:
+                return False
+
+            self._write(offset, key_hash, key, value, ttl)
+
+            return True
+
+        return self._locked(key, update)
+
+    def delete(self, key):
+        def update(entry, offset, key_hash):
+            if entry:
+                self.HEADER.pack_into(self._map, offset, 0, 0, 0)
+
+        self._locked(key, update)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class RedisError(Exception):
+    """ An error reply from the Redis server """
+
+
+class RedisClient(object):
+    """ Minimal client for the Redis protocol, with a connection per thread
+
+    Takes a 'redis://host:port/db' or 'unix:///path/to/socket?db=0' URL.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', timeout=1.0):
+        self.url = url
+        self.timeout = timeout
+
+        parsed = urlparse(url)
+        self._unix = parsed.scheme == 'unix'
+        self._address = parsed.path if self._unix else (
+            parsed.hostname or 'localhost', parsed.port or 6379)
+        self._db = int((parsed.query.partition('db=')[2] if self._unix
+                        else parsed.path.strip('/')) or 0)
+        self._local = threading.local()
+
+    def _connect(self):
+        if self._unix:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        sock.settimeout(self.timeout)
+        sock.connect(self._address)
+
+        connection = (sock, sock.makefile('rb'))
+
+        if self._db:
+            self._send(connection, 'SELECT', self._db)
+
+        return connection
+
+    def _connection(self):
+        local = self._local
+
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = None
+            local.pid = os.getpid()
+
+        if local.connection is None:
+            local.connection = self._connect()
+
+        return local.connection
+
+    @staticmethod
+    def _encode(args):
+        parts = [b'*%d\r\n' % len(args)]
+
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode('utf-8')
+
+            parts.append(b'$%d\r\n%s\r\n' % (len(arg), arg))
+
+        return b''.join(parts)
+
+    @classmethod
+    def _read_reply(cls, reader):
+        line = reader.readline()
+
+        if not line.endswith(b'\r\n'):
+            raise ConnectionError("Connection to Redis closed")
+
+        kind, rest = line[:1], line[1:-2]
+
+        if kind in (b'+', b':'):
+            return int(rest) if kind == b':' else rest.decode('utf-8')
+
+        if kind == b'-':
+            raise RedisError(rest.decode('utf-8'))
+
+        if kind == b'$':
+            length = int(rest)
+
+            if length < 0:
+                return None
+
+            data = reader.read(length + 2)
+
+            return data[:-2]
+
+        if kind == b'*':
+            return [cls._read_reply(reader) for _ in range(int(rest))]
+
+        raise RedisError("Unexpected reply {!r}".format(line))
+
+    def _send(self, connection, *args):
+        sock, reader = connection
+        sock.sendall(self._encode(args))
+
+        return self._read_reply(reader)
+
+    def execute(self, *args):
+        """ Run a command, returning its reply """
+
+        try:
+            return self._send(self._connection(), *args)
+        except RedisError:
+            raise
+        except Exception:
+            # Drop the connection, the next command makes a new one
+            self._local.connection = None
+            raise
+
+
+class RedisBackend(CacheBackend):
+    """ Values in a local Redis compatible server, shared by every worker """
+
+    name = 'redis'
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='route53:',
+                 client=None, **kwargs):
+        super(RedisBackend, self).__init__(**kwargs)
+        self.prefix = prefix
+        self.client = client or RedisClient(url)
+
+    def lookup(self, key):
+        data = self.client.execute('GET', self.prefix + key)
+
+        if data is None:
+            return False, None
+
+        return True, json.loads(data.decode('utf-8'))
+
+    def set(self, key, value, ttl):
+        self.client.execute('SET', self.prefix + key, _dumps(value), 'PX',
+                            max(1, int(ttl * 1000)))
+
+    def add(self, key, value, ttl):
+        return self.client.execute(
+            'SET', self.prefix + key, _dumps(value), 'PX',
+            max(1, int(ttl * 1000)), 'NX') is not None
+
+    def delete(self, key):
+        self.client.execute('DEL', self.prefix + key)
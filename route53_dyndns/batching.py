@@ -0,0 +1,174 @@
+""" Write-behind batching of record changes into shared Route 53 calls """
+
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+from route53_dyndns.cache import record_key
+from route53_dyndns.resilience import error_code
+
+# Limits on a single ChangeBatch, where an UPSERT counts each value twice
+MAX_BATCH_RECORDS = 1000
+MAX_BATCH_VALUE_CHARS = 32000
+
+# Errors for a bad change, after which the rest of its batch can still succeed
+INVALID_CHANGE_CODES = frozenset(['InvalidChangeBatch', 'InvalidInput'])
+
+
+def _is_invalid_change(error):
+    """ Check if an error, or the one it was raised from, is a bad change """
+
+    while error is not None:
+        if error_code(error) in INVALID_CHANGE_CODES:
+            return True
+
+        error = error.__cause__ or error.__context__
+
+    return False
+
+
+def _change_size(change):
+    values = [resource_record['Value'] for resource_record in
+              change['ResourceRecordSet'].get('ResourceRecords', ())]
+    multiplier = 2 if change['Action'] == 'UPSERT' else 1
+
+    return (max(len(values), 1) * multiplier,
+            sum(len(value) for value in values) * multiplier)
+
+
+def split_changes(changes, max_changes=MAX_BATCH_RECORDS, key=None):
+    """ Split changes into the fewest batches within the AWS limits
+
+    If given, `key` extracts the change from each item, like for `sorted`.
+    """
+
+    batch, records, chars = [], 0, 0
+
+    for change in changes:
+        change_records, change_chars = _change_size(
+            key(change) if key else change)
+
+        if batch and (len(batch) >= max_changes or
+                      records + change_records > MAX_BATCH_RECORDS or
+                      chars + change_chars > MAX_BATCH_VALUE_CHARS):
+            yield batch
+            batch, records, chars = [], 0, 0
+
+        batch.append(change)
+        records += change_records
+        chars += change_chars
+
+    if batch:
+        yield batch
+
+
+def _merge(pending, key, change, future):
+    # The last change for a record wins, and is moved to the end of the batch
+    futures = pending.pop(key, (None, []))[1]
+    futures.append(future)
+    pending[key] = (change, futures)
+
+
+class _PendingBatch(object):
+    def __init__(self):
+        self.changes = OrderedDict()  # record key -> (change, [futures])
+        self.timer = None
+
+
+class ChangeBatcher(object):
+    """ Collects changes per hosted zone and sends them together
+
+    Changes are held for up to `window` seconds, or until `max_changes` are
+    pending for the zone, and then sent as one ChangeBatch. Repeated changes to
+    the same record are merged so the last one wins. Each submitter gets a
+    future which resolves with the Route 53 response, or the error if the
+    change failed.
+    """
+
+    def __init__(self, send, window=0.05, max_changes=100):
+        self.send = send  # send(hosted_zone_id, changes, client)
+        self.window = window
+        self.max_changes = max_changes
+
+        self._lock = threading.Lock()
+        self._pending = {}  # (hosted zone ID, client) -> _PendingBatch
+
+    def __len__(self):
+        return len(self._pending)
+
+    def submit(self, hosted_zone_id, change, client):
+        """ Queue a change for the zone, returning a future for the result """
+
+        future = Future()
+        batch_key = (hosted_zone_id, client)
+        key = record_key(hosted_zone_id, change['ResourceRecordSet'])
+
+        with self._lock:
+            batch = self._pending.get(batch_key)
+
+            if batch is None:
+                batch = self._pending[batch_key] = _PendingBatch()
+                batch.timer = threading.Timer(self.window, self._flush,
+                                              (batch_key, batch))
+                batch.timer.daemon = True
+                batch.timer.start()
+
+            _merge(batch.changes, key, change, future)
+
+            full = len(batch.changes) >= self.max_changes
+
+        if full:
+            batch.timer.cancel()
+            self._flush(batch_key, batch)
+
+        return future
+
+    def _flush(self, batch_key, batch):
+        with self._lock:
+            if self._pending.get(batch_key) is not batch:
+                return  # Already flushed by a submitter or the timer
+
+            del self._pending[batch_key]
+
+        hosted_zone_id, client = batch_key
+        self._send_pending(hosted_zone_id, batch.changes, client)
+
+    def apply(self, hosted_zone_id, changes, client):
+        """ Send changes right away, returning a future for each change """
+
+        futures = [Future() for _ in changes]
+        pending = OrderedDict()
+
+        for change, future in zip(changes, futures):
+            key = record_key(hosted_zone_id, change['ResourceRecordSet'])
+            _merge(pending, key, change, future)
+
+        self._send_pending(hosted_zone_id, pending, client)
+
+        return futures
+
+    def _send_pending(self, hosted_zone_id, pending, client):
+        for chunk in split_changes(list(pending.values()), self.max_changes,
+                                   key=lambda item: item[0]):
+            self._send(hosted_zone_id, chunk, client)
+
+    def _send(self, hosted_zone_id, pending, client):
+        try:
+            response = self.send(hosted_zone_id,
+                                 [change for change, _ in pending], client)
+        except Exception as e:
+            if len(pending) > 1 and _is_invalid_change(e):
+                # A batch is applied atomically, so send each change on its own
+                # to keep one bad change from failing everybody else's. Other
+                # errors, like throttling, would only be made worse by that
+                for item in pending:
+                    self._send(hosted_zone_id, [item], client)
+                return
+
+            for _, futures in pending:
+                for future in futures:
+                    future.set_exception(e)
+        else:
+            for _, futures in pending:
+                for future in futures:
+                    future.set_result(response)
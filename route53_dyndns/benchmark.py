@@ -0,0 +1,332 @@
+""" Load test and benchmark harness for the update endpoint
+
+Runs the app against a local FakeRoute53 endpoint and drives '/nic/update' with
+simulated routers doing a mix of requests, then reports the throughput, latency
+percentiles and AWS calls per request. Results are written as JSON so runs can
+be compared between releases::
+
+    python -m route53_dyndns.benchmark --requests 10000 --output bench.json
+
+Config settings can be overridden to compare features, for example with
+``--set RECORD_CACHE_ENABLED=True``. Requests are made as a temporary user
+added through the credential store, so any configured users are left alone.
+"""
+
+from __future__ import division
+
+import ast
+from base64 import b64encode
+from collections import Counter
+import json
+from optparse import OptionParser
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from route53_dyndns import __version__
+from route53_dyndns.app import app, create_app, load_config
+from route53_dyndns.credentials import CredentialStore, hash_password
+from route53_dyndns.fakeroute53 import FakeRoute53, FakeRoute53Server
+
+# Fraction of requests for each kind of simulated router behaviour
+DEFAULT_MIX = (
+    ('nochg', 0.6),
+    ('change', 0.25),
+    ('badauth', 0.05),
+    ('multi', 0.1),
+)
+
+ZONES = (('ZBENCH1', 'bench.example.com'), ('ZBENCH2', 'bench.example.net'))
+HOSTS_PER_MULTI_REQUEST = 3
+BENCHMARK_USER = 'benchmark'
+
+_timer = time.perf_counter
+
+
+def percentile(values, fraction):
+    """ Nearest-rank percentile of an already sorted list """
+
+    if not values:
+        return None
+
+    index = int(round(fraction * len(values))) - 1
+    index = min(len(values) - 1, max(0, index))
+
+    return values[index]
+
+
+def _latency_summary(latencies):
+    latencies = sorted(latencies)
+
+    def ms(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'count': len(latencies),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 0.5)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'p999_ms': ms(percentile(latencies, 0.999)),
+        'max_ms': ms(latencies[-1]) if latencies else None,
+    }
+
+
+def _random_ip(rng):
+    return '203.0.%d.%d' % (rng.randint(0, 255), rng.randint(1, 254))
+
+
+class _Router(object):
+    def __init__(self, hostname, ip):
+        self.hostname = hostname
+        self.ip = ip
+
+
+class _Worker(threading.Thread):
+    """ Sends requests for its own routers, so each router's are in order """
+
+    def __init__(self, routers, count, mix, seed, password):
+        super(_Worker, self).__init__()
+        self.daemon = True
+        self.password = password
+        self.routers = routers
+        self.count = count
+        self.mix = mix
+        self.rng = random.Random(seed)
+        self.results = []  # (scenario, response code, latency)
+
+    def _choose(self):
+        point = self.rng.random() * sum(weight for _, weight in self.mix)
+
+        for scenario, weight in self.mix:
+            point -= weight
+
+            if point < 0:
+                break
+
+        return scenario
+
+    def _request(self, scenario):
+        router = self.rng.choice(self.routers)
+        password = self.password
+        routers = [router]
+
+        if scenario == 'change':
+            router.ip = _random_ip(self.rng)
+        elif scenario == 'badauth':
+            password += 'wrong'
+        elif scenario == 'multi':
+            routers = self.rng.sample(
+                self.routers, min(HOSTS_PER_MULTI_REQUEST, len(self.routers)))
+            ip = _random_ip(self.rng)
+
+            for router in routers:
+                router.ip = ip
+
+        credentials = '{}:{}'.format(BENCHMARK_USER, password)
+        headers = {
+            'Authorization': 'Basic ' + b64encode(
+                credentials.encode('utf-8')).decode('ascii'),
+            'User-Agent': 'route53_dyndns-benchmark/' + __version__,
+        }
+        query = {
+            'hostname': ','.join(router.hostname for router in routers),
+            'myip': router.ip,
+        }
+
+        return query, headers
+
+    def run(self):
+        client = app.test_client()
+
+        for _ in range(self.count):
+            scenario = self._choose()
+            query, headers = self._request(scenario)
+
+            start = _timer()
+            response = client.get('/nic/update', query_string=query,
+                                  headers=headers)
+            latency = _timer() - start
+
+            code = response.get_data(as_text=True).split()[0]
+            self.results.append((scenario, code, latency))
+
+
+def run_benchmark(requests=1000, concurrency=10, routers=100, latency=0.0,
+                  error_rate=0.0, throttle_rate=None, mix=DEFAULT_MIX,
+                  config=None, seed=None):
+    """ Run the benchmark and return the results as a dict
+
+    The `config` overrides are applied before the views and the Route 53
+    backend are imported, so the caches and clients they build from the config
+    use them too. Settings which are only read then have no effect if those
+    were already imported, so compare them with separate runs of the command.
+    """
+
+    rng = random.Random(seed)
+    fake = FakeRoute53(latency=latency, error_rate=error_rate,
+                       throttle_rate=throttle_rate)
+    plan = []
+
+    for zone_id, zone_name in ZONES:
+        records = []
+
+        for index in range(routers // len(ZONES)):
+            router = _Router('router%d.%s' % (index, zone_name),
+                             _random_ip(rng))
+            plan.append(router)
+            records.append({
+                'Name': router.hostname,
+                'Type': 'A',
+                'TTL': 60,
+                'ResourceRecords': [{'Value': router.ip}],
+            })
+
+        fake.add_zone(zone_id, zone_name, records)
+
+    rng.shuffle(plan)
+    password = b64encode(os.urandom(12)).decode('ascii')
+    directory = tempfile.mkdtemp()
+    credentials_file = os.path.join(directory, 'credentials')
+
+    with open(credentials_file, 'w') as output:
+        output.write('{}:{}:*\n'.format(BENCHMARK_USER,
+                                        hash_password(password)))
+
+    server = FakeRoute53Server(fake).start()
+    original_config = dict(load_config().config)
+
+    try:
+        app.config.update(config or {})
+        app.config['AWS_ENDPOINT_URL'] = server.endpoint_url
+
+        create_app()
+        from route53_dyndns import route53, views
+
+        # The benchmark user is added for the run, whatever users are set up
+        credential_store = views.credential_store
+        views.credential_store = CredentialStore(
+            credentials_file, cache_ttl=app.config['CREDENTIALS_CACHE_TTL'])
+        route53.hosted_zones.clear()
+        route53.record_cache.clear()
+
+        # Each worker gets its own routers and a share of the requests
+        workers = [
+            _Worker(plan[index::concurrency] or plan,
+                    requests // concurrency + (index < requests % concurrency),
+                    mix, rng.random(), password)
+            for index in range(concurrency)]
+
+        try:
+            start = _timer()
+
+            for worker in workers:
+                worker.start()
+
+            for worker in workers:
+                worker.join()
+
+            duration = _timer() - start
+        finally:
+            views.credential_store = credential_store
+            route53.hosted_zones.clear()
+            route53.record_cache.clear()
+    finally:
+        app.config.clear()
+        app.config.update(original_config)
+        server.stop()
+        shutil.rmtree(directory)
+
+    results = [result for worker in workers for result in worker.results]
+    total = len(results)
+    aws_calls = sum(fake.calls.values())
+
+    return {
+        'version': __version__,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'parameters': {
+            'requests': requests,
+            'concurrency': concurrency,
+            'routers': len(plan),
+            'latency': latency,
+            'error_rate': error_rate,
+            'throttle_rate': throttle_rate,
+            'mix': dict(mix),
+            'config': config or {},
+            'seed': seed,
+        },
+        'duration_s': round(duration, 3),
+        'requests_per_second': (round(total / duration, 1)
+                                if duration else None),
+        'latency': _latency_summary([latency for _, _, latency in results]),
+        'responses': dict(Counter(code for _, code, _ in results)),
+        'scenarios': dict(
+            (scenario, _latency_summary([latency for name, _, latency
+                                         in results if name == scenario]))
+            for scenario, _ in mix),
+        'aws_calls': dict(fake.calls),
+        'aws_calls_per_request': round(aws_calls / total, 3) if total else 0,
+    }
+
+
+def _parse_setting(option, opt, value, parser):
+    name, _, value = value.partition('=')
+
+    try:
+        value = ast.literal_eval(value)
+    except (SyntaxError, ValueError):
+        pass  # Use it as a plain string
+
+    parser.values.config[name] = value
+
+
+def main(args=sys.argv[1:]):
+    """ Entry point for running the benchmark from the command-line """
+
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("-n", "--requests", type="int", default=1000,
+                      help="Total number of requests [%default]")
+    parser.add_option("-c", "--concurrency", type="int", default=10,
+                      help="Number of concurrent clients [%default]")
+    parser.add_option("-r", "--routers", type="int", default=100,
+                      help="Number of simulated routers [%default]")
+    parser.add_option("--latency", type="float", default=0.0,
+                      help="Seconds added to each Route 53 call [%default]")
+    parser.add_option("--error-rate", type="float", default=0.0,
+                      help="Fraction of Route 53 calls which fail [%default]")
+    parser.add_option("--throttle-rate", type="float", default=None,
+                      help="Route 53 calls per second before throttling")
+    parser.add_option("--set", action="callback", callback=_parse_setting,
+                      type="string", metavar="KEY=VALUE",
+                      help="Override a config setting, can be repeated")
+    parser.add_option("--seed", type="int", default=None,
+                      help="Seed for a repeatable mix of requests")
+    parser.add_option("-o", "--output", default="benchmark.json",
+                      help="File to write the JSON results to [%default]")
+    parser.set_defaults(config={})
+
+    (options, _) = parser.parse_args(args)
+
+    results = run_benchmark(
+        requests=options.requests, concurrency=options.concurrency,
+        routers=options.routers, latency=options.latency,
+        error_rate=options.error_rate, throttle_rate=options.throttle_rate,
+        config=options.config, seed=options.seed)
+
+    with open(options.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+    latency = results['latency']
+    print("{} requests in {}s: {} req/s, p50 {}ms, p99 {}ms, p999 {}ms, "
+          "{} AWS calls/request".format(
+              latency['count'], results['duration_s'],
+              results['requests_per_second'], latency['p50_ms'],
+              latency['p99_ms'], latency['p999_ms'],
+              results['aws_calls_per_request']))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
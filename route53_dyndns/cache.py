@@ -0,0 +1,263 @@
+""" In-process cache of Route 53 resource records """
+
+from collections import OrderedDict
+import threading
+import time
+
+
+def normalize_name(name):
+    """ Normalize a DNS name so 'Foo.com.' and 'foo.com' are the same key """
+
+    return name.rstrip('.').lower()
+
+
+def record_key(zone_id, resource_record):
+    """ Cache key for a resource record in a hosted zone """
+
+    return (zone_id, normalize_name(resource_record['Name']),
+            resource_record['Type'], resource_record.get('SetIdentifier'))
+
+
+class RecordCache(object):
+    """ Bounded LRU cache of resource records with a TTL
+
+    Records are keyed by (zone, name, type, set identifier). A zone can be
+    loaded in full, after which a lookup for a name which isn't in the cache is
+    a definitive answer that no such record exists, until the TTL runs out or
+    one of the zone's records has to be evicted to respect the size limit. A
+    zone with more records than the cache can hold isn't loaded at all, but
+    remembered as too large until the TTL runs out.
+    """
+
+    def __init__(self, ttl=300, max_size=10000, clock=time.time):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._records = OrderedDict()  # key -> (expires, record)
+        self._names = {}  # (zone, name) -> set of keys
+        self._zones = {}  # zone -> expiry of the full listing
+        self._too_large = {}  # zone -> when to try listing it again
+        self._zone_locks = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def _add(self, key, record, expires):
+        self._records[key] = (expires, record)
+        self._records.move_to_end(key)
+        self._names.setdefault(key[:2], set()).add(key)
+
+        while len(self._records) > self.max_size:
+            evicted, _ = self._records.popitem(last=False)
+            self._discard_name(evicted)
+
+            # The zone listing is no longer complete, so a miss for the zone
+            # doesn't mean the record doesn't exist anymore
+            self._zones.pop(evicted[0], None)
+
+    def _discard_name(self, key):
+        keys = self._names.get(key[:2])
+
+        if keys is not None:
+            keys.discard(key)
+
+            if not keys:
+                del self._names[key[:2]]
+
+    def _fresh(self, expires, now, max_age):
+        return expires > now and (
+            max_age is None or expires - self.ttl + max_age > now)
+
+    def lookup(self, zone_id, name, max_age=None):
+        """ Find the cached records for a name without counting hits/misses
+
+        Returns a (possibly empty) list of records if the answer is known, or
+        None if the records need to be fetched from Route 53. With `max_age`,
+        records cached longer ago than that many seconds are treated as
+        expired.
+        """
+
+        now = self._clock()
+        name = normalize_name(name)
+
+        with self._lock:
+            records = []
+            keys = self._names.get((zone_id, name), ())
+
+            for key in sorted(keys, key=lambda k: (k[2], k[3] or '')):
+                expires, record = self._records[key]
+
+                if not self._fresh(expires, now, max_age):
+                    return None
+
+                self._records.move_to_end(key)
+                records.append(record)
+
+            if records:
+                return records
+
+            if self._fresh(self._zones.get(zone_id, 0), now, max_age):
+                return []  # Zone is complete and fresh, so there's no record
+
+            return None
+
+    def get(self, zone_id, name, max_age=None):
+        """ Like lookup, but counts the result as a cache hit or miss """
+
+        records = self.lookup(zone_id, name, max_age)
+
+        with self._lock:
+            if records is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        return records
+
+    def put(self, zone_id, resource_record):
+        """ Add or replace a single record """
+
+        key = record_key(zone_id, resource_record)
+
+        with self._lock:
+            self._add(key, resource_record, self._clock() + self.ttl)
+
+    def discard(self, zone_id, resource_record):
+        """ Remove a single record, which may no longer be what it was """
+
+        key = record_key(zone_id, resource_record)
+
+        with self._lock:
+            if self._records.pop(key, None) is not None:
+                self._discard_name(key)
+
+            # Without it the zone listing is no longer complete
+            self._zones.pop(zone_id, None)
+
+    def is_loaded(self, zone_id):
+        """ Check if a complete, unexpired listing of the zone is cached """
+
+        return self._zones.get(zone_id, 0) > self._clock()
+
+    def is_too_large(self, zone_id):
+        """ Check if the zone was recently found not to fit in the cache """
+
+        return self._too_large.get(zone_id, 0) > self._clock()
+
+    def load_zone(self, zone_id, resource_records, listed_at=None):
+        """ Replace the cached records for a zone with a complete listing
+
+        The listing expires a TTL after `listed_at`, or now, and one which has
+        already expired isn't loaded. If the listing doesn't fit in the cache,
+        the zone's records are left as they are and it is marked as too large
+        instead, rather than evicting its own records and those of every other
+        zone.
+        """
+
+        now = self._clock()
+        expires = (now if listed_at is None else listed_at) + self.ttl
+        resource_records = list(resource_records)
+
+        if expires <= now:
+            return
+
+        with self._lock:
+            if len(resource_records) > self.max_size:
+                self._too_large[zone_id] = expires
+                return
+
+            self._too_large.pop(zone_id, None)
+
+            for key in [k for k in self._records if k[0] == zone_id]:
+                del self._records[key]
+                self._discard_name(key)
+
+            self._zones[zone_id] = expires
+
+            for resource_record in resource_records:
+                self._add(record_key(zone_id, resource_record),
+                          resource_record, expires)
+
+    def zones(self):
+        """ IDs of the zones which have been loaded in full """
+
+        with self._lock:
+            return list(self._zones)
+
+    def refresh_zone(self, zone_id, resource_records, since=None):
+        """ Bring a loaded zone up-to-date with a new listing of it
+
+        Only the records which differ from the cached ones are replaced or
+        removed, and the listing is fresh for another TTL. Records cached
+        after `since`, when the listing was started, are newer than it and
+        kept. Returns the keys of the records which changed.
+        """
+
+        expires = self._clock() + self.ttl
+        listed = OrderedDict((record_key(zone_id, resource_record),
+                              resource_record)
+                             for resource_record in resource_records)
+        changed = []
+
+        with self._lock:
+            self._zones[zone_id] = expires
+
+            for key in [k for k in self._records if k[0] == zone_id]:
+                cached_expires, record = self._records[key]
+
+                if since is not None and cached_expires - self.ttl > since:
+                    listed.pop(key, None)  # Changed while it was listed
+                elif key not in listed:
+                    del self._records[key]
+                    self._discard_name(key)
+                    changed.append(key)
+                elif listed[key] != record:
+                    changed.append(key)
+
+            for key, resource_record in listed.items():
+                if key not in self._records:
+                    changed.append(key)
+
+                self._add(key, resource_record, expires)
+
+        return changed
+
+    def loaded_zones(self):
+        """ Complete, unexpired zone listings as {zone ID: [records]} """
+
+        now = self._clock()
+
+        with self._lock:
+            zones = dict((zone_id, []) for zone_id, expires
+                         in self._zones.items() if expires > now)
+
+            for key, (_, record) in self._records.items():
+                if key[0] in zones:
+                    zones[key[0]].append(record)
+
+        return zones
+
+    def zone_lock(self, zone_id):
+        """ Lock which serializes loading a zone, so it is only listed once """
+
+        with self._lock:
+            return self._zone_locks.setdefault(zone_id, threading.Lock())
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+            self._names.clear()
+            self._zones.clear()
+            self._too_large.clear()
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._records),
+            'zones': len(self._zones),
+        }
@@ -0,0 +1,189 @@
+""" Tracking of Route 53 changes until they are live on every name server
+
+Route 53 answers a change as PENDING, and it becomes INSYNC once every Route 53
+name server has it, which usually takes tens of seconds. Rather than each
+request waiting on its change, the IDs of pending changes are kept in a SQLite
+database shared by all of the worker processes, and a background thread polls
+them. Every record in a ChangeBatch shares the batch's change, so a batch is
+polled once however many records it holds.
+
+Each change is first polled `min_interval` seconds after it was made, and the
+interval doubles with each poll up to `max_interval`, since a change which
+isn't in sync quickly is usually slow to sync.
+"""
+
+import os
+import threading
+import time
+
+from route53_dyndns.cache import normalize_name
+from route53_dyndns.metrics import registry
+from route53_dyndns.storage import ThreadConnections
+
+PENDING = 'PENDING'
+INSYNC = 'INSYNC'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS changes (
+    change_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    submitted REAL NOT NULL,
+    next_poll REAL NOT NULL,
+    interval REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_next_poll ON changes (next_poll);
+CREATE TABLE IF NOT EXISTS records (
+    name TEXT PRIMARY KEY,
+    change_id TEXT NOT NULL
+);
+'''
+
+POLLS = registry.counter('change_polls_total',
+                         "Route 53 changes polled for their status")
+POLL_ERRORS = registry.counter('change_poll_errors_total',
+                               "Polls of Route 53 changes which failed")
+TRACK_ERRORS = registry.counter('change_track_errors_total',
+                                "Route 53 changes which couldn't be tracked")
+
+
+def change_id(change_info):
+    """ The ID of a change from its ChangeInfo, without the '/change/' """
+
+    return change_info['Id'].rsplit('/', 1)[-1]
+
+
+class ChangeTracker(object):
+    """ Pending Route 53 changes and the records each one changed
+
+    `get_change` is called with a change ID and returns its status. Changes
+    are forgotten `max_age` seconds after they were made, along with their
+    records, whatever their status.
+    """
+
+    def __init__(self, path, get_change, min_interval=2, max_interval=30,
+                 max_age=3600, poll_limit=100, clock=time.time):
+        self.path = path
+        self.get_change = get_change
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_age = max_age
+        self.poll_limit = poll_limit
+
+        self._clock = clock
+        self._connections = ThreadConnections(path, SCHEMA)
+        self._started = None  # PID the poll thread was started in
+
+    def track(self, change_info, names):
+        """ Track a change, as the latest change to each of the names """
+
+        now = self._clock()
+        change = change_id(change_info)
+        status = change_info.get('Status', PENDING)
+
+        with self._connections.get() as connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO changes VALUES (?, ?, ?, ?, ?)',
+                (change, status, now, now + self.min_interval,
+                 self.min_interval))
+            connection.executemany(
+                'INSERT OR REPLACE INTO records VALUES (?, ?)',
+                [(normalize_name(name), change) for name in names])
+
+    def status(self, names):
+        """ The (status, change ID) of the latest change to each name
+
+        Names without a tracked change get None.
+        """
+
+        connection = self._connections.get()
+        statuses = []
+
+        for name in names:
+            row = connection.execute(
+                'SELECT changes.status, changes.change_id FROM records '
+                'JOIN changes USING (change_id) WHERE records.name = ?',
+                (normalize_name(name),)).fetchone()
+            statuses.append(tuple(row) if row else None)
+
+        return statuses
+
+    def pending(self):
+        """ Number of changes which aren't in sync yet """
+
+        return self._connections.get().execute(
+            'SELECT COUNT(*) FROM changes WHERE status = ?',
+            (PENDING,)).fetchone()[0]
+
+    def _claim(self, now):
+        connection = self._connections.get()
+
+        with connection:
+            # Take the write lock first, so each change is only polled by one
+            # of the worker processes
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT change_id, interval FROM changes '
+                'WHERE status = ? AND next_poll <= ? '
+                'ORDER BY next_poll LIMIT ?',
+                (PENDING, now, self.poll_limit)).fetchall()
+            connection.executemany(
+                'UPDATE changes SET next_poll = ?, interval = ? '
+                'WHERE change_id = ?',
+                [(now + interval, min(self.max_interval, interval * 2),
+                  change) for change, interval in rows])
+
+        return [change for change, _ in rows]
+
+    def expire(self):
+        """ Forget changes older than the maximum age """
+
+        with self._connections.get() as connection:
+            connection.execute('DELETE FROM changes WHERE submitted < ?',
+                               (self._clock() - self.max_age,))
+            connection.execute(
+                'DELETE FROM records WHERE change_id NOT IN '
+                '(SELECT change_id FROM changes)')
+
+    def poll_once(self):
+        """ Poll the changes which are due, returning how many were polled """
+
+        changes = self._claim(self._clock())
+
+        for change in changes:
+            POLLS.inc()
+
+            try:
+                status = self.get_change(change)
+            except Exception:
+                POLL_ERRORS.inc()
+                continue  # Polled again at its next interval
+
+            if status != PENDING:
+                with self._connections.get() as connection:
+                    connection.execute(
+                        'UPDATE changes SET status = ? WHERE change_id = ?',
+                        (status, change))
+
+        return len(changes)
+
+    def _poll_forever(self):
+        while True:
+            try:
+                self.expire()
+                self.poll_once()
+            except Exception:
+                pass  # The database is unavailable, try again later
+
+            time.sleep(self.min_interval / 2.0)
+
+    def start(self):
+        """ Start polling pending changes in this process """
+
+        if self._started == os.getpid():
+            return
+
+        self._started = os.getpid()
+
+        thread = threading.Thread(target=self._poll_forever)
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,140 @@
+""" Process-wide management of the shared Route 53 client """
+
+import os
+import threading
+
+from route53_dyndns.app import load_config
+from route53_dyndns.metrics import registry
+
+app = load_config()
+
+THROTTLING_ERRORS = ('Throttling', 'ThrottlingException',
+                     'PriorRequestNotComplete', 'RequestLimitExceeded')
+
+CALLS = registry.counter('route53_calls_total',
+                         "Route 53 API calls by operation", 'operation')
+ERRORS = registry.counter('route53_errors_total',
+                          "Failed Route 53 API calls by error code", 'code')
+RETRIES = registry.counter('route53_retries_total',
+                           "Route 53 API calls retried by botocore",
+                           'operation')
+THROTTLES = registry.counter('route53_throttles_total',
+                             "Route 53 API calls which were throttled",
+                             'operation')
+POOL_SIZE = registry.gauge('route53_pool_connections',
+                           "Size of the Route 53 connection pool",
+                           lambda: app.config['AWS_MAX_POOL_CONNECTIONS'])
+
+
+def _count_call(model, parsed, **kwargs):
+    CALLS.inc(model.name)
+
+    retries = parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+
+    if retries:
+        RETRIES.inc(model.name, retries)
+
+    if 'Error' in parsed:
+        ERRORS.inc(parsed['Error'].get('Code'))
+
+
+def _count_throttle(response, operation, **kwargs):
+    # Called for every attempt, before botocore decides whether to retry
+    if response and response[1].get('Error', {}).get('Code') in (
+            THROTTLING_ERRORS):
+        THROTTLES.inc(operation.name)
+
+
+class ClientManager(object):
+    """ Builds a single Route 53 client and shares it between threads
+
+    Creating a client is expensive since botocore has to load the service model
+    and every new client opens its own connections. The client is built once,
+    rebuilt if the credentials or connection settings in the config change, and
+    dropped in forked children so pooled connections are never shared between
+    processes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entry = None  # (settings, client) so it can be read atomically
+        self._pid = os.getpid()
+
+        if hasattr(os, 'register_at_fork'):  # pragma: nb
+            os.register_at_fork(after_in_child=self.reset)
+
+    def _settings(self):
+        config = app.config
+
+        return (
+            config['AWS_ACCESS_KEY'],
+            config['AWS_SECRET_ACCESS_KEY'],
+            config.get('AWS_MAX_POOL_CONNECTIONS', 10),
+            config.get('AWS_TCP_KEEPALIVE', True),
+            config.get('AWS_ENDPOINT_URL'),
+            config.get('AWS_MAX_ATTEMPTS', 1),
+        )
+
+    def _build_client(self, access_key, secret_key, pool_size, keepalive,
+                      endpoint_url, max_attempts):
+        # Imported here since loading boto3 takes longer than starting the
+        # rest of the service, and health checks don't need it
+        import boto3
+        from botocore.config import Config
+
+        # Retries are left to route53_dyndns.resilience by default, so they
+        # aren't multiplied by botocore's own retries
+        options = {
+            'max_pool_connections': pool_size,
+            'retries': {'total_max_attempts': max_attempts},
+        }
+
+        if keepalive:
+            options['tcp_keepalive'] = True
+
+        # Route 53 is a global service, signed for us-east-1
+        client = boto3.client('route53', aws_access_key_id=access_key,
+                              aws_secret_access_key=secret_key,
+                              region_name='us-east-1',
+                              endpoint_url=endpoint_url,
+                              config=Config(**options))
+
+        events = client.meta.events
+        events.register('after-call.route53', _count_call)
+        events.register_first('needs-retry.route53', _count_throttle)
+
+        return client
+
+    def get_client(self):
+        """ Get the shared client, building it if needed """
+
+        settings = self._settings()
+        entry = self._entry
+
+        if entry and entry[0] == settings and self._pid == os.getpid():
+            return entry[1]
+
+        with self._lock:
+            if self._pid != os.getpid():  # Forked without the at-fork hook
+                self._entry = None
+                self._pid = os.getpid()
+
+            entry = self._entry
+
+            if not entry or entry[0] != settings:
+                entry = (settings, self._build_client(*settings))
+                self._entry = entry
+
+            return entry[1]
+
+    def reset(self):
+        """ Drop the current client, the next caller will build a new one """
+
+        # Called in forked children, where the old lock may be held by a thread
+        # which no longer exists, so don't try to acquire it
+        self._lock = threading.Lock()
+        self._entry = None
+        self._pid = os.getpid()
+
+
+client_manager = ClientManager()
@@ -3,22 +3,117 @@
 """ Command-line functionality for route53_dyndns """
 
 import logging
+import multiprocessing
 import sys
 
 from optparse import OptionParser
 
-from route53_dyndns import __version__, app
+from route53_dyndns import __version__
+from route53_dyndns.app import create_app
+from route53_dyndns.logs import JsonFormatter, QueueingHandler
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:  # pragma: no cover
+    BaseApplication = object  # Only needed to serve in production
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BIND = '0.0.0.0:5000'
+ASGI_WORKER_CLASS = 'uvicorn.workers.UvicornWorker'
+
+
+class Server(BaseApplication):
+    """ Production server, with a master process managing the workers
+
+    The master reloads the workers on SIGHUP and shuts down gracefully on
+    SIGTERM, letting in-flight requests finish. `load_application` is called
+    to build the app, in the master when preloading and otherwise in each
+    worker after it's forked, so reloaded workers pick up config changes.
+    """
+
+    def __init__(self, load_application, options=None):
+        if BaseApplication is object:
+            raise RuntimeError("gunicorn is required to serve in production, "
+                               "install it or use --debug")
+
+        self.load_application = load_application
+        self.options = options or {}
+        super(Server, self).__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            self.cfg.set(key, value)
+
+        self.cfg.set('post_fork', post_fork)
+
+    def load(self):
+        application = self.load_application()
+
+        if self.cfg.preload_app:
+            # Loads the botocore service model in the master, so each worker
+            # only has to build a client from the already loaded model
+            from route53_dyndns.route53 import get_client
+            get_client()
+
+        return application
+
+
+def post_fork(server, worker):
+    """ Make sure no worker shares the master's Route 53 connections
+
+    The background tasks are started straight away, so queued changes are
+    applied without waiting for the first request.
+    """
+
+    from route53_dyndns.client import client_manager
+    client_manager.reset()
+
+    from route53_dyndns.views import start_background_tasks
+    start_background_tasks()
+
+
+def serve(options):
+    """ Serve the app with the production server """
+
+    if options.asgi:
+        load_application = _load_asgi_application
+    else:
+        load_application = create_app
+
+    server_options = {
+        'bind': options.bind,
+        'workers': options.workers,
+        'threads': options.threads,
+        'backlog': options.backlog,
+        'graceful_timeout': options.graceful_timeout,
+        'preload_app': options.preload,
+    }
+
+    if options.asgi:
+        server_options['worker_class'] = ASGI_WORKER_CLASS
+
+    Server(load_application, server_options).run()
+
+
+def _load_asgi_application():
+    from route53_dyndns.asgi import application
+
+    return application
+
 
 def configure_logging(level=logging.INFO, logger=None):
-    """ Configure logging for the command-line """
+    """ Configure logging for the command-line
+
+    Records are written to stdout as JSON lines, from a background thread so
+    that logging never waits on stdout.
+    """
 
     if logger is None:  # pragma: no cover
         logger = logging.getLogger()
 
-    handler = logging.StreamHandler(sys.stdout)
+    handler = QueueingHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter())
 
     logger.addHandler(handler)
     logger.setLevel(level)
@@ -27,7 +122,15 @@ def configure_logging(level=logging.INFO, logger=None):
 def main(args=sys.argv[1:], parser=None):
     """ Main entry point for the route53_dyndns command-line script """
 
-    usage = "%prog [options] [args]\n\n"
+    if args[:1] == ['sync']:
+        # Only loaded when needed, so --help and --version work without config
+        from route53_dyndns import sync
+
+        configure_logging()
+        sys.exit(sync.main(args[1:]))
+
+    usage = "%prog [options] [args]\n"
+    usage += "       %prog sync [options] FILE\n\n"
     version = "%prog " + __version__
 
     usage += "%prog is the HTTP dynamic DNS server for Route53"
@@ -41,6 +144,26 @@ def main(args=sys.argv[1:], parser=None):
                       help="Show help and exit")
     parser.add_option("-V", "--version", dest="version", action="store_true",
                       help="Show version and exit")
+    parser.add_option("-b", "--bind", dest="bind", default=DEFAULT_BIND,
+                      help="Address and port to listen on [%default]")
+    parser.add_option("-w", "--workers", dest="workers", type="int",
+                      default=multiprocessing.cpu_count() * 2 + 1,
+                      help="Number of worker processes [%default]")
+    parser.add_option("-t", "--threads", dest="threads", type="int",
+                      default=4, help="Threads per worker process [%default]")
+    parser.add_option("--backlog", dest="backlog", type="int", default=2048,
+                      help="Maximum number of pending connections [%default]")
+    parser.add_option("--graceful-timeout", dest="graceful_timeout",
+                      type="int", default=30,
+                      help="Seconds to let requests finish on shutdown "
+                           "[%default]")
+    parser.add_option("--preload", dest="preload", action="store_true",
+                      help="Load the app and Route 53 client before forking "
+                           "the workers")
+    parser.add_option("--asgi", dest="asgi", action="store_true",
+                      help="Serve the asyncio app with uvicorn workers")
+    parser.add_option("--debug", dest="debug", action="store_true",
+                      help="Run the single process debug server instead")
 
     (options, parsed_args) = parser.parse_args(args)
 
@@ -55,4 +178,7 @@ def main(args=sys.argv[1:], parser=None):
 
     configure_logging()
 
-    app.run(debug=True)
+    if options.debug:
+        create_app().run(debug=True)
+    else:
+        serve(options)
@@ -0,0 +1,234 @@
+""" Multi-user credential store with hashed passwords
+
+Credentials are read from a file with one user per line, like htpasswd::
+
+    # username:password hash:hostnames
+    alice:pbkdf2_sha256$260000$...$...:home.example.com,*.lab.example.com
+    router:pbkdf2_sha256$260000$...$...:*
+
+Each user may only update the hostnames listed for them, where '*.' matches
+any subdomain and a lone '*' matches every hostname. Password hashes are made
+with ``python -m route53_dyndns.credentials``.
+"""
+
+from __future__ import unicode_literals
+
+import base64
+from collections import OrderedDict
+import getpass
+import hashlib
+import hmac
+import os
+import threading
+import time
+
+from route53_dyndns.cache import normalize_name
+
+ALGORITHM = 'pbkdf2_sha256'
+DEFAULT_ITERATIONS = 260000
+
+
+def _b64(value):
+    return base64.b64encode(value).decode('ascii')
+
+
+def hash_password(password, salt=None, iterations=DEFAULT_ITERATIONS):
+    """ Hash a password with PBKDF2, returning the encoded hash """
+
+    salt = salt or _b64(os.urandom(12))
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'),
+                                 salt.encode('ascii'), iterations)
+
+    return '{}${}${}${}'.format(ALGORITHM, iterations, salt, _b64(digest))
+
+
+def check_password(password, encoded):
+    """ Check a password against an encoded hash in constant time """
+
+    try:
+        algorithm, iterations, salt, _ = encoded.split('$')
+        iterations = int(iterations)
+    except ValueError:
+        return False
+
+    if algorithm != ALGORITHM:
+        return False
+
+    expected = hash_password(password, salt, iterations)
+
+    return hmac.compare_digest(expected.encode('ascii'),
+                               encoded.encode('ascii'))
+
+
+class User(object):
+    """ A user and the hostnames they may update """
+
+    def __init__(self, username, password_hash, hostnames=('*',)):
+        self.username = username
+        self.password_hash = password_hash
+        self.hostnames = set()
+        self.domains = []  # Suffixes from '*.' wildcards, with leading dot
+        self.any_hostname = False
+
+        for hostname in hostnames:
+            if hostname == '*':
+                self.any_hostname = True
+            elif hostname.startswith('*.'):
+                self.domains.append('.' + normalize_name(hostname[2:]))
+            else:
+                self.hostnames.add(normalize_name(hostname))
+
+        self.domains = tuple(self.domains)
+
+    def may_update(self, hostname):
+        """ Check whether the user may update a hostname """
+
+        if self.any_hostname:
+            return True
+
+        hostname = normalize_name(hostname)
+
+        return hostname in self.hostnames or hostname.endswith(self.domains)
+
+
+def parse_credentials(lines):
+    """ Parse credential file lines into a dict of username -> User """
+
+    users = {}
+
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+
+        if not line or line.startswith('#'):
+            continue
+
+        fields = line.split(':')
+
+        if len(fields) != 3 or not all(fields):
+            raise ValueError(
+                "Line {} should be 'username:password hash:hostnames'".format(
+                    number))
+
+        username, password_hash, hostnames = fields
+        users[username] = User(username, password_hash, [
+            hostname.strip() for hostname in hostnames.split(',')
+            if hostname.strip()])
+
+    return users
+
+
+class CredentialStore(object):
+    """ Credentials from a file, reloaded when the file changes
+
+    Hashing a password is deliberately slow, so successful verifications are
+    remembered for `cache_ttl` seconds and routers which check in regularly
+    only pay for the hash once. The cache holds a keyed digest of the
+    password, never the password itself, and is bounded to `cache_max_size`
+    users. The file is checked for changes at most every `reload_interval`
+    seconds.
+    """
+
+    def __init__(self, path, cache_ttl=60, cache_max_size=10000,
+                 reload_interval=5, clock=time.time):
+        self.path = path
+        self.cache_ttl = cache_ttl
+        self.cache_max_size = cache_max_size
+        self.reload_interval = reload_interval
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._users = {}
+        self._version = None  # (mtime, size) of the loaded file
+        self._checked = None
+        self._cache = OrderedDict()  # username -> (expires, digest, user)
+        self._key = os.urandom(32)
+        self._dummy_hash = None
+
+        self.reload()
+
+    def __len__(self):
+        return len(self._users)
+
+    def reload(self):
+        """ Load the file if it has changed since it was last loaded """
+
+        stat = os.stat(self.path)
+        version = (stat.st_mtime, stat.st_size)
+
+        if version != self._version:
+            with open(self.path) as credentials_file:
+                users = parse_credentials(credentials_file)
+
+            with self._lock:
+                self._users = users
+                self._version = version
+                self._cache.clear()
+
+        self._checked = self._clock()
+
+    def _maybe_reload(self):
+        if self._clock() - self._checked < self.reload_interval:
+            return
+
+        try:
+            self.reload()
+        except (IOError, OSError, ValueError):
+            # Keep the current users rather than locking everyone out while
+            # the file is being edited, and try again next interval
+            self._checked = self._clock()
+
+    def _digest(self, password):
+        return hmac.new(self._key, password.encode('utf-8'),
+                        hashlib.sha256).digest()
+
+    def verify(self, username, password):
+        """ Verify a username and password, returning the User or None """
+
+        self._maybe_reload()
+
+        now = self._clock()
+        digest = self._digest(password)
+        user = self._users.get(username)
+
+        with self._lock:
+            entry = self._cache.get(username)
+
+            if entry and entry[0] > now and entry[2] is user:
+                if hmac.compare_digest(entry[1], digest):
+                    self._cache.move_to_end(username)
+                    return user
+
+        if user is None:
+            # Spend as long as for a real user, so usernames can't be probed
+            if self._dummy_hash is None:
+                self._dummy_hash = hash_password(_b64(os.urandom(12)))
+
+            check_password(password, self._dummy_hash)
+            return None
+
+        if not check_password(password, user.password_hash):
+            return None
+
+        with self._lock:
+            self._cache[username] = (now + self.cache_ttl, digest, user)
+            self._cache.move_to_end(username)
+
+            while len(self._cache) > self.cache_max_size:
+                self._cache.popitem(last=False)
+
+        return user
+
+
+def main():
+    """ Prompt for a password and print its hash for a credentials file """
+
+    password = getpass.getpass("Password: ")
+
+    if password != getpass.getpass("Confirm password: "):
+        raise SystemExit("Passwords don't match")
+
+    print(hash_password(password))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
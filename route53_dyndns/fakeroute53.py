@@ -0,0 +1,302 @@
+""" Local stand-in for the Route 53 API, for benchmarks and tests
+
+Implements enough of the REST API for this service (listing hosted zones,
+listing and changing resource record sets, and getting a change) that a real
+boto3 client can be pointed at it with ``AWS_ENDPOINT_URL``. Latency, errors
+and throttling can be injected to see how the service behaves when AWS does.
+"""
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import itertools
+import random
+from socketserver import ThreadingMixIn
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+API_VERSION = '2013-04-01'
+NAMESPACE = 'https://route53.amazonaws.com/doc/2013-04-01/'
+
+
+def _sort_key(resource_record):
+    # Route 53 orders record sets by name with the labels reversed
+    labels = resource_record['Name'].rstrip('.').lower().split('.')
+
+    return ('.'.join(reversed(labels)), resource_record['Type'],
+            resource_record.get('SetIdentifier') or '')
+
+
+def _absolute(name):
+    return name if name.endswith('.') else name + '.'
+
+
+def _element(tag, value):
+    return '<{0}>{1}</{0}>'.format(tag, escape(str(value)))
+
+
+def _record_xml(resource_record):
+    parts = [_element('Name', resource_record['Name']),
+             _element('Type', resource_record['Type'])]
+
+    for tag in ('SetIdentifier', 'Weight', 'Region', 'TTL'):
+        if tag in resource_record:
+            parts.append(_element(tag, resource_record[tag]))
+
+    parts.append('<ResourceRecords>')
+    parts.extend('<ResourceRecord>{}</ResourceRecord>'.format(
+        _element('Value', rr['Value']))
+        for rr in resource_record['ResourceRecords'])
+    parts.append('</ResourceRecords>')
+
+    return '<ResourceRecordSet>{}</ResourceRecordSet>'.format(''.join(parts))
+
+
+def _parse_record(element):
+    resource_record = {}
+
+    for child in element:
+        tag = child.tag.split('}')[-1]
+
+        if tag == 'ResourceRecords':
+            resource_record[tag] = [
+                {'Value': value.text}
+                for value in child.iter('{%s}Value' % NAMESPACE)]
+        elif tag in ('TTL', 'Weight'):
+            resource_record[tag] = int(child.text)
+        else:
+            resource_record[tag] = child.text
+
+    return resource_record
+
+
+class FakeRoute53(object):
+    """ In-memory hosted zones, with injectable latency, errors and throttling
+
+    `latency` seconds are added to every call, `error_rate` is the fraction of
+    calls which fail with an internal error, and at most `throttle_rate` calls
+    per second are allowed before failing with a 'Throttling' error.
+    """
+
+    def __init__(self, latency=0, error_rate=0, throttle_rate=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.zones = {}  # zone ID -> (zone name, {record key -> record})
+        self.calls = Counter()
+
+        self._lock = threading.Lock()
+        self._change_ids = itertools.count(1)
+        self._tokens = throttle_rate
+        self._refilled = time.time()
+
+    def add_zone(self, zone_id, zone_name, resource_records=()):
+        self.zones[zone_id] = (_absolute(zone_name), {})
+
+        for resource_record in resource_records:
+            self.put_record(zone_id, resource_record)
+
+    def put_record(self, zone_id, resource_record):
+        resource_record = dict(resource_record,
+                               Name=_absolute(resource_record['Name']))
+
+        with self._lock:
+            self.zones[zone_id][1][_sort_key(resource_record)] = (
+                resource_record)
+
+    def _throttled(self):
+        if self.throttle_rate is None:
+            return False
+
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.throttle_rate, self._tokens + (
+                now - self._refilled) * self.throttle_rate)
+            self._refilled = now
+
+            if self._tokens < 1:
+                return True
+
+            self._tokens -= 1
+            return False
+
+    def handle(self, operation, handler, *args):
+        """ Run an operation, returning a (status, XML body) pair """
+
+        with self._lock:
+            self.calls[operation] += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if self._throttled():
+            return 400, self._error('Throttling', 'Rate exceeded')
+
+        if self.error_rate and random.random() < self.error_rate:
+            return 500, self._error('InternalFailure', 'Injected error')
+
+        try:
+            return 200, handler(*args)
+        except KeyError:
+            return 404, self._error('NoSuchHostedZone', 'No such zone')
+
+    def _error(self, code, message):
+        return ('<ErrorResponse xmlns="{}"><Error><Type>Sender</Type>'
+                '{}{}</Error><RequestId>fake</RequestId>'
+                '</ErrorResponse>').format(NAMESPACE, _element('Code', code),
+                                           _element('Message', message))
+
+    def list_hosted_zones(self, query):
+        zones = ''.join(
+            '<HostedZone>{}{}{}<Config><PrivateZone>false</PrivateZone>'
+            '</Config>{}</HostedZone>'.format(
+                _element('Id', '/hostedzone/' + zone_id),
+                _element('Name', zone_name),
+                _element('CallerReference', zone_id),
+                _element('ResourceRecordSetCount', len(records)))
+            for zone_id, (zone_name, records) in sorted(self.zones.items()))
+
+        return ('<ListHostedZonesResponse xmlns="{}"><HostedZones>{}'
+                '</HostedZones><Marker></Marker><IsTruncated>false'
+                '</IsTruncated><MaxItems>100</MaxItems>'
+                '</ListHostedZonesResponse>').format(NAMESPACE, zones)
+
+    def list_resource_record_sets(self, zone_id, query):
+        max_items = int(query.get('maxitems', ['100'])[0])
+        _, records = self.zones[zone_id]
+
+        with self._lock:
+            records = sorted(records.items())
+
+        if 'name' in query:
+            start = _sort_key({
+                'Name': query['name'][0],
+                'Type': query.get('type', [''])[0],
+                'SetIdentifier': query.get('identifier', [''])[0]})
+            records = [item for item in records if item[0] >= start]
+
+        page = [record for _, record in records[:max_items]]
+        truncated = len(records) > max_items
+        body = ''.join(_record_xml(record) for record in page)
+        body = '<ResourceRecordSets>{}</ResourceRecordSets>{}{}'.format(
+            body, _element('IsTruncated', 'true' if truncated else 'false'),
+            _element('MaxItems', max_items))
+
+        if truncated:
+            following = records[max_items][1]
+            body += _element('NextRecordName', following['Name'])
+            body += _element('NextRecordType', following['Type'])
+
+            if 'SetIdentifier' in following:
+                body += _element('NextRecordIdentifier',
+                                 following['SetIdentifier'])
+
+        return ('<ListResourceRecordSetsResponse xmlns="{}">{}'
+                '</ListResourceRecordSetsResponse>').format(NAMESPACE, body)
+
+    def change_resource_record_sets(self, zone_id, body):
+        self.zones[zone_id]  # Make sure the zone exists
+        root = ElementTree.fromstring(body)
+
+        for change in root.iter('{%s}Change' % NAMESPACE):
+            element = change.find('{%s}ResourceRecordSet' % NAMESPACE)
+            self.put_record(zone_id, _parse_record(element))
+
+        return self._change_info('PENDING')
+
+    def get_change(self, change_id):
+        return self._change_info('INSYNC', change_id)
+
+    def _change_info(self, status, change_id=None):
+        if change_id is None:
+            change_id = 'C%d' % next(self._change_ids)
+
+        return ('<ChangeResourceRecordSetsResponse xmlns="{}"><ChangeInfo>'
+                '{}{}<SubmittedAt>2015-01-01T00:00:00.000Z</SubmittedAt>'
+                '</ChangeInfo></ChangeResourceRecordSetsResponse>').format(
+                    NAMESPACE, _element('Id', '/change/' + change_id),
+                    _element('Status', status))
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # Keep connections alive, like AWS
+
+    def log_message(self, format, *args):
+        pass  # Far too noisy under load
+
+    def _respond(self, status, body):
+        body = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self, method):
+        fake = self.server.fake
+        url = urlparse(self.path)
+        parts = url.path.strip('/').split('/')
+        query = parse_qs(url.query)
+
+        if parts[0] != API_VERSION:
+            return self._respond(404, fake._error('NotFound', url.path))
+
+        parts = parts[1:]
+
+        if method == 'GET' and parts == ['hostedzone']:
+            return self._respond(*fake.handle(
+                'ListHostedZones', fake.list_hosted_zones, query))
+
+        if len(parts) == 3 and parts[0] == 'hostedzone' and (
+                parts[2] == 'rrset'):
+            if method == 'GET':
+                return self._respond(*fake.handle(
+                    'ListResourceRecordSets', fake.list_resource_record_sets,
+                    parts[1], query))
+
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length)
+
+            return self._respond(*fake.handle(
+                'ChangeResourceRecordSets', fake.change_resource_record_sets,
+                parts[1], body))
+
+        if method == 'GET' and len(parts) == 2 and parts[0] == 'change':
+            return self._respond(*fake.handle('GetChange', fake.get_change,
+                                              parts[1]))
+
+        return self._respond(404, fake._error('NotFound', url.path))
+
+    def do_GET(self):
+        self._route('GET')
+
+    def do_POST(self):
+        self._route('POST')
+
+
+class FakeRoute53Server(ThreadingMixIn, HTTPServer):
+    """ HTTP server for a FakeRoute53, run in a background thread """
+
+    daemon_threads = True
+
+    def __init__(self, fake, address=('127.0.0.1', 0)):
+        HTTPServer.__init__(self, address, _Handler)
+        self.fake = fake
+        self._thread = None
+
+    @property
+    def endpoint_url(self):
+        return 'http://{}:{}'.format(*self.server_address[:2])
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,176 @@
+""" History of recent updates to each record, to hold down flapping records
+
+Routers which switch between WAN links can alternate their IP every few
+seconds, and every switch would otherwise be a Route 53 change. A record may
+only be updated `max_updates` times in `window` seconds, after which updates
+are held down until the oldest update falls out of the window.
+"""
+
+import atexit
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from route53_dyndns.cache import normalize_name
+
+FILE_MAGIC = b'R53H\x01'
+_KEY_LENGTH = struct.Struct('>H')
+_TIMESTAMP_SIZE = 4
+
+
+def history_key(resource_record):
+    """ Key for a resource record in the update history """
+
+    return '{}\0{}'.format(normalize_name(resource_record['Name']),
+                           resource_record['Type'])
+
+
+class UpdateHistory(object):
+    """ Bounded store of the times each record was recently updated
+
+    Each record keeps at most `max_updates` timestamps, packed into a single
+    bytes value at one second resolution, so millions of records fit in a
+    modest amount of memory. At most `max_size` records are kept, dropping the
+    least recently updated, which only lets a dropped record update sooner.
+
+    With a `path`, the history is loaded from the file when created and saved
+    to it every `save_interval` seconds and at exit. Each worker process keeps
+    its own history, so the limit applies per worker, and the file has the
+    history of whichever worker saved it last. With a shared cache `backend`
+    the history is kept there instead, so the limit applies to all workers.
+    """
+
+    def __init__(self, max_updates, window, max_size=1000000, path=None,
+                 save_interval=60, backend=None, clock=time.time):
+        self.max_updates = max_updates
+        self.window = window
+        self.max_size = max_size
+        self.path = path
+        self.save_interval = save_interval
+        self.backend = backend
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._history = {}  # key -> packed timestamps, in update order
+        self._saver = None  # PID the save thread was started in
+
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._history)
+
+    def _recent(self, key, now):
+        if self.backend is not None:
+            timestamps = self.backend.get('history\0' + key) or []
+        else:
+            packed = self._history.get(key, b'')
+            timestamps = struct.unpack(
+                '>%dI' % (len(packed) // _TIMESTAMP_SIZE), packed)
+
+        return [timestamp for timestamp in timestamps
+                if timestamp > now - self.window]
+
+    def held_down(self, resource_record):
+        """ Check whether a record has been updated too often to update now """
+
+        recent = self._recent(history_key(resource_record), self._clock())
+
+        return len(recent) >= self.max_updates
+
+    def record(self, resource_record):
+        """ Record that a record was updated """
+
+        self.start()
+
+        now = int(self._clock())
+        key = history_key(resource_record)
+
+        if self.backend is not None:
+            timestamps = (self._recent(key, now) + [now])[-self.max_updates:]
+            self.backend.put('history\0' + key, timestamps, self.window)
+            return
+
+        with self._lock:
+            timestamps = (self._recent(key, now) + [now])[-self.max_updates:]
+
+            # Move it to the end, so the oldest entries are evicted first
+            self._history.pop(key, None)
+            self._history[key] = struct.pack('>%dI' % len(timestamps),
+                                             *timestamps)
+
+            while len(self._history) > self.max_size:
+                del self._history[next(iter(self._history))]
+
+    def save(self):
+        """ Atomically write the history to the file """
+
+        with self._lock:
+            items = list(self._history.items())
+
+        descriptor, path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(self.path)))
+
+        with os.fdopen(descriptor, 'wb') as history_file:
+            history_file.write(FILE_MAGIC)
+
+            for key, packed in items:
+                key = key.encode('utf-8')
+                history_file.write(_KEY_LENGTH.pack(len(key)) + key)
+                history_file.write(_KEY_LENGTH.pack(len(packed)) + packed)
+
+        os.rename(path, self.path)
+
+    def load(self):
+        """ Load the history from the file, ignoring it if it's invalid """
+
+        with open(self.path, 'rb') as history_file:
+            data = history_file.read()
+
+        if not data.startswith(FILE_MAGIC):
+            return
+
+        history = {}
+        offset = len(FILE_MAGIC)
+
+        try:
+            while offset < len(data):
+                fields = []
+
+                for _ in range(2):
+                    length, = _KEY_LENGTH.unpack_from(data, offset)
+                    offset += _KEY_LENGTH.size
+                    fields.append(data[offset:offset + length])
+                    offset += length
+
+                if offset > len(data) or len(fields[1]) % _TIMESTAMP_SIZE:
+                    raise ValueError("Truncated history file")
+
+                history[fields[0].decode('utf-8')] = fields[1]
+        except (struct.error, ValueError):
+            return  # Truncated or corrupt, start afresh
+
+        with self._lock:
+            self._history = history
+
+    def start(self):
+        """ Start saving the history every save interval, if there's a file """
+
+        if not self.path or self.backend is not None or (
+                self._saver == os.getpid()):
+            return
+
+        self._saver = os.getpid()
+
+        def save_forever():
+            while True:
+                time.sleep(self.save_interval)
+                self.save()
+
+        thread = threading.Thread(target=save_forever)
+        thread.daemon = True
+        thread.start()
+
+        atexit.register(self.save)
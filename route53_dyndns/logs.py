@@ -0,0 +1,247 @@
+""" Structured logging of update decisions, and the audit log of DNS changes
+
+Each request logs a JSON line per hostname with the user, the old and new
+addresses, the response given and how long finding and updating the records
+took. Records are handed to a background thread through a bounded queue and
+written in batches, so a slow log destination never holds up a request; if
+the queue fills up, records are dropped and counted rather than waited on.
+Most requests are routers checking in with an address which hasn't changed,
+so only a sample of the 'nochg' decisions are logged.
+
+The audit log is separate: an append-only file with a JSON line for every
+change actually sent to Route 53 and the user who asked for it, written before
+the change is reported as made.
+"""
+
+import atexit
+from datetime import datetime
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+
+from route53_dyndns.changes import change_id
+from route53_dyndns.metrics import registry
+
+DROPPED = registry.counter('log_records_dropped_total',
+                           "Log records dropped because the queue was full")
+AUDIT_ERRORS = registry.counter('audit_log_errors_total',
+                                "Changes which couldn't be audit logged")
+
+NO_CHANGE = 'nochg'
+
+# Attributes of every LogRecord, so the rest are the caller's extra fields
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {
+    'message', 'asctime'}
+
+
+def _timestamp(seconds):
+    return datetime.utcfromtimestamp(seconds).isoformat() + 'Z'
+
+
+class JsonFormatter(logging.Formatter):
+    """ Formats each record as a single line JSON object
+
+    Fields passed with `extra` are included as they are.
+    """
+
+    def format(self, record):
+        fields = {
+            'time': _timestamp(record.created),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES:
+                fields[name] = value
+
+        if record.exc_info:
+            fields.setdefault('error', record.exc_info[0].__name__)
+            fields['traceback'] = self.formatException(record.exc_info)
+
+        return json.dumps(fields, separators=(',', ':'), sort_keys=True,
+                          default=str)
+
+
+class NoChangeSampler(logging.Filter):
+    """ Lets through only `rate` of the records for 'nochg' decisions
+
+    The records which are let through get a 'sample_rate' field, so counts
+    from the logs can be scaled back up.
+    """
+
+    def __init__(self, rate=1.0, random=random.random):
+        super(NoChangeSampler, self).__init__()
+        self.rate = rate
+
+        self._random = random
+
+    def filter(self, record):
+        if getattr(record, 'decision', None) != NO_CHANGE or self.rate >= 1:
+            return True
+
+        if self._random() >= self.rate:
+            return False
+
+        record.sample_rate = self.rate
+
+        return True
+
+
+class QueueingHandler(logging.Handler):
+    """ Writes records to a stream from a background thread, in batches
+
+    Up to `batch_size` records are written and flushed together, waiting up
+    to `flush_interval` seconds for a batch to fill. At most `max_queued`
+    records wait to be written.
+    """
+
+    def __init__(self, stream=None, max_queued=10000, batch_size=100,
+                 flush_interval=0.5):
+        super(QueueingHandler, self).__init__()
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.max_queued = max_queued
+
+        self._reset_queue()
+        self._started = None  # PID the writer thread was started in
+
+        if hasattr(os, 'register_at_fork'):  # pragma: nb
+            os.register_at_fork(after_in_child=self._reset_queue)
+
+    def _reset_queue(self):
+        # The parent's records are its own to write, and its queue's lock may
+        # be held by a thread which doesn't exist in the child
+        self._queue = queue.Queue(self.max_queued)
+
+    def emit(self, record):
+        self.start()
+
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            DROPPED.inc()
+
+    def _take(self, block):
+        """ Take the next batch of records from the queue """
+
+        records = []
+        deadline = time.time() + self.flush_interval
+
+        while len(records) < self.batch_size:
+            timeout = deadline - time.time()
+
+            try:
+                if block and not records:
+                    records.append(self._queue.get())
+                elif block and timeout > 0:
+                    records.append(self._queue.get(timeout=timeout))
+                else:
+                    records.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        return records
+
+    def _write(self, records):
+        lines = []
+
+        for record in records:
+            try:
+                lines.append(self.format(record) + '\n')
+            except Exception:
+                self.handleError(record)
+
+        self.acquire()
+
+        try:
+            self.stream.write(''.join(lines))
+            self.stream.flush()
+        finally:
+            self.release()
+
+    def flush(self):
+        """ Write everything which is queued, from the calling thread """
+
+        records = self._take(block=False)
+
+        while records:
+            self._write(records)
+            records = self._take(block=False)
+
+    def _write_forever(self):
+        while True:
+            try:
+                self._write(self._take(block=True))
+            except Exception:
+                pass  # The stream is unavailable, those records are lost
+
+    def start(self):
+        """ Start the writer thread in this process """
+
+        if self._started == os.getpid():
+            return
+
+        self._started = os.getpid()
+
+        thread = threading.Thread(target=self._write_forever)
+        thread.daemon = True
+        thread.start()
+
+        atexit.register(self.flush)
+
+
+class AuditLog(object):
+    """ Append-only file with a JSON line for each change made to Route 53
+
+    Each batch of changes is written with a single append, so the lines from
+    several worker processes are never interleaved.
+    """
+
+    def __init__(self, path, clock=time.time):
+        self.path = path
+
+        self._clock = clock
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                           0o600)
+
+    def record(self, hosted_zone_id, changes, change_info, users=None):
+        """ Log the changes in a ChangeBatch which Route 53 accepted
+
+        `users` is the name of the user who asked for each change, if known.
+        """
+
+        now = _timestamp(self._clock())
+        lines = []
+
+        for change, user in zip(changes, users or [None] * len(changes)):
+            resource_record = change['ResourceRecordSet']
+            lines.append(json.dumps({
+                'time': now,
+                'zone': hosted_zone_id,
+                'change': change_id(change_info),
+                'action': change['Action'],
+                'name': resource_record['Name'],
+                'type': resource_record['Type'],
+                'ttl': resource_record.get('TTL'),
+                'user': user,
+                'values': [value['Value'] for value in
+                           resource_record.get('ResourceRecords', ())],
+            }, separators=(',', ':'), sort_keys=True) + '\n')
+
+        try:
+            os.write(self._fd, ''.join(lines).encode('utf-8'))
+        except OSError:
+            AUDIT_ERRORS.inc(amount=len(changes))
+            raise
+
+    def close(self):
+        os.close(self._fd)
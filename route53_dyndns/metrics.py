@@ -0,0 +1,350 @@
+""" Prometheus style metrics, aggregated across worker processes
+
+Metrics are cheap to update on the request path: each thread writes to its own
+shard, so no locks are taken, and the shards are only summed when the metrics
+are collected. With ``METRICS_DIR`` set, each process also periodically writes
+its values to a file in that directory, and collecting reads every process's
+file so the totals cover all of the workers.
+"""
+
+from __future__ import division
+
+from bisect import bisect_left
+from contextlib import contextmanager
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+_timer = time.perf_counter
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, registry, name, documentation, label=None):
+        self.name = name
+        self.documentation = documentation
+        self.label = label
+
+        self._local = threading.local()
+        self._shards = []  # (thread, shard) for each thread which wrote
+        self._retired = {}  # Totals of the threads which have exited
+        self._lock = threading.Lock()
+
+        registry.register(self)
+
+    def _shard(self):
+        try:
+            return self._local.shard
+        except AttributeError:
+            shard = self._local.shard = {}
+
+            with self._lock:  # Only once per thread
+                self._retire()
+                self._shards.append((threading.current_thread(), shard))
+
+            return shard
+
+    def _retire(self):
+        # Fold the shards of exited threads into one, so threads started
+        # per request or per batch don't each keep a shard forever. Called
+        # with the lock held; exited threads can't be writing to them
+        live = []
+
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                _merge(self.kind, self._retired, shard)
+
+        self._shards = live
+
+    def _all_shards(self):
+        """ Copies of the retired totals and each live thread's shard """
+
+        with self._lock:
+            self._retire()
+
+            return [_copy(self._retired)] + [
+                _copy(shard) for _, shard in self._shards]
+
+    def reset(self):
+        # Also called in forked children, where the lock may be held by a
+        # thread which no longer exists, so replace it instead of acquiring it
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._shards = []
+        self._retired = {}
+
+
+class Counter(_Metric):
+    """ Monotonically increasing count, optionally split by a label value """
+
+    kind = 'counter'
+
+    def inc(self, label_value=None, amount=1):
+        shard = self._shard()
+        shard[label_value] = shard.get(label_value, 0) + amount
+
+    def values(self):
+        totals = {}
+
+        for shard in self._all_shards():
+            _merge(self.kind, totals, shard)
+
+        return totals
+
+
+class Gauge(_Metric):
+    """ Value which is read from a callback when the metrics are collected """
+
+    kind = 'gauge'
+
+    def __init__(self, registry, name, documentation, callback, label=None):
+        super(Gauge, self).__init__(registry, name, documentation, label)
+        self.callback = callback  # Returns a value, or {label value: value}
+
+    def values(self):
+        value = self.callback()
+
+        return value if isinstance(value, dict) else {None: value}
+
+
+class Histogram(_Metric):
+    """ Distribution of observed values, like request latencies """
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, label=None,
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(registry, name, documentation, label)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, label_value=None):
+        shard = self._shard()
+        counts = shard.get(label_value)
+
+        if counts is None:
+            # One count per bucket plus +Inf, then the sum of the values
+            counts = shard[label_value] = [0] * (len(self.buckets) + 1) + [0]
+
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    @contextmanager
+    def time(self, label_value=None):
+        """ Observe how long the block takes """
+
+        start = _timer()
+
+        try:
+            yield
+        finally:
+            self.observe(_timer() - start, label_value)
+
+    def timed(self, function):
+        """ Decorator to observe how long each call of a function takes """
+
+        def decorated(*args, **kwargs):
+            with self.time():
+                return function(*args, **kwargs)
+
+        decorated.__name__ = function.__name__
+        decorated.__doc__ = function.__doc__
+
+        return decorated
+
+    def values(self):
+        totals = {}
+
+        for shard in self._all_shards():
+            _merge(self.kind, totals, shard)
+
+        return totals
+
+
+def _copy(shard):
+    return dict((label_value, list(value) if isinstance(value, list)
+                 else value) for label_value, value in list(shard.items()))
+
+
+def _merge(kind, totals, values):
+    for label_value, value in values.items():
+        if kind == 'histogram':
+            total = totals.setdefault(label_value, [0] * len(value))
+
+            for index, count in enumerate(value):
+                total[index] += count
+        else:
+            totals[label_value] = totals.get(label_value, 0) + value
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+
+    return True
+
+
+class Registry(object):
+    """ Collection of metrics which can be rendered for Prometheus """
+
+    def __init__(self, directory=None, flush_interval=5):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.metrics = []
+
+        self._flusher = None  # PID the flush thread was started in
+
+        if hasattr(os, 'register_at_fork'):  # pragma: nb
+            # Counts from before the fork belong to the parent
+            os.register_at_fork(after_in_child=self.reset)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+
+    def counter(self, name, documentation, label=None):
+        return Counter(self, name, documentation, label)
+
+    def gauge(self, name, documentation, callback, label=None):
+        return Gauge(self, name, documentation, callback, label)
+
+    def histogram(self, name, documentation, label=None,
+                  buckets=DEFAULT_BUCKETS):
+        return Histogram(self, name, documentation, label, buckets)
+
+    def snapshot(self):
+        """ Values of this process's metrics, as {name: {label: value}} """
+
+        return dict((metric.name, metric.values()) for metric in self.metrics)
+
+    def _path(self, pid):
+        return os.path.join(self.directory, 'metrics_%d.json' % pid)
+
+    def flush(self):
+        """ Write this process's values for the other processes to read """
+
+        snapshot = dict(
+            (name, [[label, value] for label, value in values.items()])
+            for name, values in self.snapshot().items())
+        descriptor, path = tempfile.mkstemp(dir=self.directory)
+
+        with os.fdopen(descriptor, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+
+        os.rename(path, self._path(os.getpid()))  # Atomic, readers never wait
+
+    def start(self):
+        """ Start writing this process's values every flush interval """
+
+        if not self.directory or self._flusher == os.getpid():
+            return
+
+        self._flusher = os.getpid()
+
+        def flush_forever():
+            while True:
+                time.sleep(self.flush_interval)
+                self.flush()
+
+        thread = threading.Thread(target=flush_forever)
+        thread.daemon = True
+        thread.start()
+
+    def collect(self):
+        """ Aggregated values across all processes, as {name: {label: value}}
+
+        Counters and histograms include processes which have exited, since
+        their counts are still part of the totals, but gauges only come from
+        live processes.
+        """
+
+        kinds = dict((metric.name, metric.kind) for metric in self.metrics)
+        totals = dict((name, {}) for name in kinds)
+
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory,
+                                               'metrics_*.json')):
+                pid = int(os.path.basename(path)[8:-5])
+
+                if pid == os.getpid():
+                    continue  # Use the live values instead
+
+                try:
+                    with open(path) as snapshot_file:
+                        snapshot = json.load(snapshot_file)
+                except (IOError, ValueError):
+                    continue
+
+                alive = _pid_alive(pid)
+
+                for name, values in snapshot.items():
+                    if name not in kinds or (kinds[name] == 'gauge' and
+                                             not alive):
+                        continue
+
+                    _merge(kinds[name], totals[name], dict(
+                        (label, value) for label, value in values))
+
+        for name, values in self.snapshot().items():
+            _merge(kinds[name], totals[name], values)
+
+        return totals
+
+    def render(self):
+        """ Render the metrics in the Prometheus text exposition format """
+
+        totals = self.collect()
+        lines = []
+
+        for metric in self.metrics:
+            lines.append('# HELP {} {}'.format(metric.name,
+                                               metric.documentation))
+            lines.append('# TYPE {} {}'.format(metric.name, metric.kind))
+
+            for label_value, value in sorted(totals[metric.name].items(),
+                                             key=lambda item: str(item[0])):
+                labels = []
+
+                if label_value is not None:
+                    labels.append('{}="{}"'.format(metric.label, label_value))
+
+                if metric.kind == 'histogram':
+                    lines.extend(_render_histogram(metric, labels, value))
+                else:
+                    lines.append('{}{} {}'.format(
+                        metric.name, _labels(labels), value))
+
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        for metric in self.metrics:
+            metric.reset()
+
+
+registry = Registry()
+
+
+def _labels(labels):
+    return '{' + ','.join(labels) + '}' if labels else ''
+
+
+def _render_histogram(metric, labels, counts):
+    cumulative = 0
+
+    for bound, count in zip(metric.buckets + ('+Inf',), counts[:-1]):
+        cumulative += count
+        yield '{}_bucket{} {}'.format(
+            metric.name, _labels(labels + ['le="{}"'.format(bound)]),
+            cumulative)
+
+    yield '{}_sum{} {}'.format(metric.name, _labels(labels), counts[-1])
+    yield '{}_count{} {}'.format(metric.name, _labels(labels), cumulative)
@@ -0,0 +1,218 @@
+""" Per-phase timing and profiling of update requests
+
+With phase timing on, each phase of an update request (authentication, the
+request checks, the record lookups and the updates) is timed into the
+``dyndns_phase_seconds`` histogram, so a latency spike can be traced to the
+phase it came from. When it's off, timing a phase is a single attribute check.
+
+Profiling is for finding out where the time goes within a phase. While it's
+switched on, a sample of requests are run under cProfile, and the profile of
+each request which takes longer than the threshold is dumped to a directory,
+along with its phase timings, for reading with ``pstats`` or snakeviz. It is
+switched on and off at runtime by a flag file in that directory, so switching
+it reaches every worker process.
+"""
+
+from contextvars import ContextVar
+import cProfile
+import json
+import os
+import random
+import threading
+import time
+
+from route53_dyndns.metrics import registry
+
+PHASE_SECONDS = registry.histogram('dyndns_phase_seconds',
+                                   "Time taken by each phase of update "
+                                   "requests", 'phase')
+PROFILES = registry.counter('dyndns_profiles_total',
+                            "Profiles of slow update requests dumped")
+
+FLAG_FILE = 'enabled'
+
+
+class _NoPhase(object):
+    """ Context manager which does nothing, for when timing is off """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NO_PHASE = _NoPhase()
+
+
+class _Phase(object):
+    def __init__(self, name, timings):
+        self.name = name
+        self.timings = timings
+
+    def __enter__(self):
+        self.start = time.time()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.start
+        PHASE_SECONDS.observe(seconds, self.name)
+
+        if self.timings is not None:
+            self.timings[self.name] = self.timings.get(self.name, 0) + seconds
+
+        return False
+
+
+class Profiler(object):
+    """ Times the phases of requests, and profiles a sample of them
+
+    Phases are only timed when `enabled`. Profiles are only taken when there
+    is a `directory` and profiling is switched on, for `sample_rate` of the
+    requests, and only those taking over `threshold` seconds are dumped. At
+    most `max_dumps` are kept, the oldest being removed.
+    """
+
+    def __init__(self, enabled=False, directory=None, threshold=1.0,
+                 sample_rate=0.1, max_dumps=100, check_interval=1.0,
+                 random=random.random, clock=time.time):
+        self.enabled = enabled
+        self.directory = directory
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.max_dumps = max_dumps
+        self.check_interval = check_interval
+
+        self._random = random
+        self._clock = clock
+        self._timings = ContextVar('timings', default=None)
+        self._profiling = (0, False)  # (checked, switched on)
+        self._lock = threading.Lock()  # Only one profiler runs at a time
+        self._dumps = 0
+
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def phase(self, name):
+        """ Context manager timing a phase of the current request """
+
+        if not self.enabled:
+            return _NO_PHASE
+
+        return _Phase(name, self._timings.get())
+
+    @property
+    def flag_path(self):
+        return os.path.join(self.directory, FLAG_FILE)
+
+    def is_profiling(self):
+        """ Whether profiling is switched on, checked once per interval """
+
+        if not self.directory:
+            return False
+
+        checked, switched_on = self._profiling
+        now = self._clock()
+
+        if now - checked >= self.check_interval:
+            switched_on = os.path.exists(self.flag_path)
+            self._profiling = (now, switched_on)
+
+        return switched_on
+
+    def switch(self, on):
+        """ Switch profiling on or off, in every worker process """
+
+        if on:
+            with open(self.flag_path, 'w'):
+                pass
+        elif os.path.exists(self.flag_path):
+            os.remove(self.flag_path)
+
+        self._profiling = (self._clock(), on)
+
+    def request(self, profile=True):
+        """ Context manager around a request, collecting its phase timings
+
+        Unless `profile` is false, the request may be profiled.
+        """
+
+        if not self.enabled and not self.directory:
+            return _NO_PHASE
+
+        return _Request(self, profile and self.is_profiling() and (
+            self._random() < self.sample_rate))
+
+    def dump(self, profile, seconds, timings):
+        """ Write a request's profile and phase timings to the directory """
+
+        self._dumps += 1
+        name = '{:.6f}-{}-{}'.format(self._clock(), os.getpid(), self._dumps)
+        path = os.path.join(self.directory, name)
+
+        profile.dump_stats(path + '.prof')
+
+        with open(path + '.json', 'w') as timings_file:
+            json.dump({'seconds': seconds, 'phases': timings}, timings_file,
+                      indent=2, sort_keys=True)
+
+        PROFILES.inc()
+        self._prune()
+
+        return path + '.prof'
+
+    def _prune(self):
+        dumps = sorted(name[:-len('.prof')]
+                       for name in os.listdir(self.directory)
+                       if name.endswith('.prof'))
+
+        for name in dumps[:-self.max_dumps]:
+            for extension in ('.prof', '.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name + extension))
+                except OSError:
+                    pass  # Removed by another worker
+
+
+class _Request(object):
+    def __init__(self, profiler, profile):
+        self.profiler = profiler
+        self.sampled = profile
+        self.profile = None
+        self.timings = {}
+
+    def __enter__(self):
+        self._token = self.profiler._timings.set(self.timings)
+
+        # Requests being profiled while another is are just left out
+        if self.sampled and self.profiler._lock.acquire(False):
+            self.profile = cProfile.Profile()
+
+            try:
+                self.profile.enable()
+            except ValueError:
+                # Another profiler is already running in this process
+                self.profile = None
+                self.profiler._lock.release()
+
+        self.start = time.time()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.time() - self.start
+
+        if self.profile is not None:
+            self.profile.disable()
+            self.profiler._lock.release()
+
+            if seconds >= self.profiler.threshold:
+                try:
+                    self.profiler.dump(self.profile, seconds, self.timings)
+                except (IOError, OSError):
+                    pass  # Profiles are best effort
+
+        self.profiler._timings.reset(self._token)
+
+        return False
@@ -0,0 +1,155 @@
+""" Resolution of the client's address behind trusted proxies
+
+Behind a load balancer every request comes from the balancer, and the client's
+own address is in the 'Forwarded' or 'X-Forwarded-For' header. Anyone can
+send those headers, so they are only believed when the request came from a
+trusted proxy, and each hop is only believed if the proxy which added it is
+trusted too. Walking the hops from the right, the client is the first address
+which isn't a trusted proxy.
+
+The trusted networks are compiled into sorted, merged address ranges, so each
+hop is checked with a binary search however many networks there are.
+"""
+
+from bisect import bisect_right
+import ipaddress
+
+
+def parse_address(value):
+    """ Parse an address, unwrapping IPv4 addresses mapped into IPv6
+
+    Raises ValueError if the value isn't an IP address.
+    """
+
+    address = ipaddress.ip_address(value)
+
+    if address.version == 6 and address.ipv4_mapped:
+        return address.ipv4_mapped
+
+    return address
+
+
+class NetworkSet(object):
+    """ A set of IP networks, as sorted ranges of addresses """
+
+    def __init__(self, networks):
+        ranges = {4: [], 6: []}
+
+        for network in networks:
+            network = ipaddress.ip_network(network, strict=False)
+            ranges[network.version].append((int(network.network_address),
+                                            int(network.broadcast_address)))
+
+        self._starts = {}
+        self._ends = {}
+
+        for version, version_ranges in ranges.items():
+            merged = []
+
+            for start, end in sorted(version_ranges):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+
+            self._starts[version] = [start for start, _ in merged]
+            self._ends[version] = [end for _, end in merged]
+
+    def __len__(self):
+        """ Number of distinct address ranges """
+
+        return sum(len(starts) for starts in self._starts.values())
+
+    def __contains__(self, address):
+        if not isinstance(address, (ipaddress.IPv4Address,
+                                    ipaddress.IPv6Address)):
+            try:
+                address = parse_address(address)
+            except ValueError:
+                return False
+
+        value = int(address)
+        index = bisect_right(self._starts[address.version], value) - 1
+
+        return index >= 0 and value <= self._ends[address.version][index]
+
+
+def _strip_port(value):
+    value = value.strip().strip('"')
+
+    if value.startswith('['):
+        return value[1:].split(']', 1)[0]  # IPv6, possibly with a port
+
+    if value.count(':') == 1:
+        return value.split(':', 1)[0]  # IPv4 with a port
+
+    return value
+
+
+def parse_forwarded(header):
+    """ The 'for' address of each hop in a Forwarded header, in order """
+
+    hops = []
+
+    for element in header.split(','):
+        for pair in element.split(';'):
+            name, _, value = pair.strip().partition('=')
+
+            if name.lower() == 'for':
+                hops.append(_strip_port(value))
+                break
+        else:
+            hops.append('')  # A hop which didn't say who it was for
+
+    return hops
+
+
+def parse_x_forwarded_for(header):
+    """ The address of each hop in an X-Forwarded-For header, in order """
+
+    return [_strip_port(value) for value in header.split(',')]
+
+
+class ClientResolver(object):
+    """ Finds the client's address from the forwarding headers
+
+    Only the last `max_hops` hops are looked at, so a long header can't make
+    the lookup slow.
+    """
+
+    def __init__(self, trusted_proxies, max_hops=20):
+        self.trusted_proxies = NetworkSet(trusted_proxies)
+        self.max_hops = max_hops
+
+    def resolve(self, remote_addr, forwarded=None, x_forwarded_for=None):
+        """ The client's address, or None if a trusted hop was invalid
+
+        The Forwarded header is used if there is one, otherwise the
+        X-Forwarded-For header.
+        """
+
+        if not len(self.trusted_proxies) or not remote_addr or (
+                remote_addr not in self.trusted_proxies):
+            return remote_addr
+
+        if forwarded:
+            hops = parse_forwarded(forwarded)
+        elif x_forwarded_for:
+            hops = parse_x_forwarded_for(x_forwarded_for)
+        else:
+            return remote_addr
+
+        address = remote_addr
+
+        for hop in reversed(hops[-self.max_hops:]):
+            try:
+                parsed = parse_address(hop)
+            except ValueError:
+                return None  # Nothing can be trusted past a bad hop
+
+            address = str(parsed)
+
+            if parsed not in self.trusted_proxies:
+                break
+
+        return address
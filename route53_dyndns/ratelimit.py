@@ -0,0 +1,147 @@
+""" Token bucket rate limiting of update requests
+
+Every key gets a bucket holding up to `burst` tokens, which refills at `rate`
+tokens per second. A request takes one token, and is refused when the bucket
+is empty. Only the token count and the time it was last updated are stored,
+so checking a key is O(1) and needs no background refills.
+"""
+
+from __future__ import division
+
+from collections import OrderedDict
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+def _refill(tokens, updated, now, rate, burst):
+    return min(burst, tokens + max(0, now - updated) * rate)
+
+
+class TokenBuckets(object):
+    """ Token buckets for the keys seen by this process
+
+    At most `max_size` buckets are kept, dropping the least recently used, so a
+    flood of distinct keys can't use up memory. A dropped bucket starts full if
+    its key comes back, which can only let a client through, never block one.
+    """
+
+    def __init__(self, rate, burst, max_size=100000, clock=time.time):
+        self.rate = rate
+        self.burst = burst
+        self.max_size = max_size
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, key):
+        """ Take a token for a key, returning False if there are none left """
+
+        now = self._clock()
+
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.burst, now))
+            tokens = _refill(tokens, updated, now, self.rate, self.burst)
+            allowed = tokens >= 1
+
+            if allowed:
+                tokens -= 1
+
+            self._buckets[key] = (tokens, now)
+
+            if len(self._buckets) > self.max_size:
+                self._buckets.popitem(last=False)
+
+        return allowed
+
+
+class SharedTokenBuckets(object):
+    """ Token buckets in a memory mapped file, shared by worker processes
+
+    The file holds a fixed number of `slots`, and each key hashes to a slot, so
+    the size never grows. Each slot stores a hash of its key, and a different
+    key hashing to the same slot replaces it with a full bucket, which like an
+    eviction can only let a client through. Slots are locked individually with
+    ``fcntl`` record locks, so workers only wait on each other for one key.
+    Put the file on a memory backed filesystem, like '/dev/shm'.
+    """
+
+    SLOT = struct.Struct('=Qdd')  # Key hash, tokens, updated
+
+    def __init__(self, path, rate, burst, slots=65536, clock=time.time):
+        if fcntl is None:  # pragma: no cover
+            raise RuntimeError("Shared rate limits need fcntl, not available "
+                               "on this platform")
+
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.slots = slots
+
+        size = slots * self.SLOT.size
+        self._clock = clock
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        if os.fstat(self._fd).st_size < size:
+            os.ftruncate(self._fd, size)
+
+        self._map = mmap.mmap(self._fd, size)
+        self._lock = threading.Lock()  # Record locks don't exclude threads
+
+        if hasattr(os, 'register_at_fork'):  # pragma: nb
+            os.register_at_fork(after_in_child=self._reset_lock)
+
+    def _reset_lock(self):
+        # The lock may be held by a thread which doesn't exist in the child
+        self._lock = threading.Lock()
+
+    def _hash(self, key):
+        digest = hashlib.sha1(key.encode('utf-8')).digest()
+
+        # Zero is an empty slot
+        return struct.unpack('=Q', digest[:8])[0] or 1
+
+    def allow(self, key):
+        """ Take a token for a key, returning False if there are none left """
+
+        key_hash = self._hash(key)
+        offset = key_hash % self.slots * self.SLOT.size
+        now = self._clock()
+
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, self.SLOT.size, offset)
+
+            try:
+                stored, tokens, updated = self.SLOT.unpack_from(self._map,
+                                                                offset)
+
+                if stored != key_hash:
+                    tokens, updated = self.burst, now
+
+                tokens = _refill(tokens, updated, now, self.rate, self.burst)
+                allowed = tokens >= 1
+
+                if allowed:
+                    tokens -= 1
+
+                self.SLOT.pack_into(self._map, offset, key_hash, tokens, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, self.SLOT.size, offset)
+
+        return allowed
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
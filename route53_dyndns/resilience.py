@@ -0,0 +1,225 @@
+""" Retries, backoff and circuit breaking for Route 53 calls
+
+Calls which fail with a retryable error, like throttling or a connection
+error, are retried with exponential backoff and full jitter. Retries come out
+of a budget for each hosted zone (or the account, for calls which aren't for
+a zone), so a struggling zone can't multiply its own load. When retryable
+failures keep happening a circuit breaker opens, and calls fail fast without
+reaching AWS until a trial call succeeds after a cool-off period.
+"""
+
+from functools import partial
+import random
+import threading
+import time
+
+from route53_dyndns.metrics import registry
+from route53_dyndns.ratelimit import TokenBuckets
+
+DEFAULT_RETRYABLE_ERRORS = (
+    'Throttling', 'ThrottlingException', 'PriorRequestNotComplete',
+    'RequestLimitExceeded', 'ServiceUnavailable', 'InternalError',
+    'InternalFailure',
+)
+
+ACCOUNT = ''  # Budget key for calls which aren't for a single zone
+
+CLOSED, OPEN, HALF_OPEN = 0, 1, 2
+
+RETRIES = registry.counter('route53_retry_attempts_total',
+                           "Route 53 calls retried after a retryable error",
+                           'operation')
+RETRIES_EXHAUSTED = registry.counter(
+    'route53_retries_exhausted_total',
+    "Route 53 calls which failed after their last allowed attempt",
+    'operation')
+BUDGET_EXHAUSTED = registry.counter(
+    'route53_retry_budget_exhausted_total',
+    "Route 53 retries skipped because the retry budget was used up",
+    'operation')
+REJECTED = registry.counter('route53_circuit_rejected_total',
+                            "Route 53 calls failed fast by the open circuit",
+                            'operation')
+
+
+class CircuitOpenError(Exception):
+    """ Raised instead of calling Route 53 while the circuit is open """
+
+
+def error_code(error):
+    """ The AWS error code of an exception, or None """
+
+    # Checked without importing botocore, which is only loaded with the client
+    response = getattr(error, 'response', None)
+
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code')
+
+    return None
+
+
+class CircuitBreaker(object):
+    """ Opens after `failure_threshold` consecutive failures
+
+    Once open, calls are rejected for `reset_timeout` seconds, then a single
+    trial call is let through. The circuit closes again if it succeeds, and
+    opens for another `reset_timeout` seconds if it fails.
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30,
+                 clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened = None  # When the circuit last opened
+        self._trial = False  # A half-open trial call is in flight
+
+    @property
+    def state(self):
+        if self._opened is None:
+            return CLOSED
+
+        if self._clock() - self._opened < self.reset_timeout:
+            return OPEN
+
+        return HALF_OPEN
+
+    def allow(self):
+        """ Check whether a call may go ahead """
+
+        state = self.state
+
+        if state == CLOSED:
+            return True
+
+        if state == OPEN:
+            return False
+
+        with self._lock:
+            if self._trial:
+                return False
+
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened = None
+            self._trial = False
+
+    def release(self):
+        """ Neither a success nor a failure, so allow another trial call """
+
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self._failures += 1
+
+            if self._trial or self._failures >= self.failure_threshold:
+                self._opened = self._clock()
+                self._trial = False
+
+
+class Resilience(object):
+    """ Calls functions with retries, a retry budget and a circuit breaker
+
+    Errors whose AWS error code is in `retryable_errors`, and connection
+    errors, are retried up to `max_attempts` attempts in all unless the code
+    is in `fatal_errors`. Any other error is raised straight away, and doesn't
+    count against the circuit breaker since AWS itself isn't failing.
+    """
+
+    def __init__(self, max_attempts=4, backoff_base=0.1, backoff_max=5.0,
+                 retryable_errors=DEFAULT_RETRYABLE_ERRORS, fatal_errors=(),
+                 budget_rate=1.0, budget_burst=10, failure_threshold=5,
+                 reset_timeout=30, sleep=time.sleep, clock=time.time):
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.retryable_errors = frozenset(retryable_errors)
+        self.fatal_errors = frozenset(fatal_errors)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout, clock)
+
+        self._budget = TokenBuckets(budget_rate, budget_burst, clock=clock)
+        self._sleep = sleep
+
+    def is_retryable(self, error):
+        code = error_code(error)
+
+        if code is not None:
+            return code in self.retryable_errors and (
+                code not in self.fatal_errors)
+
+        from botocore.exceptions import ConnectionError, HTTPClientError
+
+        return isinstance(error, (ConnectionError, HTTPClientError))
+
+    def backoff(self, attempt):
+        """ Seconds to wait before retrying after the given attempt """
+
+        return random.uniform(0, min(self.backoff_max,
+                                     self.backoff_base * 2 ** attempt))
+
+    def call(self, function, zone=None, operation=None):
+        """ Call a function, retrying it if it fails with a retryable error """
+
+        operation = operation or getattr(function, '__name__', None)
+
+        for attempt in range(self.max_attempts):
+            if not self.breaker.allow():
+                REJECTED.inc(operation)
+                raise CircuitOpenError("Route 53 is unavailable, failing fast")
+
+            try:
+                result = function()
+            except Exception as e:
+                if not self.is_retryable(e):
+                    if error_code(e) is not None:
+                        self.breaker.success()  # AWS answered, it's healthy
+                    else:
+                        self.breaker.release()
+
+                    raise
+
+                self.breaker.failure()
+
+                if attempt + 1 >= self.max_attempts:
+                    RETRIES_EXHAUSTED.inc(operation)
+                    raise
+
+                if not self._budget.allow(zone or ACCOUNT):
+                    BUDGET_EXHAUSTED.inc(operation)
+                    raise
+
+                RETRIES.inc(operation)
+                self._sleep(self.backoff(attempt))
+            else:
+                self.breaker.success()
+                return result
+
+
+class ResilientClient(object):
+    """ Client whose API calls all go through a Resilience """
+
+    def __init__(self, client, resilience):
+        self.client = client
+        self.resilience = resilience
+
+    def __getattr__(self, name):
+        method = getattr(self.client, name)
+
+        if name.startswith('_') or not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            return self.resilience.call(partial(method, *args, **kwargs),
+                                        zone=kwargs.get('HostedZoneId'),
+                                        operation=name)
+
+        return call
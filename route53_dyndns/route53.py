@@ -1,8 +1,89 @@
 """ Backend functionality for communicating with Route 53 and updating DNS """
 
-from route53_dyndns.app import app
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import logging
+import os
+import threading
 
-import boto3
+from route53_dyndns.addresses import same_values
+from route53_dyndns.app import load_config
+from route53_dyndns.backends import (
+    MemoryBackend, RedisBackend, SharedMemoryBackend)
+from route53_dyndns.batching import ChangeBatcher
+from route53_dyndns.cache import normalize_name, record_key, RecordCache
+from route53_dyndns.changes import ChangeTracker, TRACK_ERRORS
+from route53_dyndns.client import client_manager
+from route53_dyndns.logs import AuditLog
+from route53_dyndns.metrics import registry
+from route53_dyndns.resilience import Resilience, ResilientClient
+from route53_dyndns.storage import HostLock
+from route53_dyndns.watcher import ZoneWatcher
+from route53_dyndns.workqueue import QueueApplier, WorkQueue
+from route53_dyndns.zones import HostedZones
+
+app = load_config()
+logger = logging.getLogger(__name__)
+
+hosted_zones = HostedZones(
+    refresh_interval=app.config['ZONE_REFRESH_INTERVAL'],
+    allowed=app.config['HOSTED_ZONES'])
+record_cache = RecordCache(ttl=app.config['RECORD_CACHE_TTL'],
+                           max_size=app.config['RECORD_CACHE_MAX_SIZE'])
+resilience = Resilience(
+    max_attempts=app.config['ROUTE53_MAX_ATTEMPTS'],
+    backoff_base=app.config['ROUTE53_BACKOFF_BASE'],
+    backoff_max=app.config['ROUTE53_BACKOFF_MAX'],
+    retryable_errors=app.config['ROUTE53_RETRYABLE_ERRORS'],
+    fatal_errors=app.config['ROUTE53_FATAL_ERRORS'],
+    budget_rate=app.config['ROUTE53_RETRY_BUDGET_RATE'],
+    budget_burst=app.config['ROUTE53_RETRY_BUDGET_BURST'],
+    failure_threshold=app.config['ROUTE53_BREAKER_THRESHOLD'],
+    reset_timeout=app.config['ROUTE53_BREAKER_RESET_TIMEOUT'])
+
+if app.config['CACHE_BACKEND'] == 'memory':
+    shared_cache = MemoryBackend(max_size=app.config['CACHE_MAX_SIZE'])
+elif app.config['CACHE_BACKEND'] == 'shared':
+    shared_cache = SharedMemoryBackend(
+        app.config['CACHE_SHARED_FILE'],
+        slots=app.config['CACHE_SHARED_SLOTS'],
+        slot_size=app.config['CACHE_SHARED_SLOT_SIZE'])
+elif app.config['CACHE_BACKEND'] == 'redis':
+    shared_cache = RedisBackend(app.config['CACHE_REDIS_URL'])
+else:
+    shared_cache = None
+
+if app.config['AUDIT_LOG_FILE']:
+    audit_log = AuditLog(app.config['AUDIT_LOG_FILE'])
+else:
+    audit_log = None
+
+_executor = None  # (pid, executor) since threads don't survive a fork
+_executor_lock = threading.Lock()
+
+FIND_SECONDS = registry.histogram('route53_find_seconds',
+                                  "Time taken to find a resource record")
+UPDATE_SECONDS = registry.histogram('route53_update_seconds',
+                                    "Time taken to update a resource record")
+
+registry.gauge('record_cache_hits', "Record cache lookups which were hits",
+               lambda: record_cache.hits)
+registry.gauge('record_cache_misses', "Record cache lookups which were misses",
+               lambda: record_cache.misses)
+registry.gauge('record_cache_size', "Records in the record cache",
+               lambda: len(record_cache))
+registry.gauge('hosted_zones', "Hosted zones being served",
+               lambda: len(hosted_zones))
+registry.gauge('route53_circuit_state',
+               "Route 53 circuit breaker, 0 closed, 1 open and 2 half-open",
+               lambda: resilience.breaker.state)
+registry.gauge('batches_pending', "Batches of changes waiting to be sent",
+               lambda: len(batcher))
+
+
+# Key on a change for the user who asked for it, which goes through batching
+# and the work queue with the change and is removed before it is sent
+REQUESTED_BY = 'RequestedBy'
 
 
 class Route53Exception(Exception):
@@ -10,17 +91,73 @@ class Route53Exception(Exception):
 
 
 def get_client():  # pragma: no cover
-    """ Helper function to get an authenticated Route 53 client """
+    """ Helper function to get the shared, authenticated Route 53 client """
+
+    return client_manager.get_client()
+
+
+def _resilient(client):
+    """ Wrap a client so its calls are retried and circuit broken """
+
+    if isinstance(client, ResilientClient):
+        return client
+
+    return ResilientClient(client, resilience)
+
+
+def find_hosted_zone(record_name, client=None):
+    """ Find the ID of the hosted zone a DNS record belongs in, or None """
+
+    if not client:  # pragma: no cover
+        client = get_client()
+
+    try:
+        return hosted_zones.find_zone(record_name, _resilient(client))
+    except Exception as e:
+        logger.warning("Failed to list the hosted zones: %s", e,
+                       extra={'error': e.__class__.__name__})
+        raise Route53Exception(e)
 
-    AWS_ACCESS_KEY = app.config['AWS_ACCESS_KEY']
-    AWS_SECRET_ACCESS_KEY = app.config['AWS_SECRET_ACCESS_KEY']
 
-    return boto3.client('route53', aws_access_key_id=AWS_ACCESS_KEY,
-                        aws_secret_access_key=AWS_SECRET_ACCESS_KEY)
+def list_resource_records(hosted_zone_id, client=None):
+    """ Page through every resource record in a hosted zone """
 
+    if not client:  # pragma: no cover
+        client = get_client()
+
+    client = _resilient(client)
+    kwargs = {'HostedZoneId': hosted_zone_id}
+
+    while True:
+        try:
+            response = client.list_resource_record_sets(**kwargs)
+        except Exception as e:
+            logger.warning("Failed to list zone %s: %s", hosted_zone_id, e,
+                           extra={'error': e.__class__.__name__})
+            raise Route53Exception(e)
+
+        for resource_record in response['ResourceRecordSets']:
+            yield resource_record
+
+        if not response['IsTruncated']:
+            break
 
-def find_resource_record(record_name, client=None):
-    """ Find a DNS resource record on Route 53 """
+        kwargs['StartRecordName'] = response['NextRecordName']
+        kwargs['StartRecordType'] = response['NextRecordType']
+
+        if response.get('NextRecordIdentifier'):
+            kwargs['StartRecordIdentifier'] = response['NextRecordIdentifier']
+        else:
+            kwargs.pop('StartRecordIdentifier', None)
+
+
+@FIND_SECONDS.timed
+def find_resource_record(record_name, client=None, record_type=None):
+    """ Find a DNS resource record on Route 53
+
+    Finds the record set of the given type, or the first one for the name if
+    no type is given.
+    """
 
     if not client:  # pragma: no cover
         client = get_client()
@@ -28,62 +165,520 @@ def find_resource_record(record_name, client=None):
     if not record_name:
         raise ValueError("Need a record name")
 
+    hosted_zone_id = find_hosted_zone(record_name, client)
+
+    if not hosted_zone_id:
+        return None  # Not in any of the zones being served
+
+    if shared_cache is not None:
+        # Only one worker looks it up, the others get its result. This
+        # worker's records are only told about its own changes, so they
+        # mustn't outlive the shared ones which other workers' changes replace
+        return shared_cache.get_or_load(
+            _shared_key(hosted_zone_id, record_name, record_type),
+            lambda: _find_zone_resource_record(hosted_zone_id, record_name,
+                                               client, record_type,
+                                               app.config['CACHE_TTL']),
+            app.config['CACHE_TTL'])
+
+    return _find_zone_resource_record(hosted_zone_id, record_name, client,
+                                      record_type)
+
+
+def _shared_key(hosted_zone_id, record_name, record_type=None):
+    return '\0'.join(('record', hosted_zone_id, normalize_name(record_name),
+                      record_type or ''))
+
+
+def _find_zone_resource_record(hosted_zone_id, record_name, client,
+                               record_type=None, max_age=None):
+    """ Find a resource record in its hosted zone """
+
+    if app.config['RECORD_CACHE_ENABLED']:
+        return _find_cached_resource_record(hosted_zone_id, record_name,
+                                            client, record_type, max_age)
+
+    resource_record = _lookup_resource_record(hosted_zone_id, record_name,
+                                              client, record_type)
+
+    return resource_record if _matches(resource_record, record_name,
+                                       record_type) else None
+
+
+def _lookup_resource_record(hosted_zone_id, record_name, client,
+                            record_type=None):
+    """ Look up a single resource record directly on Route 53 """
+
+    kwargs = {'HostedZoneId': hosted_zone_id, 'StartRecordName': record_name,
+              'MaxItems': '1'}
+
+    if record_type:
+        kwargs['StartRecordType'] = record_type
+
     try:
-        response = client.list_resource_record_sets(
-            HostedZoneId='string',
-            StartRecordName=record_name,
-            MaxItems='1'
-        )
+        response = _resilient(client).list_resource_record_sets(**kwargs)
     except Exception as e:
-        # TODO - Log the error
+        logger.warning("Failed to look up %s: %s", record_name, e,
+                       extra={'error': e.__class__.__name__})
         raise Route53Exception(e)
 
-    # We don't ever expect to get truncated results since we are looking up a
-    # single record by name. TBD: This may fail if record types can share names
-    assert not response['IsTruncated'], "Expected single record"
+    # The listing is truncated whenever any record follows this one in the
+    # zone, so only the number of records returned matters
     assert len(response['ResourceRecordSets']) == 1, "Expected single record"
 
     return response['ResourceRecordSets'][0]
 
 
-def update_resource_record(resource_record, value, client=None):
-    """ Update a resource record on Route 53 with a new value """
+def _matches(resource_record, record_name, record_type=None):
+    # Listing starts at the given name, so the first record can be another one
+    return normalize_name(resource_record['Name']) == normalize_name(
+        record_name) and record_type in (None, resource_record['Type'])
+
+
+def _find_cached_resource_record(hosted_zone_id, record_name, client,
+                                 record_type=None, max_age=None):
+    """ Find a resource record, listing the whole zone into the cache once
+
+    Cached records older than `max_age` seconds are looked up again.
+    """
+
+    records = record_cache.get(hosted_zone_id, record_name, max_age)
+
+    if records is None:
+        with record_cache.zone_lock(hosted_zone_id):
+            if not (record_cache.is_loaded(hosted_zone_id) or
+                    record_cache.is_too_large(hosted_zone_id)):
+                record_cache.load_zone(
+                    hosted_zone_id,
+                    list(list_resource_records(hosted_zone_id, client)))
+
+        records = record_cache.lookup(hosted_zone_id, record_name, max_age)
+
+    if records is None:
+        # The zone is too large to be held completely, fall back to a lookup
+        # of the single record, which is then cached on its own
+        resource_record = _lookup_resource_record(hosted_zone_id, record_name,
+                                                  client, record_type)
+        record_cache.put(hosted_zone_id, resource_record)
+
+        return resource_record if _matches(resource_record, record_name,
+                                           record_type) else None
+
+    records = [resource_record for resource_record in records
+               if record_type in (None, resource_record['Type'])]
+
+    return records[0] if records else None
+
+
+def revalidate_zone(hosted_zone_id, client=None):
+    """ List a zone from Route 53 again, replacing its cached records """
 
     if not client:  # pragma: no cover
         client = get_client()
 
-    record_name = resource_record['Name']
-    record_type = resource_record['Type']
-    set_identifier = resource_record['SetIdentifier']
-    current_value = resource_record['ResourceRecords'][0]['Value']
+    resource_records = list(list_resource_records(hosted_zone_id, client))
+
+    with record_cache.zone_lock(hosted_zone_id):
+        record_cache.load_zone(hosted_zone_id, resource_records)
+
+
+def _forget_shared(hosted_zone_id, key):
+    """ Drop a record changed outside the service from the shared cache """
+
+    if shared_cache is not None:
+        _, name, record_type, _ = key
+        shared_cache.discard(_shared_key(hosted_zone_id, name, record_type))
+        shared_cache.discard(_shared_key(hosted_zone_id, name))
+
+
+if app.config['ZONE_WATCH_ENABLED']:
+    zone_watcher = ZoneWatcher(
+        record_cache,
+        lambda hosted_zone_id: list_resource_records(hosted_zone_id,
+                                                     get_client()),
+        min_interval=app.config['ZONE_WATCH_MIN_INTERVAL'],
+        max_interval=app.config['ZONE_WATCH_MAX_INTERVAL'],
+        changed=_forget_shared)
+
+    registry.gauge('zone_last_sync_timestamp_seconds',
+                   "When each cached zone was last listed from Route 53",
+                   lambda: dict(zone_watcher.last_sync), 'zone')
+else:
+    zone_watcher = None
 
-    if value == current_value:
-        return True  # Nothing to do, it is already up-to-date
+
+def change_resource_records(hosted_zone_id, changes, client=None):
+    """ Apply a list of changes to a hosted zone in a single ChangeBatch """
+
+    if not client:  # pragma: no cover
+        client = get_client()
+
+    users = [change.get(REQUESTED_BY) for change in changes]
+    changes = [dict((name, value) for name, value in change.items()
+                    if name != REQUESTED_BY) for change in changes]
 
     try:
-        client.change_resource_record_sets(
-            HostedZoneId='string',
+        response = _resilient(client).change_resource_record_sets(
+            HostedZoneId=hosted_zone_id,
             ChangeBatch={
                 'Comment': "Updating DNS record via route53_dyndns",
-                'Changes': [
-                    {
-                        'Action': 'UPSERT',
-                        'ResourceRecordSet': {
-                            'Name': record_name,
-                            'Type': record_type,
-                            'SetIdentifier': set_identifier,
-                            'ResourceRecords': [
-                                {
-                                    'Value': value
-                                },
-                            ],
-                        }
-                    },
-                ]
+                'Changes': changes
             }
         )
     except Exception as e:
-        # TODO - Log the error
+        logger.warning("Failed to change %d records in zone %s: %s",
+                       len(changes), hosted_zone_id, e,
+                       extra={'error': e.__class__.__name__})
         raise Route53Exception(e)
 
+    if audit_log is not None:
+        try:
+            audit_log.record(hosted_zone_id, changes, response['ChangeInfo'],
+                             users)
+        except Exception:
+            logger.exception("Failed to audit log a change to zone %s",
+                             hosted_zone_id)
+
+    if change_tracker is not None:
+        try:
+            change_tracker.track(
+                response['ChangeInfo'],
+                [change['ResourceRecordSet']['Name'] for change in changes])
+        except Exception:
+            # The change was made, it just can't be followed
+            TRACK_ERRORS.inc()
+            logger.exception("Failed to track a change to zone %s",
+                             hosted_zone_id)
+
+    return response
+
+
+def get_change_status(change_id, client=None):
+    """ Get the status of a change, PENDING or INSYNC """
+
+    if not client:  # pragma: no cover
+        client = get_client()
+
+    return _resilient(client).get_change(Id=change_id)['ChangeInfo']['Status']
+
+
+if app.config['CHANGE_TRACKER_FILE']:
+    change_tracker = ChangeTracker(
+        app.config['CHANGE_TRACKER_FILE'], get_change_status,
+        min_interval=app.config['CHANGE_TRACKER_MIN_INTERVAL'],
+        max_interval=app.config['CHANGE_TRACKER_MAX_INTERVAL'],
+        max_age=app.config['CHANGE_TRACKER_MAX_AGE'])
+
+    registry.gauge('changes_pending', "Route 53 changes not yet in sync",
+                   change_tracker.pending)
+else:
+    change_tracker = None
+
+
+batcher = ChangeBatcher(change_resource_records,
+                        window=app.config['BATCH_WINDOW'],
+                        max_changes=app.config['BATCH_MAX_CHANGES'])
+
+
+def _cache_applied(hosted_zone_id, change):
+    """ Remember the record from an applied change, in each of the caches """
+
+    resource_record = change['ResourceRecordSet']
+
+    if app.config['RECORD_CACHE_ENABLED']:
+        record_cache.put(hosted_zone_id, resource_record)
+
+    if shared_cache is not None:
+        name = resource_record['Name']
+        shared_cache.put(_shared_key(hosted_zone_id, name,
+                                     resource_record['Type']),
+                         resource_record, app.config['CACHE_TTL'])
+        shared_cache.discard(_shared_key(hosted_zone_id, name))
+
+
+def _forget_dropped(hosted_zone_id, change):
+    """ Forget the record from a queued change which was given up on """
+
+    resource_record = change['ResourceRecordSet']
+    logger.error("Gave up on changing %s in zone %s",
+                 resource_record['Name'], hosted_zone_id)
+
+    if app.config['RECORD_CACHE_ENABLED']:
+        record_cache.discard(hosted_zone_id, resource_record)
+
+    _forget_shared(hosted_zone_id, record_key(hosted_zone_id,
+                                              resource_record))
+
+
+if app.config['ASYNC_UPDATES']:
+    work_queue = WorkQueue(app.config['WORK_QUEUE_FILE'],
+                           lease=app.config['WORK_QUEUE_LEASE'])
+    applier = QueueApplier(
+        work_queue,
+        lambda hosted_zone_id, changes: batcher.apply(
+            hosted_zone_id, changes, get_client()),
+        concurrency=app.config['WORK_QUEUE_CONCURRENCY'],
+        batch_size=app.config['BATCH_MAX_CHANGES'],
+        max_attempts=app.config['WORK_QUEUE_MAX_ATTEMPTS'],
+        applied=_cache_applied,
+        dropped=_forget_dropped,
+        lock=HostLock(app.config['WORK_QUEUE_FILE'] + '.lock'))
+
+    registry.gauge('work_queue_depth', "Changes waiting to be applied",
+                   work_queue.depth)
+    registry.gauge('work_queue_lag_seconds',
+                   "Seconds the oldest waiting change has been queued for",
+                   work_queue.lag)
+else:
+    work_queue = applier = None
+
+
+def _completed(result=None, exception=None):
+    future = Future()
+
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+
+    return future
+
+
+def _get_executor():
+    """ Thread pool for concurrent Route 53 calls, one per process """
+
+    global _executor
+
+    if _executor is None or _executor[0] != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor[0] != os.getpid():
+                _executor = (os.getpid(), ThreadPoolExecutor(
+                    max_workers=app.config['ROUTE53_CONCURRENCY']))
+
+    return _executor[1]
+
+
+def find_resource_records(record_names, client=None, record_types=None):
+    """ Find several DNS resource records concurrently
+
+    `record_types` optionally gives the type of record to find for each name.
+    Returns a future for the record of each name, in the same order.
+    """
+
+    if not client:  # pragma: no cover
+        client = get_client()
+
+    lookups = list(zip(record_names, record_types or
+                       [None] * len(record_names)))
+    futures = []
+
+    for record_name, record_type in lookups:
+        # Not worth handing off to other threads, since a single lookup or one
+        # answered from the cache doesn't need to wait on the others
+        if len(lookups) > 1 and not _is_cached(record_name, client):
+            futures.append(_get_executor().submit(
+                find_resource_record, record_name, client, record_type))
+            continue
+
+        try:
+            futures.append(_completed(find_resource_record(
+                record_name, client, record_type)))
+        except Exception as e:
+            futures.append(_completed(exception=e))
+
+    return futures
+
+
+def _is_cached(record_name, client):
+    """ Check if a record can be found without waiting on Route 53 """
+
+    if not app.config['RECORD_CACHE_ENABLED'] or not record_name:
+        return False
+
+    try:
+        hosted_zone_id = find_hosted_zone(record_name, client)
+    except Route53Exception:
+        return False
+
+    max_age = app.config['CACHE_TTL'] if shared_cache is not None else None
+
+    return hosted_zone_id is None or record_cache.lookup(
+        hosted_zone_id, record_name, max_age) is not None
+
+
+def _values(value):
+    """ A single value or a list of values as a list """
+
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+
+def _upsert_change(resource_record, value, user=None):
+    updated_record = dict(resource_record, ResourceRecords=[
+        {'Value': record_value} for record_value in _values(value)])
+    change = {
+        'Action': 'UPSERT',
+        'ResourceRecordSet': updated_record
+    }
+
+    if user:
+        change[REQUESTED_BY] = user
+
+    return change
+
+
+def _apply_changes(changes_by_zone, client):
+    """ Send the changes for each zone, returning a future for each change """
+
+    if app.config['BATCH_UPDATES']:
+        return dict(
+            (hosted_zone_id, [batcher.submit(hosted_zone_id, change, client)
+                              for change in changes])
+            for hosted_zone_id, changes in changes_by_zone.items())
+
+    if len(changes_by_zone) == 1:
+        hosted_zone_id, changes = list(changes_by_zone.items())[0]
+
+        return {hosted_zone_id: batcher.apply(hosted_zone_id, changes, client)}
+
+    # Zones are independent, so send their batches at the same time
+    executor = _get_executor()
+    results = dict(
+        (hosted_zone_id, executor.submit(batcher.apply, hosted_zone_id,
+                                         changes, client))
+        for hosted_zone_id, changes in changes_by_zone.items())
+
+    return dict((hosted_zone_id, result.result())
+                for hosted_zone_id, result in results.items())
+
+
+def _updated_future(hosted_zone_id, change, result):
+    """ Chain a future for a sent change which resolves to True on success """
+
+    future = Future()
+
+    def done(result):
+        try:
+            result.result()
+        except Exception as e:
+            future.set_exception(e)
+        else:
+            _cache_applied(hosted_zone_id, change)
+            future.set_result(True)
+
+    result.add_done_callback(done)
+
+    return future
+
+
+def _require_hosted_zone(resource_record, client):
+    hosted_zone_id = find_hosted_zone(resource_record['Name'], client)
+
+    if not hosted_zone_id:
+        raise Route53Exception(
+            "No hosted zone for '{}'".format(resource_record['Name']))
+
+    return hosted_zone_id
+
+
+def update_resource_records(updates, client=None, user=None):
+    """ Update several resource records, with one ChangeBatch per zone
+
+    Takes a list of (resource record, value) pairs, where the value can be a
+    list of values, and returns a future for the result of each update, in the
+    same order. `user` is the name of the user asking, for the audit log.
+    """
+
+    if not client:  # pragma: no cover
+        client = get_client()
+
+    if work_queue is not None:
+        return _enqueue_updates(updates, client, user)
+
+    if len(updates) == 1:
+        try:
+            return [_completed(update_resource_record(*updates[0],
+                                                      client=client,
+                                                      user=user))]
+        except Exception as e:
+            return [_completed(exception=e)]
+
+    futures = [None] * len(updates)
+    changes_by_zone = OrderedDict()  # zone -> [(index, change)]
+
+    for index, (resource_record, value) in enumerate(updates):
+        if same_values(resource_record, _values(value)):
+            futures[index] = _completed(True)  # Already up-to-date
+            continue
+
+        try:
+            hosted_zone_id = _require_hosted_zone(resource_record, client)
+        except Route53Exception as e:
+            futures[index] = _completed(exception=e)
+            continue
+
+        changes_by_zone.setdefault(hosted_zone_id, []).append(
+            (index, _upsert_change(resource_record, value, user)))
+
+    results = _apply_changes(
+        dict((hosted_zone_id, [change for _, change in changes])
+             for hosted_zone_id, changes in changes_by_zone.items()),
+        client)
+
+    for hosted_zone_id, changes in changes_by_zone.items():
+        for (index, change), result in zip(changes,
+                                           results[hosted_zone_id]):
+            futures[index] = _updated_future(hosted_zone_id, change, result)
+
+    return futures
+
+
+def _enqueue_updates(updates, client, user=None):
+    """ Queue updates to be applied in the background
+
+    The future for each update completes as soon as its change is queued.
+    """
+
+    futures = []
+
+    for resource_record, value in updates:
+        if same_values(resource_record, _values(value)):
+            futures.append(_completed(True))
+            continue
+
+        try:
+            hosted_zone_id = _require_hosted_zone(resource_record, client)
+            change = _upsert_change(resource_record, value, user)
+            work_queue.enqueue(hosted_zone_id, change)
+        except Exception as e:
+            futures.append(_completed(exception=e))
+            continue
+
+        # Later lookups see the new value, rather than queueing it again
+        _cache_applied(hosted_zone_id, change)
+        futures.append(_completed(True))
+
+    return futures
+
+
+@UPDATE_SECONDS.timed
+def update_resource_record(resource_record, value, client=None, user=None):
+    """ Update a resource record on Route 53 with a new value or values """
+
+    if not client:  # pragma: no cover
+        client = get_client()
+
+    if same_values(resource_record, _values(value)):
+        return True  # Nothing to do, it is already up-to-date
+
+    hosted_zone_id = _require_hosted_zone(resource_record, client)
+    change = _upsert_change(resource_record, value, user)
+
+    if app.config['BATCH_UPDATES']:
+        # Blocks until the batch holding the change has been sent
+        batcher.submit(hosted_zone_id, change, client).result()
+    else:
+        change_resource_records(hosted_zone_id, [change], client)
+
+    _cache_applied(hosted_zone_id, change)
+
     return True
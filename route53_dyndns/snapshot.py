@@ -0,0 +1,280 @@
+""" On-disk snapshot of what the service knows, so restarts start warm
+
+Without a snapshot a restarted service knows nothing, and the first wave of
+router check-ins all list records from Route 53 at once and get throttled. The
+snapshot is a small SQLite database holding the hosted zones, the records from
+complete zone listings in the record cache and the IP each hostname last
+reported. It is written periodically to a temporary file which is renamed
+into place, so readers only ever see a complete snapshot.
+
+After loading a snapshot its zones are revalidated against Route 53 in the
+background at a controlled rate, zones with the most recently seen clients
+first, instead of all at once on demand.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from route53_dyndns.cache import normalize_name
+from route53_dyndns.zones import ZoneIndex
+
+SCHEMA_VERSION = '1'
+
+SCHEMA = '''
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE zones (name TEXT, zone_id TEXT);
+CREATE TABLE records (zone_id TEXT, record TEXT);
+CREATE TABLE clients (hostname TEXT PRIMARY KEY, ip TEXT, seen REAL);
+'''
+
+
+class LastSeen(object):
+    """ Bounded record of the IP each hostname last reported, and when """
+
+    def __init__(self, max_size=100000, clock=time.time):
+        self.max_size = max_size
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._clients = {}  # hostname -> (ip, seen), least recent first
+
+    def __len__(self):
+        return len(self._clients)
+
+    def seen(self, hostname, ip):
+        hostname = normalize_name(hostname)
+
+        with self._lock:
+            self._clients.pop(hostname, None)
+            self._clients[hostname] = (ip, self._clock())
+
+            while len(self._clients) > self.max_size:
+                del self._clients[next(iter(self._clients))]
+
+    def get(self, hostname):
+        """ The (ip, seen) last reported for a hostname, or None """
+
+        return self._clients.get(normalize_name(hostname))
+
+    def items(self):
+        """ (hostname, ip, seen) for each client, least recent first """
+
+        with self._lock:
+            return [(hostname, ip, seen)
+                    for hostname, (ip, seen) in self._clients.items()]
+
+    def load(self, items):
+        with self._lock:
+            for hostname, ip, seen in sorted(items, key=lambda item: item[2]):
+                self._clients.pop(hostname, None)
+                self._clients[hostname] = (ip, seen)
+
+            while len(self._clients) > self.max_size:
+                del self._clients[next(iter(self._clients))]
+
+
+def write_snapshot(path, zones, records, clients, saved_at=None):
+    """ Atomically write a snapshot
+
+    `zones` is a list of (name, zone ID) pairs, `records` a dict of zone ID to
+    the zone's records and `clients` a list of (hostname, ip, seen).
+    """
+
+    descriptor, temporary_path = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+    os.close(descriptor)
+
+    try:
+        connection = sqlite3.connect(temporary_path)
+
+        try:
+            connection.executescript(SCHEMA)
+            connection.executemany('INSERT INTO meta VALUES (?, ?)', [
+                ('version', SCHEMA_VERSION),
+                ('saved_at', repr(time.time() if saved_at is None
+                                  else saved_at)),
+            ])
+            connection.executemany('INSERT INTO zones VALUES (?, ?)', zones)
+            connection.executemany('INSERT INTO records VALUES (?, ?)', (
+                (zone_id, json.dumps(record, separators=(',', ':')))
+                for zone_id, zone_records in records.items()
+                for record in zone_records))
+            connection.executemany('INSERT INTO clients VALUES (?, ?, ?)',
+                                   clients)
+            connection.commit()
+        finally:
+            connection.close()
+
+        os.rename(temporary_path, path)
+    except Exception:
+        os.remove(temporary_path)
+        raise
+
+
+def read_snapshot(path):
+    """ Read a snapshot written by write_snapshot
+
+    Returns a dict with 'saved_at', 'zones', 'records' and 'clients', or None
+    if the file is missing, corrupt or from an incompatible version.
+    """
+
+    if not os.path.exists(path):
+        return None
+
+    try:
+        connection = sqlite3.connect(path)
+
+        try:
+            meta = dict(connection.execute('SELECT key, value FROM meta'))
+
+            if meta.get('version') != SCHEMA_VERSION:
+                return None
+
+            records = {}
+
+            for zone_id, record in connection.execute(
+                    'SELECT zone_id, record FROM records'):
+                records.setdefault(zone_id, []).append(json.loads(record))
+
+            return {
+                'saved_at': float(meta['saved_at']),
+                'zones': list(connection.execute(
+                    'SELECT name, zone_id FROM zones')),
+                'records': records,
+                'clients': list(connection.execute(
+                    'SELECT hostname, ip, seen FROM clients')),
+            }
+        finally:
+            connection.close()
+    except (sqlite3.Error, KeyError, ValueError):
+        return None
+
+
+class StateSnapshot(object):
+    """ Saves and restores the hosted zones, record cache and last seen IPs
+
+    `revalidate` is called with a zone ID to list the zone from Route 53 again,
+    and zones from a loaded snapshot are revalidated at `revalidate_rate` zones
+    per second. The record cache is only saved and restored when
+    `cache_records` is true. With a HostLock as `lock`, only the worker
+    holding it revalidates and saves, so Route 53 sees the controlled rate
+    however many workers there are.
+    """
+
+    def __init__(self, path, hosted_zones, record_cache, last_seen,
+                 revalidate, interval=60, revalidate_rate=1.0,
+                 cache_records=True, lock=None):
+        self.path = path
+        self.hosted_zones = hosted_zones
+        self.record_cache = record_cache
+        self.last_seen = last_seen
+        self.revalidate = revalidate
+        self.interval = interval
+        self.revalidate_rate = revalidate_rate
+        self.cache_records = cache_records
+        self.lock = lock
+
+        self._pending = []  # Zone IDs from the snapshot to revalidate
+        self._started = None  # PID the background threads were started in
+
+    def save(self):
+        zones = self.hosted_zones.zones()
+
+        if not zones:
+            return  # Nothing is known yet, so keep any previous snapshot
+
+        records = {}
+
+        if self.cache_records:
+            records = self.record_cache.loaded_zones()
+
+        write_snapshot(self.path, zones, records, self.last_seen.items())
+
+    def load(self):
+        """ Restore the state from the snapshot
+
+        Records are only cached until a TTL after the snapshot was saved, so
+        those from an old snapshot aren't trusted. Returns False if there is
+        no usable snapshot.
+        """
+
+        snapshot = read_snapshot(self.path)
+
+        if snapshot is None:
+            return False
+
+        self.hosted_zones.load(snapshot['zones'])
+        self.last_seen.load(snapshot['clients'])
+
+        if self.cache_records:
+            for zone_id, zone_records in snapshot['records'].items():
+                self.record_cache.load_zone(zone_id, zone_records,
+                                            listed_at=snapshot['saved_at'])
+
+            # Zones which had expired are listed when they're next needed
+            self._pending = [zone_id for zone_id
+                             in self._revalidation_order(snapshot)
+                             if self.record_cache.is_loaded(zone_id)]
+
+        return True
+
+    def _revalidation_order(self, snapshot):
+        # Zones whose clients checked in most recently are likely to be
+        # needed first, then any others in the snapshot
+        index = ZoneIndex(snapshot['zones'])
+        order = []
+
+        for hostname, _, _ in sorted(snapshot['clients'],
+                                     key=lambda client: -client[2]):
+            zone_id = index.find(hostname)
+
+            if zone_id in snapshot['records'] and zone_id not in order:
+                order.append(zone_id)
+
+        return order + [zone_id for zone_id in sorted(snapshot['records'])
+                        if zone_id not in order]
+
+    def revalidate_all(self, sleep=time.sleep):
+        """ Revalidate each zone from the snapshot, at the controlled rate """
+
+        while self._pending:
+            zone_id = self._pending.pop(0)
+
+            try:
+                self.revalidate(zone_id)
+            except Exception:
+                pass  # Loaded on demand instead once the records expire
+
+            if self._pending:
+                sleep(1.0 / self.revalidate_rate)
+
+    def _save_forever(self):
+        while True:
+            time.sleep(self.interval)
+
+            try:
+                self.save()
+            except Exception:
+                pass  # Try again next interval, the old snapshot is intact
+
+    def start(self):
+        """ Start revalidating and periodically saving in this process """
+
+        if self._started == os.getpid():
+            return
+
+        self._started = os.getpid()
+        targets = [self.revalidate_all, self._save_forever]
+
+        if self.lock is not None:
+            self.lock.start(targets)
+            return
+
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
@@ -0,0 +1,73 @@
+""" Report of how long each phase of starting the service takes
+
+Each phase is timed in a fresh Python process, so the numbers are those of a
+cold start rather than of modules which are already imported::
+
+    python -m route53_dyndns.startup [--json]
+
+The AWS SDK is only loaded when the first Route 53 client is built, so a
+worker can serve health checks after the 'views' phase. For a breakdown by
+module of any phase, run Python with ``-X importtime``.
+"""
+
+import json
+from optparse import OptionParser
+import subprocess
+import sys
+
+# Each phase is timed after the ones before it have run
+PHASES = (
+    ('package', 'import route53_dyndns'),
+    ('config', 'from route53_dyndns.app import load_config; load_config()'),
+    ('views', 'from route53_dyndns.app import create_app; create_app()'),
+    ('aws sdk', 'import boto3'),
+    ('client', 'from route53_dyndns.client import client_manager; '
+               'client_manager.get_client()'),
+)
+
+_SCRIPT = '''
+import json, sys, time
+timings = []
+for name, statement in json.loads(sys.argv[1]):
+    start = time.time()
+    exec(statement)
+    timings.append((name, time.time() - start))
+print(json.dumps(timings))
+'''
+
+
+def measure(phases=PHASES, python=sys.executable):
+    """ Time each phase in a new process, returning (name, seconds) pairs """
+
+    output = subprocess.check_output([python, '-c', _SCRIPT,
+                                      json.dumps(phases)])
+
+    return [tuple(timing) for timing in
+            json.loads(output.decode('utf-8').splitlines()[-1])]
+
+
+def format_report(timings):
+    lines = ['{:<10} {:>8.1f} ms'.format(name, seconds * 1000)
+             for name, seconds in timings]
+    lines.append('{:<10} {:>8.1f} ms'.format(
+        'total', sum(seconds for _, seconds in timings) * 1000))
+
+    return '\n'.join(lines)
+
+
+def main(args=sys.argv[1:]):
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--json", dest="json", action="store_true",
+                      help="Write the timings as JSON")
+
+    options, _ = parser.parse_args(args)
+    timings = measure()
+
+    if options.json:
+        print(json.dumps(dict(timings), indent=2, sort_keys=True))
+    else:
+        print(format_report(timings))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
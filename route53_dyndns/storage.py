@@ -0,0 +1,85 @@
+""" Local SQLite databases and locks shared by the worker processes """
+
+import fcntl
+import os
+import sqlite3
+import threading
+
+
+class ThreadConnections(object):
+    """ A connection to a SQLite database for each thread
+
+    SQLite connections can't be shared between threads or processes, so each
+    thread gets its own, opened again after a fork. The database is in WAL
+    mode so readers don't wait on writers, and survives the service crashing,
+    though an OS crash could lose the most recent transactions.
+    """
+
+    def __init__(self, path, schema=None):
+        self.path = path
+
+        self._local = threading.local()
+
+        if schema:
+            with self.get() as connection:
+                connection.executescript(schema)
+
+    def get(self):
+        local = self._local
+
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(self.path, timeout=30)
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.pid = os.getpid()
+
+        return local.connection
+
+
+class HostLock(object):
+    """ Lock on a file, held by at most one process on the host
+
+    Used to elect the one worker which runs a background task. The lock is
+    released by the OS when the process holding it exits, and another worker
+    takes over.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        self._held = None  # PID which holds the lock
+
+    def acquire(self, blocking=True):
+        """ Take the lock, returning False if it's held and not `blocking` """
+
+        if self._held == os.getpid():
+            return True
+
+        descriptor = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        try:
+            fcntl.flock(descriptor, fcntl.LOCK_EX | (
+                0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            os.close(descriptor)
+            return False
+
+        # The descriptor stays open for as long as this process runs
+        self._held = os.getpid()
+
+        return True
+
+    def start(self, targets):
+        """ Run each target in a thread once this process holds the lock """
+
+        def run():
+            self.acquire()
+
+            for target in targets:
+                thread = threading.Thread(target=target)
+                thread.daemon = True
+                thread.start()
+
+        thread = threading.Thread(target=run)
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,322 @@
+""" Reconciliation of Route 53 with a file of the records it should hold
+
+Setting thousands of names through '/nic/update' takes a request and a lookup
+per name. Instead, ``route53_dyndns sync`` reads the desired records from a
+file, lists each hosted zone they are in once, and sends only the records
+which differ, in as few ChangeBatches as the AWS limits allow. The zones are
+independent, so several are listed and changed at the same time.
+
+The file is either CSV, with a ``name,type,ttl,value[,value...]`` row per
+record set, or JSON lines like ``{"name": ..., "type": "A", "ttl": 300,
+"values": [...]}``. The type defaults to 'A', and a record which exists keeps
+its TTL unless one is given. Only the record sets in the file are changed,
+others in the zones are left alone.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import json
+import sys
+
+from optparse import OptionParser
+
+from route53_dyndns.addresses import same_values
+from route53_dyndns.batching import split_changes
+from route53_dyndns.cache import normalize_name
+
+DEFAULT_TTL = 300
+
+
+class SyncError(Exception):
+    pass
+
+
+def _desired(name, record_type, ttl, values, line):
+    if not name or not values:
+        raise SyncError("Line {}: need a name and a value".format(line))
+
+    try:
+        ttl = int(ttl) if ttl not in (None, '') else None
+    except ValueError:
+        raise SyncError("Line {}: invalid TTL {!r}".format(line, ttl))
+
+    return (normalize_name(name), (record_type or 'A').upper(), ttl,
+            list(values))
+
+
+def read_csv(lines):
+    """ Desired (name, type, TTL, values) from CSV rows, one at a time """
+
+    for line, row in enumerate(csv.reader(lines), 1):
+        if not row or row[0].startswith('#') or (
+                line == 1 and row[0].lower() == 'name'):
+            continue  # Blank lines, comments and a header
+
+        row += [''] * (3 - len(row))
+
+        yield _desired(row[0].strip(), row[1].strip(), row[2].strip(),
+                       [value.strip() for value in row[3:] if value.strip()],
+                       line)
+
+
+def read_jsonl(lines):
+    """ Desired (name, type, TTL, values) from JSON lines, one at a time """
+
+    for line, text in enumerate(lines, 1):
+        if not text.strip():
+            continue
+
+        try:
+            item = json.loads(text)
+            values = item.get('values', item.get('value'))
+        except (AttributeError, ValueError):
+            raise SyncError("Line {}: invalid JSON".format(line))
+
+        if not isinstance(values, list):
+            values = [values] if values else []
+
+        yield _desired(item.get('name'), item.get('type'), item.get('ttl'),
+                       values, line)
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+class Plan(object):
+    """ The changes needed to bring each hosted zone to the desired state """
+
+    def __init__(self):
+        self.changes = OrderedDict()  # zone -> [(change, existing record)]
+        self.unchanged = 0
+        self.errors = []
+
+    def __len__(self):
+        return sum(len(changes) for changes in self.changes.values())
+
+    def batches(self, hosted_zone_id, max_changes):
+        """ The zone's changes, split into the fewest ChangeBatches """
+
+        return list(split_changes(
+            [change for change, _ in self.changes.get(hosted_zone_id, ())],
+            max_changes))
+
+
+def _group_by_zone(desired, find_hosted_zone, plan):
+    """ Group the desired records by zone, the last for a record winning """
+
+    by_zone = OrderedDict()  # zone -> {(name, type): (ttl, values)}
+
+    for name, record_type, ttl, values in desired:
+        hosted_zone_id = find_hosted_zone(name)
+
+        if not hosted_zone_id:
+            plan.errors.append("No hosted zone for '{}'".format(name))
+            continue
+
+        by_zone.setdefault(hosted_zone_id, OrderedDict())[
+            (name, record_type)] = (ttl, values)
+
+    return by_zone
+
+
+def _diff_zone(hosted_zone_id, wanted, resource_records, plan):
+    existing = {}
+
+    for resource_record in resource_records:
+        key = (normalize_name(resource_record['Name']),
+               resource_record['Type'])
+
+        if key in wanted:
+            existing.setdefault(key, []).append(resource_record)
+
+    changes = []
+
+    for (name, record_type), (ttl, values) in wanted.items():
+        current = existing.get((name, record_type), [])
+
+        if len(current) > 1:
+            plan.errors.append("'{}' has {} {} record sets, not syncing it"
+                               .format(name, len(current), record_type))
+            continue
+
+        if current and 'ResourceRecords' not in current[0]:
+            plan.errors.append("'{}' is an alias {} record, not syncing it"
+                               .format(name, record_type))
+            continue
+
+        resource_record = current[0] if current else None
+
+        if resource_record is not None and same_values(
+                resource_record, values) and ttl in (
+                None, resource_record.get('TTL')):
+            plan.unchanged += 1
+            continue
+
+        updated = dict(resource_record or {
+            'Name': name + '.', 'Type': record_type, 'TTL': DEFAULT_TTL})
+        updated['ResourceRecords'] = [{'Value': value} for value in values]
+
+        if ttl is not None:
+            updated['TTL'] = ttl
+
+        changes.append(({'Action': 'UPSERT', 'ResourceRecordSet': updated},
+                        resource_record))
+
+    if changes:
+        plan.changes[hosted_zone_id] = changes
+
+
+def plan_sync(desired, client, concurrency=4):
+    """ Compare the desired records with Route 53, returning a Plan
+
+    Each zone with desired records is listed once, `concurrency` at a time.
+    """
+
+    from route53_dyndns import route53
+
+    plan = Plan()
+    by_zone = _group_by_zone(
+        desired, lambda name: route53.find_hosted_zone(name, client), plan)
+
+    def list_zone(hosted_zone_id):
+        return list(route53.list_resource_records(hosted_zone_id, client))
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        listings = [(hosted_zone_id, executor.submit(list_zone,
+                                                     hosted_zone_id))
+                    for hosted_zone_id in by_zone]
+
+        for hosted_zone_id, listing in listings:
+            try:
+                resource_records = listing.result()
+            except Exception as e:
+                plan.errors.append("Failed to list zone {}: {}".format(
+                    hosted_zone_id, e))
+                continue
+
+            _diff_zone(hosted_zone_id, by_zone[hosted_zone_id],
+                       resource_records, plan)
+
+    return plan
+
+
+def apply_plan(plan, client, concurrency=4, max_changes=1000):
+    """ Send the planned changes, `concurrency` zones at a time
+
+    Each zone's batches are sent one after another. Returns the number of
+    changes made, and adds any failures to the plan's errors.
+    """
+
+    from route53_dyndns import route53
+
+    def apply_zone(hosted_zone_id):
+        applied = 0
+
+        for batch in plan.batches(hosted_zone_id, max_changes):
+            route53.change_resource_records(hosted_zone_id, batch, client)
+            applied += len(batch)
+
+        return applied
+
+    applied = 0
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = [(hosted_zone_id, executor.submit(apply_zone,
+                                                    hosted_zone_id))
+                   for hosted_zone_id in plan.changes]
+
+        for hosted_zone_id, result in results:
+            try:
+                applied += result.result()
+            except Exception as e:
+                plan.errors.append("Failed to change zone {}: {}".format(
+                    hosted_zone_id, e))
+
+    return applied
+
+
+def _format_values(resource_record):
+    if resource_record is None:
+        return '(none)'
+
+    return '{} TTL {}'.format(
+        ','.join(value['Value']
+                 for value in resource_record['ResourceRecords']),
+        resource_record.get('TTL'))
+
+
+def format_plan(plan, max_changes=1000):
+    """ Describe the planned changes, a line per change """
+
+    lines = []
+
+    for hosted_zone_id, changes in plan.changes.items():
+        lines.append("{}: {} changes in {} batches".format(
+            hosted_zone_id, len(changes),
+            len(plan.batches(hosted_zone_id, max_changes))))
+
+        for change, existing in changes:
+            resource_record = change['ResourceRecordSet']
+            lines.append("  UPSERT {} {}: {} -> {}".format(
+                resource_record['Name'], resource_record['Type'],
+                _format_values(existing), _format_values(resource_record)))
+
+    lines.append("{} to change, {} unchanged, {} errors".format(
+        len(plan), plan.unchanged, len(plan.errors)))
+
+    return '\n'.join(lines)
+
+
+def main(args=sys.argv[1:], client=None, stdout=sys.stdout):
+    """ Entry point for the sync subcommand, returning the exit status """
+
+    parser = OptionParser(usage="%prog sync [options] FILE")
+    parser.add_option("-n", "--dry-run", dest="dry_run", action="store_true",
+                      help="Print the changes without making them")
+    parser.add_option("-f", "--format", dest="format", choices=list(READERS),
+                      help="File format, csv or jsonl [from the extension]")
+    parser.add_option("-c", "--concurrency", dest="concurrency", type="int",
+                      default=4, help="Zones to sync at a time [%default]")
+    parser.add_option("--max-changes", dest="max_changes", type="int",
+                      default=1000,
+                      help="Most changes in a ChangeBatch [%default]")
+
+    (options, parsed_args) = parser.parse_args(args)
+
+    if len(parsed_args) != 1:
+        parser.error("Need the desired state file")
+
+    path = parsed_args[0]
+    file_format = options.format or (
+        'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+
+    if client is None:  # pragma: no cover
+        from route53_dyndns.route53 import get_client
+        client = get_client()
+
+    try:
+        with open(path) as lines:
+            # Parsed a line at a time, so only the records are held in memory
+            plan = plan_sync(READERS[file_format](lines), client,
+                             options.concurrency)
+    except (IOError, SyncError) as e:
+        stdout.write("{}\n".format(e))
+        return 2
+
+    for error in plan.errors:
+        stdout.write("Error: {}\n".format(error))
+
+    stdout.write(format_plan(plan, options.max_changes) + '\n')
+
+    if not options.dry_run and len(plan):
+        planning_errors = len(plan.errors)
+        applied = apply_plan(plan, client, options.concurrency,
+                             options.max_changes)
+
+        for error in plan.errors[planning_errors:]:
+            stdout.write("Error: {}\n".format(error))
+
+        stdout.write("Applied {} of {} changes\n".format(applied, len(plan)))
+
+    return 1 if plan.errors else 0
@@ -0,0 +1,187 @@
+""" Blocking of user agents by exact string, glob or regular expression
+
+Rules are plain strings which must match the whole user agent, or patterns
+with a prefix::
+
+    BAD_USER_AGENTS = [
+        'BrokenRouter/1.0',           # Exact match
+        'glob:AcmeFirmware/2.[0-3]*',  # Glob, matching the whole user agent
+        're:^Foo.*bar$',              # Regular expression, searched for
+    ]
+
+All of the patterns are compiled into a single regular expression, so checking
+a user agent is one match however many rules there are, and the verdict for
+each user agent string is cached since a fleet of routers only sends a few
+distinct ones.
+"""
+
+from fnmatch import translate
+import os
+import re
+import threading
+import time
+
+GLOB_PREFIX = 'glob:'
+REGEX_PREFIX = 're:'
+
+# Flags at the start of a rule, which would apply to the other rules as well
+_GLOBAL_FLAGS = re.compile(r'\A\(\?([aiLmsux]+)\)')
+# Backreferences, which would refer to the wrong group once rules are combined
+_BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def _regex(rule):
+    pattern = rule[len(REGEX_PREFIX):]
+
+    if _BACKREFERENCE.search(pattern.replace('\\\\', '')):
+        raise ValueError("Bad user agent rule {!r}: backreferences aren't "
+                         "supported".format(rule))
+
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        raise ValueError("Bad user agent rule {!r}: {}".format(rule, e))
+
+    flags = _GLOBAL_FLAGS.match(pattern)
+
+    if flags:
+        # Scope the flags to the rule, like '(?i)curl' to '(?i:curl)'
+        return '(?{}:{})'.format(flags.group(1), pattern[flags.end():])
+
+    return '(?:{})'.format(pattern)
+
+
+def compile_rules(rules):
+    """ Compile rules into (set of exact user agents, combined regex or None)
+
+    Raises ValueError if a regular expression rule is invalid, or can't be
+    combined with the others.
+    """
+
+    exact = set()
+    patterns = []
+
+    for rule in rules:
+        if rule.startswith(GLOB_PREFIX):
+            patterns.append(r'\A(?:{})'.format(translate(
+                rule[len(GLOB_PREFIX):])))
+        elif rule.startswith(REGEX_PREFIX):
+            patterns.append(_regex(rule))
+        else:
+            exact.add(rule)
+
+    if not patterns:
+        return frozenset(exact), None
+
+    try:
+        return frozenset(exact), re.compile('|'.join(patterns))
+    except re.error as e:
+        # Like flags in the middle of a rule, or a group name used twice
+        raise ValueError("Bad user agent rules: {}".format(e))
+
+
+class UserAgentMatcher(object):
+    """ Compiled rules with a bounded cache of verdicts """
+
+    def __init__(self, rules, cache_size=1000):
+        self.rules = tuple(rules)
+        self.cache_size = cache_size
+
+        self._exact, self._pattern = compile_rules(self.rules)
+        self._verdicts = {}
+
+    def is_blocked(self, user_agent):
+        try:
+            return self._verdicts[user_agent]
+        except KeyError:
+            pass
+
+        blocked = user_agent in self._exact or bool(
+            self._pattern and self._pattern.search(user_agent))
+
+        if len(self._verdicts) >= self.cache_size:
+            # Clients with random user agents shouldn't grow the cache, and
+            # the real fleet's user agents are back in it after one request
+            self._verdicts.clear()
+
+        self._verdicts[user_agent] = blocked
+
+        return blocked
+
+
+class UserAgentBlocklist(object):
+    """ User agent rules from the config and an optional file of rules
+
+    `rules` is called to get the rules from the config, which are recompiled
+    whenever the setting is replaced. The file has one rule per line, ignoring
+    blank lines and lines starting with '#', and is checked for changes at
+    most every `reload_interval` seconds.
+    """
+
+    def __init__(self, rules, path=None, reload_interval=5, cache_size=1000,
+                 clock=time.time):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.cache_size = cache_size
+
+        self._rules = rules
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._source = None  # Rules from the config the matcher was built for
+        self._file_rules = ()
+        self._version = None  # (mtime, size) of the loaded file
+        self._checked = None
+        self._matcher = None
+
+        if path:
+            self._load_file()
+
+    def _load_file(self):
+        stat = os.stat(self.path)
+        version = (stat.st_mtime, stat.st_size)
+
+        if version != self._version:
+            with open(self.path) as rules_file:
+                rules = tuple(line.strip() for line in rules_file
+                              if line.strip() and
+                              not line.strip().startswith('#'))
+
+            compile_rules(rules)  # Check the rules before using them
+            self._file_rules = rules
+            self._version = version
+            self._matcher = None
+
+        self._checked = self._clock()
+
+    def _maybe_reload(self):
+        if not self.path or (
+                self._clock() - self._checked < self.reload_interval):
+            return
+
+        try:
+            self._load_file()
+        except (IOError, OSError, ValueError):
+            # Keep the current rules until the file is fixed
+            self._checked = self._clock()
+
+    def get_matcher(self):
+        """ Get the matcher for the current rules """
+
+        self._maybe_reload()
+
+        source = self._rules()
+        matcher = self._matcher
+
+        if matcher is None or source is not self._source:
+            with self._lock:
+                matcher = UserAgentMatcher(tuple(source) + self._file_rules,
+                                           self.cache_size)
+                self._matcher = matcher
+                self._source = source
+
+        return matcher
+
+    def is_blocked(self, user_agent):
+        """ Check whether a user agent is blocked """
+
+        return self.get_matcher().is_blocked(user_agent)
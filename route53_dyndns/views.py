@@ -2,30 +2,165 @@
 
 from __future__ import unicode_literals
 
+from concurrent.futures import Future
 from functools import wraps
-
-from flask import request
-
-from route53_dyndns.app import app
+import hmac
+import logging
+import time
+
+from flask import g, request, Response
+
+from route53_dyndns.addresses import (
+    AddressParser, format_addresses, record_values, same_values)
+from route53_dyndns.app import load_config
+from route53_dyndns.cache import normalize_name
+from route53_dyndns.credentials import CredentialStore, User
+from route53_dyndns.history import UpdateHistory
+from route53_dyndns.logs import NoChangeSampler
+from route53_dyndns.metrics import registry
+from route53_dyndns.profiling import Profiler
+from route53_dyndns.proxies import ClientResolver, NetworkSet
+from route53_dyndns.ratelimit import SharedTokenBuckets, TokenBuckets
+from route53_dyndns.snapshot import LastSeen, StateSnapshot
+from route53_dyndns.storage import HostLock
+from route53_dyndns.useragents import UserAgentBlocklist
 from route53_dyndns import route53
 
+app = load_config()
+logger = logging.getLogger(__name__)
+nochg_sampler = NoChangeSampler(app.config['LOG_NOCHG_SAMPLE_RATE'])
+logger.addFilter(nochg_sampler)
+
 AUTH_REALM = "Route 53 DNS Update API"
 
+ABUSE = 'abuse'
 BAD_AUTH = 'badauth'
+BAD_IP = 'badip'
 BAD_USER_AGENT = 'badagent'
 IP_CHANGED = 'good %s'
 NO_CHANGE = 'nochg %s'
 NO_HOST = 'nohost'
 NOT_SUPPORTED = '!donator'
+TOO_MANY_HOSTS = 'numhost'
 GENERAL_ERROR = '911'
+UNKNOWN_CHANGE = 'unknown'
+
+REQUEST_SECONDS = registry.histogram('dyndns_request_seconds',
+                                     "Time taken to handle update requests")
+RESPONSES = registry.counter('dyndns_responses_total',
+                             "Responses to update requests by code", 'code')
+
+if app.config['CREDENTIALS_FILE']:
+    credential_store = CredentialStore(
+        app.config['CREDENTIALS_FILE'],
+        cache_ttl=app.config['CREDENTIALS_CACHE_TTL'],
+        cache_max_size=app.config['CREDENTIALS_CACHE_MAX_SIZE'],
+        reload_interval=app.config['CREDENTIALS_RELOAD_INTERVAL'])
+else:
+    credential_store = None
+
+if not app.config['RATE_LIMIT_ENABLED']:
+    rate_limiter = None
+elif app.config['RATE_LIMIT_SHARED_FILE']:
+    rate_limiter = SharedTokenBuckets(
+        app.config['RATE_LIMIT_SHARED_FILE'], app.config['RATE_LIMIT_RATE'],
+        app.config['RATE_LIMIT_BURST'],
+        slots=app.config['RATE_LIMIT_MAX_SIZE'])
+else:
+    rate_limiter = TokenBuckets(
+        app.config['RATE_LIMIT_RATE'], app.config['RATE_LIMIT_BURST'],
+        max_size=app.config['RATE_LIMIT_MAX_SIZE'])
+
+if app.config['FLAP_MAX_UPDATES']:
+    update_history = UpdateHistory(
+        app.config['FLAP_MAX_UPDATES'], app.config['FLAP_WINDOW'],
+        max_size=app.config['FLAP_HISTORY_MAX_SIZE'],
+        path=app.config['FLAP_HISTORY_FILE'],
+        backend=route53.shared_cache)
+else:
+    update_history = None
+
+last_seen = LastSeen(max_size=app.config['SNAPSHOT_MAX_CLIENTS'])
+
+if app.config['SNAPSHOT_FILE']:
+    state_snapshot = StateSnapshot(
+        app.config['SNAPSHOT_FILE'], route53.hosted_zones,
+        route53.record_cache, last_seen, route53.revalidate_zone,
+        interval=app.config['SNAPSHOT_INTERVAL'],
+        revalidate_rate=app.config['SNAPSHOT_REVALIDATE_RATE'],
+        cache_records=app.config['RECORD_CACHE_ENABLED'],
+        lock=HostLock(app.config['SNAPSHOT_FILE'] + '.lock'))
+    state_snapshot.load()
+else:
+    state_snapshot = None
+
+client_resolver = ClientResolver(app.config['TRUSTED_PROXIES'])
+
+if app.config['CLIENT_NETWORKS'] is not None:
+    client_networks = NetworkSet(app.config['CLIENT_NETWORKS'])
+else:
+    client_networks = None
+
+profiler = Profiler(enabled=app.config['PROFILE_PHASES'],
+                    directory=app.config['PROFILE_DIR'],
+                    threshold=app.config['PROFILE_THRESHOLD'],
+                    sample_rate=app.config['PROFILE_SAMPLE_RATE'],
+                    max_dumps=app.config['PROFILE_MAX_DUMPS'])
+
+address_parser = AddressParser(reject_bogons=app.config['REJECT_BOGON_IPS'])
+
+bad_user_agents = UserAgentBlocklist(
+    lambda: app.config['BAD_USER_AGENTS'],
+    path=app.config['BAD_USER_AGENTS_FILE'],
+    reload_interval=app.config['BAD_USER_AGENTS_RELOAD_INTERVAL'],
+    cache_size=app.config['BAD_USER_AGENTS_CACHE_SIZE'])
+bad_user_agents.get_matcher()  # Bad rules should fail at startup
+
+
+class Rejected(Exception):
+    """ A host's lookup was refused, with the response to give for it """
+
+    def __init__(self, response):
+        super(Rejected, self).__init__(response)
+        self.response = response
+
+
+def _rejected(response):
+    future = Future()
+    future.set_exception(Rejected(response))
+
+    return future
+
+
+def _equal(value, expected):
+    return hmac.compare_digest(value.encode('utf-8'),
+                               expected.encode('utf-8'))
 
 
 def verify_auth(username, password):
-    """ Verify the HTTP Basic Auth credentials """
+    """ Verify the HTTP Basic Auth credentials, returning the User or None """
+
+    if credential_store is not None:
+        return credential_store.verify(username, password)
 
     config = app.config
 
-    return username == config['USERNAME'] and password == config['PASSWORD']
+    # Always compare both, so a bad username takes as long as a bad password
+    if _equal(username, config['USERNAME']) & _equal(password,
+                                                     config['PASSWORD']):
+        return User(username, None)
+
+    return None
+
+
+def parse_hostnames(value):
+    """ Split a comma separated list of hostnames, ignoring empty values """
+
+    if not value:
+        return []
+
+    return [hostname.strip() for hostname in value.split(',')
+            if hostname.strip()]
 
 
 def authenticate_response(forbidden=False):
@@ -48,54 +183,443 @@ def api_auth(view):
         if not auth:  # Auth is required at all times
             return authenticate_response()
 
-        if not verify_auth(auth.username, auth.password):
+        with profiler.phase('auth'):
+            user = verify_auth(auth.username, auth.password)
+
+        if not user:
+            log_refused(auth.username, request.args.get('hostname'),
+                        BAD_AUTH)
             return authenticate_response(forbidden=True)
 
+        g.user = user
+
         return view(*args, **kwargs)
 
     return decorated
 
 
+def count_responses(body):
+    """ Count the response code for each host in a response body """
+
+    for line in body.split('\n'):
+        RESPONSES.inc(line.split(' ', 1)[0])
+
+
+def start_background_tasks():
+    """ Start this process's background threads, if they aren't running """
+
+    registry.start()
+
+    if state_snapshot is not None:
+        state_snapshot.start()
+
+    if route53.applier is not None:
+        route53.applier.start()
+
+    if route53.change_tracker is not None:
+        route53.change_tracker.start()
+
+    if route53.zone_watcher is not None:
+        route53.zone_watcher.start()
+
+
+def instrumented(view):
+    """ Decorator to time an update view and count its response codes """
+
+    @wraps(view)
+    def decorated(*args, **kwargs):
+        start_background_tasks()
+
+        with REQUEST_SECONDS.time(), profiler.request():
+            rv = view(*args, **kwargs)
+
+        count_responses(rv[0] if isinstance(rv, tuple) else rv)
+
+        return rv
+
+    return decorated
+
+
+def check_update_request(args, user_agent):
+    """ Check an update request before any records are looked up
+
+    Returns a (response, hostnames) pair, where the response is set if the
+    request can be answered without looking up any records.
+    """
+
+    if args.get('offline'):
+        return NOT_SUPPORTED, None
+
+    if not user_agent or bad_user_agents.is_blocked(user_agent):
+        return BAD_USER_AGENT, None
+
+    hostnames = parse_hostnames(args.get('hostname'))
+
+    if not hostnames:
+        return NO_HOST, None
+
+    if len(hostnames) > app.config['MAX_HOSTNAMES']:
+        return TOO_MANY_HOSTS, None
+
+    return None, hostnames
+
+
+def check_client_address(remote_addr, forwarded=None, x_forwarded_for=None):
+    """ Find the client's address from behind any trusted proxies
+
+    Returns a (response, address) pair, where the response is set if the
+    address doesn't match the CLIENT_NETWORKS policy and it is to reject them.
+    The address is None if the forwarding headers were invalid.
+    """
+
+    address = client_resolver.resolve(remote_addr, forwarded,
+                                      x_forwarded_for)
+
+    if client_networks is not None and (
+            address is None or address not in client_networks):
+        logger.warning("Client address %s (via %s) is outside of the "
+                       "client networks", address, remote_addr)
+
+        if app.config['CLIENT_POLICY'] == 'reject':
+            return ABUSE, address
+
+    return None, address
+
+
+def check_myip(value):
+    """ Validate and normalize the addresses a client asked for
+
+    Returns a (response, addresses) pair, where the response is set if the
+    addresses are invalid or refused, and the addresses are a tuple of (record
+    type, addresses) pairs.
+    """
+
+    try:
+        return None, address_parser.parse(value)
+    except ValueError:
+        return BAD_IP, None
+
+
+def check_hostname(user, hostname, remote_addr):
+    """ Check whether a hostname may be looked up and updated
+
+    Returns the response to refuse the hostname with, or None.
+    """
+
+    if not user.may_update(hostname):
+        # Treated like a hostname which doesn't exist, so users can't find out
+        # which hostnames belong to someone else
+        return NO_HOST
+
+    if rate_limiter is not None:
+        key = '{}\0{}\0{}'.format(user.username, normalize_name(hostname),
+                                  remote_addr)
+
+        if not rate_limiter.allow(key):
+            return ABUSE
+
+    return None
+
+
+def find_resource_records(user, hostnames, remote_addr=None,
+                          record_types=('A',)):
+    """ Look up the records for hostnames, if the user may update them
+
+    Returns a future for the record of each of the record types for each
+    hostname, in the same order.
+    """
+
+    refusals = [check_hostname(user, hostname, remote_addr)
+                for hostname in hostnames]
+    allowed = [hostname for hostname, refusal in zip(hostnames, refusals)
+               if not refusal]
+    lookups = iter(route53.find_resource_records(
+        [hostname for hostname in allowed for _ in record_types],
+        record_types=[record_type for _ in allowed
+                      for record_type in record_types]))
+
+    return [_rejected(refusal) if refusal else next(lookups)
+            for refusal in refusals for _ in record_types]
+
+
+def _found_records(lookups):
+    """ The records found for a host, or the response to give instead """
+
+    found = []
+
+    for lookup in lookups:
+        try:
+            resource_record = lookup.result()
+        except Rejected as e:
+            return e.response, None
+        except ValueError:
+            return NO_HOST, None
+        except Exception:
+            return GENERAL_ERROR, None
+
+        found.append(resource_record)
+
+    if not any(found):
+        return NO_HOST, None
+
+    return None, found
+
+
+def check_resource_records(lookups, addresses):
+    """ Decide which hosts need an update from their completed lookups
+
+    `lookups` has the lookup for each of the record types in `addresses` for
+    each host. A host only needs one of the record types to exist, and the
+    others are left alone. Returns the response for each host, which is None
+    where an update is needed, and a list of (index, resource record, values)
+    to update.
+    """
+
+    myip = format_addresses(addresses)
+    responses = [None] * (len(lookups) // len(addresses))
+    updates = []
+
+    for index in range(len(responses)):
+        response, found = _found_records(
+            lookups[index * len(addresses):(index + 1) * len(addresses)])
+
+        if response:
+            responses[index] = response
+            continue
+
+        current = []
+        changed = False
+
+        for resource_record, (_, values) in zip(found, addresses):
+            if not resource_record:
+                continue
+
+            last_seen.seen(resource_record['Name'], myip)
+
+            if same_values(resource_record, values):
+                current.extend(values)
+            elif update_history is not None and (
+                    update_history.held_down(resource_record)):
+                # Flapping, so keep the current value until the hold-down ends
+                current.extend(sorted(record_values(resource_record)))
+            else:
+                updates.append((index, resource_record, values))
+                changed = True
+
+        if not changed:
+            responses[index] = NO_CHANGE % ','.join(current)
+
+    return responses, updates
+
+
+def check_update_results(responses, updates, results, myip):
+    """ Fill in the responses for hosts from their completed updates """
+
+    failed = set()
+
+    for (index, resource_record, _), result in zip(updates, results):
+        try:
+            updated = result.result()
+        except Exception:
+            updated = False
+
+        if updated and update_history is not None:
+            update_history.record(resource_record)
+
+        if not updated:
+            failed.add(index)
+
+    for index, _, _ in updates:
+        responses[index] = GENERAL_ERROR if index in failed else (
+            IP_CHANGED % myip)
+
+    return responses
+
+
+def log_refused(username, hostname, response, client=None):
+    """ Log a request which was answered before any lookups
+
+    Returns the response, so refusals can be logged as they are returned.
+    """
+
+    logger.info("Refused update of %s", hostname, extra={
+        'user': username, 'hostname': hostname, 'client': client,
+        'decision': response.split(' ', 1)[0]})
+
+    return response
+
+
+def _error_class(future):
+    """ Class name of a completed future's error, unless it was refused """
+
+    exception = future.exception()
+
+    if exception is None or isinstance(exception, Rejected):
+        return None
+
+    return exception.__class__.__name__
+
+
+def log_decisions(username, hostnames, responses, client, lookups, updates,
+                  results, seconds):
+    """ Log the decision made for each hostname in an update request
+
+    Each line has the addresses the host had and the ones it has now, and the
+    class of any error looking it up or updating it. `seconds` is how long
+    the lookups and updates took, whether they were answered from the caches
+    or by Route 53.
+    """
+
+    failed = {}
+
+    for (index, _, _), result in zip(updates, results):
+        failed[index] = failed.get(index) or _error_class(result)
+    per_host = len(lookups) // len(hostnames)
+
+    for index, (hostname, response) in enumerate(zip(hostnames, responses)):
+        old, error = [], failed.get(index)
+
+        for lookup in lookups[index * per_host:(index + 1) * per_host]:
+            if not lookup.done():
+                continue  # Not needed once another lookup for it failed
+
+            if lookup.exception() is not None:
+                error = error or _error_class(lookup)
+            elif lookup.result():
+                old.extend(sorted(record_values(lookup.result())))
+
+        decision, _, new = response.partition(' ')
+        logger.info("Update of %s: %s", hostname, decision, extra={
+            'user': username, 'hostname': hostname, 'client': client,
+            'decision': decision, 'old': ','.join(old) or None,
+            'new': new or None, 'backend_ms': round(seconds * 1000, 1),
+            'error': error})
+
+
 @app.route('/nic/update/', methods=['GET'])
 @app.route('/nic/update', methods=['GET'])
+@instrumented
 @api_auth
 def nic_update():
-    """ Update a dynamic DNS record """
+    """ Update the dynamic DNS records for one or more hostnames """
 
-    if request.args.get('offline'):
-        return NOT_SUPPORTED
+    username, hostname = g.user.username, request.args.get('hostname')
 
-    # Check for a user agent
-    user_agent = request.user_agent.string
+    with profiler.phase('request'):
+        response, hostnames = check_update_request(request.args,
+                                                   request.user_agent.string)
 
-    if not user_agent:
-        print("WTF")
-    if not user_agent or user_agent in app.config['BAD_USER_AGENTS']:
-        return BAD_USER_AGENT
+    if response:
+        return log_refused(username, hostname, response)
 
-    try:
-        hostname = request.args.get('hostname')
-        resource_record = route53.find_resource_record(hostname)
-    except ValueError:
-        return NO_HOST
-    except:
-        return GENERAL_ERROR
+    with profiler.phase('client'):
+        response, client = check_client_address(
+            request.remote_addr,
+            ', '.join(request.headers.getlist('Forwarded')),
+            ', '.join(request.headers.getlist('X-Forwarded-For')))
+
+        if not response:
+            response, addresses = check_myip(request.args.get('myip',
+                                                              client))
+
+    if response:
+        return log_refused(username, hostname, response, client)
+
+    started = time.time()
+
+    with profiler.phase('find'):
+        lookups = find_resource_records(
+            g.user, hostnames, client,
+            [record_type for record_type, _ in addresses])
+        responses, updates = check_resource_records(lookups, addresses)
+
+    results = []
+
+    if updates:
+        with profiler.phase('update'):
+            results = route53.update_resource_records(
+                [(resource_record, list(values))
+                 for _, resource_record, values in updates], user=username)
+            check_update_results(responses, updates, results,
+                                 format_addresses(addresses))
+
+    with profiler.phase('log'):
+        log_decisions(username, hostnames, responses, client, lookups,
+                      updates, results, time.time() - started)
+
+    # Each hostname gets its own line in the response, in the order given
+    return '\n'.join(responses)
+
+
+def change_statuses(user, hostnames):
+    """ The status of the latest change to each hostname, one per line
+
+    Each line is the change's status and ID, like 'INSYNC C2682N5HXP0BZ4',
+    or 'unknown' if there's no recent change to the hostname.
+    """
+
+    statuses = route53.change_tracker.status(hostnames)
+    responses = []
+
+    for hostname, status in zip(hostnames, statuses):
+        if not user.may_update(hostname):
+            responses.append(NO_HOST)
+        elif status is None:
+            responses.append(UNKNOWN_CHANGE)
+        else:
+            responses.append('{} {}'.format(*status))
+
+    return responses
 
-    if not resource_record:
+
+@app.route('/nic/status/', methods=['GET'])
+@app.route('/nic/status', methods=['GET'])
+@api_auth
+def nic_status():
+    """ Whether the latest changes to hostnames are live on Route 53 """
+
+    if route53.change_tracker is None:
+        return 'Not Found', 404, {}
+
+    start_background_tasks()
+
+    hostnames = parse_hostnames(request.args.get('hostname'))
+
+    if not hostnames:
         return NO_HOST
 
-    # TODO - A sanity check of the value would be good, but good luck doing it
-    #        easily in anything before Python 3.3+ which got 'ipaddress' module
-    # TODO - Comma separated values should be allowed
-    myip = request.args.get('myip', request.remote_addr)
+    if len(hostnames) > app.config['MAX_HOSTNAMES']:
+        return TOO_MANY_HOSTS
 
-    if myip == resource_record['ResourceRecords'][0]['Value']:
-        return NO_CHANGE % myip
+    return '\n'.join(change_statuses(g.user, hostnames))
 
-    try:
-        if not route53.update_resource_record(resource_record, myip):
-            return GENERAL_ERROR
-    except:
-        return GENERAL_ERROR
 
-    return IP_CHANGED % myip
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+@api_auth
+def admin_profiling():
+    """ Whether requests are being profiled, switched with 'enabled' """
+
+    if profiler.directory is None:
+        return 'Not Found', 404, {}
+
+    if g.user.username not in app.config['ADMIN_USERS']:
+        return 'Forbidden', 403, {}
+
+    if request.method == 'POST':
+        profiler.switch(request.values.get('enabled') in ('1', 'true', 'on'))
+
+    return 'on' if profiler.is_profiling() else 'off'
+
+
+@app.route('/health', methods=['GET'])
+def health():
+    """ Answers once the worker can serve, without loading or calling AWS """
+
+    return 'OK'
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """ Metrics for all of the worker processes, for Prometheus to scrape """
+
+    return Response(registry.render(), mimetype='text/plain')
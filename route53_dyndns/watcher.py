@@ -0,0 +1,134 @@
+""" Background refreshing of the cached zones, for changes made elsewhere
+
+Records can be changed outside of this service, from the console or by other
+tools, so a cached zone can't be trusted for long on its own. The watcher
+lists each cached zone again on a schedule and applies only the differences
+to the record cache, which keeps the zone fresh, so the cache's TTL can be
+long without its records going stale.
+
+Each zone is listed again `min_interval` seconds after it was loaded. The
+interval doubles each time the zone turns out not to have changed, up to
+`max_interval`, and goes back to `min_interval` as soon as it has, since a
+zone someone is working on is likely to change again soon.
+"""
+
+import os
+import threading
+import time
+
+from route53_dyndns.metrics import registry
+
+REFRESHES = registry.counter('zone_refreshes_total',
+                             "Listings of cached zones to find changes")
+REFRESH_ERRORS = registry.counter('zone_refresh_errors_total',
+                                  "Listings of cached zones which failed")
+EXTERNAL_CHANGES = registry.counter(
+    'zone_external_changes_total',
+    "Records found changed outside of this worker, by zone", 'zone')
+
+
+class ZoneWatcher(object):
+    """ Keeps the zones in a RecordCache up-to-date with Route 53
+
+    `list_zone` is called with a zone ID and returns all of its records.
+    `changed` is called with the zone ID and record key of each record which
+    was changed outside of this worker. Every worker has its own cache, so
+    changes made through the other workers are found like any other.
+    """
+
+    def __init__(self, record_cache, list_zone, min_interval=30,
+                 max_interval=600, changed=None, clock=time.time):
+        self.record_cache = record_cache
+        self.list_zone = list_zone
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.changed = changed
+        self.last_sync = {}  # Zone ID -> when it was last listed
+        self.external_changes = 0
+
+        self._clock = clock
+        self._schedule = {}  # Zone ID -> (next refresh, interval)
+        self._started = None  # PID the refresh thread was started in
+
+    def due(self):
+        """ IDs of the cached zones which are due to be listed again """
+
+        now = self._clock()
+        zones = self.record_cache.zones()
+
+        for zone_id in set(self._schedule) - set(zones):
+            del self._schedule[zone_id]  # No longer cached
+
+        for zone_id in zones:
+            self._schedule.setdefault(zone_id, (now + self.min_interval,
+                                                self.min_interval))
+
+        return sorted(zone_id for zone_id, (next_refresh, _)
+                      in self._schedule.items() if next_refresh <= now)
+
+    def refresh(self, zone_id):
+        """ List a zone again, returning how many of its records changed """
+
+        REFRESHES.inc()
+
+        started = self._clock()
+        changed = self.record_cache.refresh_zone(
+            zone_id, list(self.list_zone(zone_id)), since=started)
+
+        now = self._clock()
+        interval = self._schedule.get(zone_id, (0, self.min_interval))[1]
+
+        if changed:
+            interval = self.min_interval
+            EXTERNAL_CHANGES.inc(zone_id, len(changed))
+            self.external_changes += len(changed)
+        else:
+            interval = min(self.max_interval, interval * 2)
+
+        self._schedule[zone_id] = (now + interval, interval)
+        self.last_sync[zone_id] = now
+
+        if self.changed:
+            for key in changed:
+                self.changed(zone_id, key)
+
+        return len(changed)
+
+    def refresh_once(self):
+        """ List the zones which are due, returning how many were listed """
+
+        zones = self.due()
+
+        for zone_id in zones:
+            try:
+                self.refresh(zone_id)
+            except Exception:
+                REFRESH_ERRORS.inc()
+
+                # Try again soon, without changing how quiet the zone is
+                interval = self._schedule[zone_id][1]
+                self._schedule[zone_id] = (
+                    self._clock() + self.min_interval, interval)
+
+        return len(zones)
+
+    def _refresh_forever(self):
+        while True:
+            try:
+                self.refresh_once()
+            except Exception:
+                pass  # Try again later
+
+            time.sleep(min(1.0, self.min_interval / 2.0))
+
+    def start(self):
+        """ Start watching the cached zones in this process """
+
+        if self._started == os.getpid():
+            return
+
+        self._started = os.getpid()
+
+        thread = threading.Thread(target=self._refresh_forever)
+        thread.daemon = True
+        thread.start()
@@ -0,0 +1,269 @@
+""" Durable local queue of changes, applied to Route 53 in the background
+
+In the "accept and apply" mode, updates are answered as soon as their change
+is safely in the queue, and a background applier sends the queued changes to
+Route 53. The queue is a SQLite database in WAL mode, so queued changes
+survive restarts and crashes of the service, and can be shared by all of the
+worker processes on a host, with one of them elected to apply the changes.
+
+There is at most one queued change per record, so a record which changes
+again before its change is applied only has its latest value sent. Each
+change is claimed by one applier at a time for a lease, and a change whose
+applier dies is picked up again once its lease runs out.
+"""
+
+import json
+import os
+import threading
+import time
+
+from route53_dyndns.cache import record_key
+from route53_dyndns.metrics import registry
+from route53_dyndns.storage import ThreadConnections
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS changes (
+    key TEXT PRIMARY KEY,
+    zone_id TEXT NOT NULL,
+    change TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    enqueued REAL NOT NULL,
+    attempts INTEGER NOT NULL,
+    available REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS changes_available ON changes (available);
+'''
+
+APPLIED = registry.counter('work_queue_applied_total',
+                           "Queued changes applied to Route 53")
+FAILED = registry.counter('work_queue_failed_total',
+                          "Attempts to apply queued changes which failed")
+DROPPED = registry.counter('work_queue_dropped_total',
+                           "Queued changes dropped after too many failures")
+
+
+def change_key(hosted_zone_id, change):
+    """ Queue key for a change, the same for every change to a record """
+
+    zone_id, name, record_type, set_identifier = record_key(
+        hosted_zone_id, change['ResourceRecordSet'])
+
+    return '\0'.join((zone_id, name, record_type, set_identifier or ''))
+
+
+class WorkQueue(object):
+    """ SQLite backed queue of changes, with one pending change per record
+
+    Claimed changes aren't available to other appliers for `lease` seconds.
+    """
+
+    def __init__(self, path, lease=60, clock=time.time):
+        self.path = path
+        self.lease = lease
+
+        self._clock = clock
+        self._connections = ThreadConnections(path, SCHEMA)
+
+    def enqueue(self, hosted_zone_id, change):
+        """ Queue a change, replacing any pending change to the same record """
+
+        now = self._clock()
+
+        with self._connections.get() as connection:
+            # A replaced change keeps its place in the queue and its lease, so
+            # changes to a record are never applied out of order
+            connection.execute(
+                'INSERT INTO changes VALUES (?, ?, ?, 1, ?, 0, ?) '
+                'ON CONFLICT (key) DO UPDATE SET change = excluded.change, '
+                'version = version + 1, attempts = 0',
+                (change_key(hosted_zone_id, change), hosted_zone_id,
+                 json.dumps(change, separators=(',', ':')), now, now))
+
+    def claim(self, limit):
+        """ Claim up to `limit` available changes, oldest first
+
+        Returns a list of (key, version, zone ID, change, attempts).
+        """
+
+        now = self._clock()
+        connection = self._connections.get()
+
+        # Only take the write lock when there's something to claim, so idle
+        # appliers don't hold up the requests queueing changes
+        if connection.execute(
+                'SELECT 1 FROM changes WHERE available <= ? LIMIT 1',
+                (now,)).fetchone() is None:
+            return []
+
+        with connection:
+            # Take the write lock first, so two appliers can't claim the same
+            # changes
+            connection.execute('BEGIN IMMEDIATE')
+            rows = connection.execute(
+                'SELECT key, version, zone_id, change, attempts FROM changes '
+                'WHERE available <= ? ORDER BY enqueued LIMIT ?',
+                (now, limit)).fetchall()
+            connection.executemany(
+                'UPDATE changes SET available = ? WHERE key = ?',
+                [(now + self.lease, row[0]) for row in rows])
+
+        return [(key, version, zone_id, json.loads(change), attempts)
+                for key, version, zone_id, change, attempts in rows]
+
+    def complete(self, key, version):
+        """ Remove an applied change, unless it was replaced meanwhile
+
+        Returns False if the change was replaced, and the new change is made
+        available to apply straight away.
+        """
+
+        with self._connections.get() as connection:
+            removed = connection.execute(
+                'DELETE FROM changes WHERE key = ? AND version = ?',
+                (key, version)).rowcount
+
+            if not removed:
+                # The record changed again while it was being applied
+                connection.execute(
+                    'UPDATE changes SET available = ? WHERE key = ?',
+                    (self._clock(), key))
+
+        return bool(removed)
+
+    def retry(self, key, delay):
+        """ Make a failed change available again after `delay` seconds """
+
+        with self._connections.get() as connection:
+            connection.execute(
+                'UPDATE changes SET available = ?, attempts = attempts + 1 '
+                'WHERE key = ?', (self._clock() + delay, key))
+
+    def drop(self, key, version):
+        """ Give up on a change, unless it was replaced meanwhile
+
+        Returns False if the change was replaced.
+        """
+
+        with self._connections.get() as connection:
+            return bool(connection.execute(
+                'DELETE FROM changes WHERE key = ? AND version = ?',
+                (key, version)).rowcount)
+
+    def depth(self):
+        """ Number of changes waiting to be applied """
+
+        return self._connections.get().execute(
+            'SELECT COUNT(*) FROM changes').fetchone()[0]
+
+    def lag(self):
+        """ Seconds the oldest waiting change has been queued for """
+
+        oldest = self._connections.get().execute(
+            'SELECT MIN(enqueued) FROM changes').fetchone()[0]
+
+        return max(0, self._clock() - oldest) if oldest is not None else 0
+
+
+class QueueApplier(object):
+    """ Applies queued changes in the background
+
+    `apply` is called with a zone ID and a list of changes, and returns a
+    future for the result of each change, like ChangeBatcher.apply. Up to
+    `batch_size` changes are claimed at a time, and the zones are applied by
+    `concurrency` threads. A change which fails is retried with backoff, and
+    dropped after `max_attempts` attempts. `applied` is called with the zone
+    ID and change for each applied change, and `dropped` for each dropped
+    one. With a HostLock as `lock`, only the worker holding it applies
+    changes, so `concurrency` is the total for the host.
+    """
+
+    def __init__(self, queue, apply, concurrency=4, batch_size=100,
+                 poll_interval=0.5, max_attempts=10, applied=None,
+                 dropped=None, lock=None):
+        self.queue = queue
+        self.apply = apply
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.applied = applied
+        self.dropped = dropped
+        self.lock = lock
+
+        self._started = None  # PID the applier threads were started in
+
+    def _apply_zone(self, zone_id, items):
+        try:
+            results = self.apply(zone_id, [item[3] for item in items])
+        except Exception as e:
+            results = [e] * len(items)
+
+        for (key, version, _, change, attempts), result in zip(items,
+                                                               results):
+            try:
+                if isinstance(result, Exception):
+                    raise result
+
+                result.result()
+            except Exception:
+                FAILED.inc()
+
+                if attempts + 1 >= self.max_attempts:
+                    DROPPED.inc()
+
+                    # A replaced change is superseded, so leave it be
+                    if self.queue.drop(key, version) and self.dropped:
+                        self.dropped(zone_id, change)
+                else:
+                    self.queue.retry(key, min(300, 2 ** attempts))
+
+                continue
+
+            APPLIED.inc()
+
+            # A replaced change is out of date, so don't report it
+            if self.queue.complete(key, version) and self.applied:
+                self.applied(zone_id, change)
+
+    def run_once(self):
+        """ Claim and apply one batch of changes, returning how many """
+
+        items = self.queue.claim(self.batch_size)
+
+        by_zone = {}
+
+        for item in items:
+            by_zone.setdefault(item[2], []).append(item)
+
+        for zone_id, zone_items in by_zone.items():
+            self._apply_zone(zone_id, zone_items)
+
+        return len(items)
+
+    def _run_forever(self):
+        while True:
+            try:
+                claimed = self.run_once()
+            except Exception:
+                claimed = 0  # The queue is unavailable, try again later
+
+            if not claimed:
+                time.sleep(self.poll_interval)
+
+    def start(self):
+        """ Start the applier threads in this process """
+
+        if self._started == os.getpid():
+            return
+
+        self._started = os.getpid()
+        targets = [self._run_forever] * self.concurrency
+
+        if self.lock is not None:
+            self.lock.start(targets)
+            return
+
+        for target in targets:
+            thread = threading.Thread(target=target)
+            thread.daemon = True
+            thread.start()
@@ -0,0 +1,174 @@
+""" Mapping of hostnames to the Route 53 hosted zones which contain them """
+
+import threading
+import time
+
+from route53_dyndns.cache import normalize_name
+
+_ZONE = None  # Key for the zone ID in a trie node, labels are never None
+
+
+def _labels(name):
+    return reversed(normalize_name(name).split('.'))
+
+
+class ZoneIndex(object):
+    """ Trie of reversed domain labels for longest-suffix zone matching
+
+    Finding the zone for a hostname walks one node per label, so the cost
+    depends on the length of the hostname, not the number of zones.
+    """
+
+    def __init__(self, zones=()):
+        self._root = {}
+        self.zones = {}  # zone name -> zone ID
+
+        for zone_name, zone_id in zones:
+            self.add(zone_name, zone_id)
+
+    def __len__(self):
+        return len(self.zones)
+
+    def add(self, zone_name, zone_id):
+        node = self._root
+
+        for label in _labels(zone_name):
+            node = node.setdefault(label, {})
+
+        node[_ZONE] = zone_id
+        self.zones[normalize_name(zone_name)] = zone_id
+
+    def find(self, hostname):
+        """ Find the ID of the most specific zone for a hostname, or None """
+
+        node = self._root
+        zone_id = None
+
+        for label in _labels(hostname):
+            node = node.get(label)
+
+            if node is None:
+                break
+
+            zone_id = node.get(_ZONE, zone_id)
+
+        return zone_id
+
+
+def list_hosted_zones(client):
+    """ Page through all public hosted zones as (name, zone ID) pairs """
+
+    kwargs = {}
+
+    while True:
+        response = client.list_hosted_zones(**kwargs)
+
+        for zone in response['HostedZones']:
+            if zone.get('Config', {}).get('PrivateZone'):
+                continue  # Not reachable by clients on the internet
+
+            yield zone['Name'], zone['Id'].split('/')[-1]
+
+        if not response['IsTruncated']:
+            break
+
+        kwargs['Marker'] = response['NextMarker']
+
+
+class HostedZones(object):
+    """ Periodically refreshed index of the hosted zones which can be updated
+
+    If `allowed` is not empty only zones whose name or ID is in it are used.
+    Once the first listing is loaded, a stale index is refreshed by one thread
+    while the others keep using the previous index. If refreshing it fails,
+    the previous index is used for another `retry_interval` seconds.
+    """
+
+    def __init__(self, refresh_interval=300, allowed=(), retry_interval=30,
+                 clock=time.time):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.allowed = set(normalize_name(zone) for zone in allowed)
+
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._index = None
+        self._expires = 0
+
+    def __len__(self):
+        return len(self._index or ())
+
+    def _is_allowed(self, zone_name, zone_id):
+        if not self.allowed:
+            return True
+
+        return normalize_name(zone_name) in self.allowed or (
+            zone_id.lower() in self.allowed)
+
+    def refresh(self, client):
+        """ List the hosted zones and replace the index """
+
+        index = ZoneIndex(
+            (zone_name, zone_id)
+            for zone_name, zone_id in list_hosted_zones(client)
+            if self._is_allowed(zone_name, zone_id))
+
+        self._index = index
+        self._expires = self._clock() + self.refresh_interval
+
+        return index
+
+    def get_index(self, client):
+        """ Get the current index, refreshing it if it is stale """
+
+        index = self._index
+
+        if index is not None and self._expires > self._clock():
+            return index
+
+        # Only wait for the refresh if there's no index to fall back on
+        if not self._lock.acquire(index is None):
+            return index
+
+        try:
+            if self._index is None or self._expires <= self._clock():
+                try:
+                    return self.refresh(client)
+                except Exception:
+                    if self._index is None:
+                        raise
+
+                    # Keep using the stale index, rather than listing the
+                    # zones again for every request while Route 53 fails
+                    self._expires = self._clock() + min(
+                        self.retry_interval, self.refresh_interval)
+
+            return self._index
+        finally:
+            self._lock.release()
+
+    def zones(self):
+        """ The current zones, as (name, zone ID) pairs """
+
+        return list((self._index.zones if self._index else {}).items())
+
+    def load(self, zones):
+        """ Use previously saved zones until they can be refreshed
+
+        The index is stale straight away, so the next use refreshes it while
+        the loaded zones are used in the meantime.
+        """
+
+        self._index = ZoneIndex(
+            (zone_name, zone_id) for zone_name, zone_id in zones
+            if self._is_allowed(zone_name, zone_id))
+        self._expires = 0
+
+    def find_zone(self, hostname, client):
+        """ Find the ID of the most specific zone for a hostname, or None """
+
+        return self.get_index(client).find(hostname)
+
+    def clear(self):
+        self._index = None
+        self._expires = 0
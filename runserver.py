@@ -1,3 +1,3 @@
-from route53_dyndns import app
+from route53_dyndns.app import create_app
 
-app.run(debug=True)
+create_app().run(debug=True)
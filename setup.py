@@ -18,10 +18,16 @@ setup(
     url="https://github.com/dsanders11/route53-dyndns-service/",
     keywords="route53 ddns dyndns dns dynamic",
     packages=find_packages(exclude=("tests",)),
+    python_requires=">= 3.7",
     install_requires=[
         "Flask >= 0.10",
-        "boto3 >= 1.2.3"
+        "boto3 >= 1.24",
+        "botocore >= 1.27",
     ],
+    extras_require={
+        "server": ["gunicorn >= 19.0"],
+        "asgi": ["gunicorn >= 19.0", "uvicorn"],
+    },
     entry_points={
         "console_scripts": ["route53_dyndns=route53_dyndns.cmdline:main"],
     },
@@ -38,10 +44,12 @@ setup(
         "Operating System :: Unix",
         "Operating System :: MacOS :: MacOS X",
         "Programming Language :: Python",
-        "Programming Language :: Python :: 2.7",
-        "Programming Language :: Python :: 3.3",
-        "Programming Language :: Python :: 3.4",
-        "Programming Language :: Python :: 3.5",
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3.7",
+        "Programming Language :: Python :: 3.8",
+        "Programming Language :: Python :: 3.9",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
         "Topic :: System :: Systems Administration",
         "Topic :: Internet :: WWW/HTTP :: HTTP Servers",
         "Topic :: Internet :: Name Service (DNS)",
@@ -1,13 +1,39 @@
-def new_resource_record(name, value):
+class Clock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def new_resource_record(name, value, record_type='A'):
+    values = value if isinstance(value, list) else [value]
+
     return {
         'Name': name,
-        'Type': 'A',
+        'Type': record_type,
         'SetIdentifier': 'string',
         'Region': 'us-east-1',
         'TTL': 123,
         'ResourceRecords': [
             {
                 'Value': value
-            },
+            } for value in values
         ],
     }
+
+
+def hosted_zones_response(*names):
+    return {
+        'HostedZones': [
+            {
+                'Id': '/hostedzone/Z%d' % i,
+                'Name': name + '.',
+                'Config': {
+                    'PrivateZone': False
+                },
+            } for i, name in enumerate(names)
+        ],
+        'IsTruncated': False,
+        'MaxItems': '100'
+    }
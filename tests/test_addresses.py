@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+
+import ipaddress
+import unittest
+
+from route53_dyndns.addresses import (
+    AddressParser, format_addresses, is_bogon, record_values, same_values)
+
+from .helpers import new_resource_record
+
+
+class AddressesTestCase(unittest.TestCase):
+    def test_parse(self):
+        parser = AddressParser()
+
+        self.assertEqual(parser.parse('10.0.0.1'), (('A', ('10.0.0.1',)),))
+
+        # Lists are split by type, normalized, sorted and without duplicates
+        addresses = parser.parse(
+            '2001:DB8:0::1, 10.0.0.2,10.0.0.1,2001:db8::1')
+        self.assertEqual(addresses, (('A', ('10.0.0.1', '10.0.0.2')),
+                                     ('AAAA', ('2001:db8::1',))))
+        self.assertEqual(format_addresses(addresses),
+                         '10.0.0.1,10.0.0.2,2001:db8::1')
+
+        self.assertEqual(parser.parse('2001:db8::1'),
+                         (('AAAA', ('2001:db8::1',)),))
+
+    def test_parse_invalid(self):
+        parser = AddressParser(max_addresses=2)
+
+        for value in (None, '', 'foo', '10.0.0.256', '10.0.0.1,',
+                      '10.0.0.1;10.0.0.2', '10.0.0.1,10.0.0.2,10.0.0.3'):
+            with self.assertRaises(ValueError):
+                parser.parse(value)
+
+            # Invalid values are cached too
+            with self.assertRaises(ValueError):
+                parser.parse(value)
+
+    def test_reject_bogons(self):
+        parser = AddressParser(reject_bogons=True)
+
+        self.assertEqual(parser.parse('8.8.8.8,2606:4700::1111'),
+                         (('A', ('8.8.8.8',)), ('AAAA', ('2606:4700::1111',))))
+
+        for value in ('10.0.0.1', '192.168.1.1', '127.0.0.1', '100.64.0.1',
+                      '169.254.1.1', '224.0.0.1', '0.0.0.0', '192.0.2.1',
+                      '::1', 'fe80::1', 'fd00::1', '2001:db8::1',
+                      '8.8.8.8,10.0.0.1'):
+            with self.assertRaises(ValueError):
+                parser.parse(value)
+
+        self.assertFalse(is_bogon(ipaddress.ip_address('8.8.8.8')))
+
+    def test_cache_bounded(self):
+        parser = AddressParser(cache_size=2)
+
+        for value in ('8.8.8.1', '8.8.8.2', '8.8.8.3'):
+            parser.parse(value)
+
+        self.assertLessEqual(len(parser._parsed), 2)
+
+    def test_same_values(self):
+        resource_record = new_resource_record(
+            'www.google.com', ['2001:DB8::2', '2001:0db8::1'], 'AAAA')
+
+        self.assertEqual(record_values(resource_record),
+                         frozenset(['2001:db8::1', '2001:db8::2']))
+        self.assertTrue(same_values(resource_record,
+                                    ['2001:db8::1', '2001:db8::2']))
+        self.assertFalse(same_values(resource_record, ['2001:db8::1']))
+
+        # Values which aren't addresses are compared as they are
+        resource_record = new_resource_record('www.google.com',
+                                              '"text"', 'TXT')
+        self.assertTrue(same_values(resource_record, ['"text"']))
@@ -0,0 +1,211 @@
+from __future__ import unicode_literals
+
+import asyncio
+from base64 import b64encode
+import threading
+import unittest
+
+from route53_dyndns import asgi, views
+from route53_dyndns.proxies import ClientResolver
+
+from mock import Mock, patch
+
+from .helpers import new_resource_record
+
+
+class AsgiTestCase(unittest.TestCase):
+    def request(self, path, query='', headers=None, method='GET',
+                username='admin', password='secret', user_agent='Client'):
+        headers = dict(headers or {})
+
+        if username is not None:
+            value = "{0}:{1}".format(username, password).encode('ascii')
+            headers['Authorization'] = 'Basic ' + b64encode(value).decode()
+
+        if user_agent is not None:
+            headers['User-Agent'] = user_agent
+
+        scope = {
+            'type': 'http',
+            'method': method,
+            'path': path,
+            'query_string': query.encode('ascii'),
+            'headers': [(name.encode('ascii'), value.encode('ascii'))
+                        for name, value in headers.items()],
+            'client': ('10.1.10.1', 12345),
+        }
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        asyncio.run(asgi.application(scope, receive, send))
+
+        start, body = messages
+        headers = dict(start['headers'])
+        self.assertEqual(headers[b'content-type'], b'text/plain')
+
+        return start['status'], body['body'].decode('utf-8')
+
+    def assertResponseEqual(self, expected, response, status=200):
+        self.assertEqual(response, (status, expected + '\r\n'))
+
+    def test_parse_basic_auth(self):
+        header = 'Basic ' + b64encode(b'admin:se:cret').decode()
+        self.assertEqual(asgi.parse_basic_auth(header), ('admin', 'se:cret'))
+        self.assertIsNone(asgi.parse_basic_auth(None))
+        self.assertIsNone(asgi.parse_basic_auth('Bearer token'))
+        self.assertIsNone(asgi.parse_basic_auth('Basic !!!'))
+
+    def test_routing(self):
+        status, _ = self.request('/foo')
+        self.assertEqual(status, 404)
+
+        status, _ = self.request('/nic/update', method='POST')
+        self.assertEqual(status, 405)
+
+    def test_health(self):
+        self.assertResponseEqual('OK', self.request('/health',
+                                                    username=None))
+
+    def test_auth(self):
+        self.assertResponseEqual(views.BAD_AUTH, self.request(
+            '/nic/update', username=None), status=401)
+        self.assertResponseEqual(views.BAD_AUTH, self.request(
+            '/nic/update', password='wrong'), status=403)
+
+    def test_auth_off_loop(self):
+        """ Test that password hashes aren't checked on the event loop """
+
+        threads = []
+
+        def verify_auth(username, password):
+            threads.append(threading.current_thread())
+
+        with patch.object(views, 'verify_auth', verify_auth):
+            self.request('/nic/update', password='wrong')
+
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_nic_update(self):
+        # Requests answered without any lookups
+        self.assertResponseEqual(views.NOT_SUPPORTED, self.request(
+            '/nic/update/', 'offline=1'))
+        self.assertResponseEqual(views.BAD_USER_AGENT, self.request(
+            '/nic/update', user_agent=None))
+        self.assertResponseEqual(views.NO_HOST, self.request('/nic/update'))
+
+        records = {
+            "www.google.com": new_resource_record("www.google.com",
+                                                  "10.1.10.1"),
+            "mail.google.com": new_resource_record("mail.google.com",
+                                                   "10.0.0.1"),
+        }
+
+        with patch('route53_dyndns.route53.find_resource_record') as find, \
+                patch('route53_dyndns.route53.update_resource_record') as \
+                update:
+            find.side_effect = (
+                lambda name, client, record_type: records.get(name))
+            update.return_value = True
+
+            # The client address is used when no IP is given
+            response = self.request(
+                '/nic/update',
+                'hostname=www.google.com,mail.google.com,ftp.google.com')
+
+            self.assertResponseEqual('\n'.join([views.NO_CHANGE % "10.1.10.1",
+                                                views.IP_CHANGED % "10.1.10.1",
+                                                views.NO_HOST]), response)
+
+            update.side_effect = RuntimeError("Error")
+            response = self.request('/nic/update',
+                                    'hostname=mail.google.com&myip=10.0.0.2')
+            self.assertResponseEqual(views.GENERAL_ERROR, response)
+
+    def test_history_off_loop(self):
+        """ Test that the update history isn't checked on the event loop """
+
+        threads = []
+        history = Mock()
+        history.held_down.side_effect = (
+            lambda record: threads.append(threading.current_thread()))
+        history.record.side_effect = history.held_down.side_effect
+        record = new_resource_record("www.google.com", "10.1.10.1")
+
+        with patch.object(views, 'update_history', history), \
+                patch('route53_dyndns.route53.find_resource_record') as find, \
+                patch('route53_dyndns.route53.update_resource_record') as \
+                update:
+            find.return_value = record
+            update.return_value = True
+
+            self.assertResponseEqual(views.IP_CHANGED % "10.0.0.2",
+                                     self.request('/nic/update',
+                                                  'hostname=www.google.com&'
+                                                  'myip=10.0.0.2'))
+
+        self.assertEqual(len(threads), 2)
+        self.assertNotIn(threading.current_thread(), threads)
+
+    def test_nic_status(self):
+        with patch('route53_dyndns.route53.change_tracker') as tracker:
+            tracker.min_interval = 0.01
+            tracker.status.side_effect = [
+                [('PENDING', 'C1'), None],
+                [('INSYNC', 'C1'), None],
+            ]
+
+            self.assertResponseEqual('\n'.join(['PENDING C1', 'unknown']),
+                                     self.request('/nic/status',
+                                                  'hostname=a.google.com,'
+                                                  'b.google.com'))
+
+            # Waits until none of the changes are pending
+            tracker.status.side_effect = [
+                [('PENDING', 'C1'), None],
+                [('INSYNC', 'C1'), None],
+            ]
+            self.assertResponseEqual('\n'.join(['INSYNC C1', 'unknown']),
+                                     self.request('/nic/status',
+                                                  'hostname=a.google.com,'
+                                                  'b.google.com&wait=5'))
+            self.assertEqual(tracker.status.call_count, 3)
+
+            # Errors are answered like in the update endpoint
+            tracker.status.side_effect = RuntimeError("Error")
+            self.assertResponseEqual(views.GENERAL_ERROR,
+                                     self.request('/nic/status',
+                                                  'hostname=a.google.com'))
+
+            # Authenticated before anything else, like the WSGI view
+            self.assertResponseEqual(views.BAD_AUTH, self.request(
+                '/nic/status', username=None), status=401)
+
+        with patch('route53_dyndns.route53.change_tracker', None):
+            status, _ = self.request('/nic/status', 'hostname=a.google.com')
+            self.assertEqual(status, 404)
+
+    def test_head(self):
+        self.assertEqual(self.request('/health', method='HEAD',
+                                      username=None), (200, ''))
+
+    def test_forwarded(self):
+        record = new_resource_record("www.google.com", "203.0.113.1")
+
+        with patch('route53_dyndns.route53.find_resource_record') as find, \
+                patch('route53_dyndns.route53.update_resource_record') as \
+                update, patch.object(views, 'client_resolver',
+                                     ClientResolver(['10.0.0.0/8'])):
+            find.return_value = record
+            update.return_value = True
+
+            response = self.request('/nic/update', 'hostname=www.google.com',
+                                    headers={'X-Forwarded-For': '10.0.0.5',
+                                             'Forwarded': 'for=203.0.113.2'})
+            self.assertResponseEqual(views.IP_CHANGED % '203.0.113.2',
+                                     response)
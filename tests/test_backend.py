@@ -1,12 +1,15 @@
 from datetime import datetime
 import unittest
 
+from route53_dyndns import route53
+from route53_dyndns.backends import MemoryBackend
 from route53_dyndns.route53 import (
-    find_resource_record, Route53Exception, update_resource_record)
+    find_resource_record, find_resource_records, hosted_zones,
+    Route53Exception, update_resource_record, update_resource_records)
 
 from mock import patch
 
-from .helpers import new_resource_record
+from .helpers import hosted_zones_response, new_resource_record
 
 
 class MockRoute53Client(object):
@@ -33,13 +36,23 @@ class MockRoute53Client(object):
             'MaxItems': max_items
         }
 
+    def list_hosted_zones(self):
+        return hosted_zones_response('google.com', 'example.com')
+
     def list_resource_record_sets(self, HostedZoneId=None,
-                                  StartRecordName=None, MaxItems=None):
+                                  StartRecordName=None, MaxItems=None,
+                                  StartRecordType=None):
         assert HostedZoneId
         assert StartRecordName
         assert MaxItems
 
-        return self._resource_records_response(StartRecordName, MaxItems)
+        response = self._resource_records_response(StartRecordName, MaxItems)
+
+        if StartRecordType == 'AAAA':
+            response['ResourceRecordSets'] = [new_resource_record(
+                StartRecordName + '.', '2001:db8::1', 'AAAA')]
+
+        return response
 
     def change_resource_record_sets(self, HostedZoneId=None,
                                     ChangeBatch=None):
@@ -57,6 +70,10 @@ class MockRoute53Client(object):
 
 
 class BackendTestCase(unittest.TestCase):
+    def setUp(self):
+        hosted_zones.clear()
+        self.addCleanup(hosted_zones.clear)
+
     def test_find_resource_record(self):
         """ Test find_resource_record functionality """
 
@@ -70,6 +87,10 @@ class BackendTestCase(unittest.TestCase):
         with self.assertRaises(ValueError):
             find_resource_record('', client=client)
 
+        # Records outside of the hosted zones don't exist
+        self.assertIsNone(find_resource_record("www.example.org",
+                                               client=client))
+
         # Go right case
         resource_record = find_resource_record(hostname, client=client)
         self.assertEqual(resource_record['Name'], hostname)
@@ -81,15 +102,15 @@ class BackendTestCase(unittest.TestCase):
             with self.assertRaises(Route53Exception):
                 find_resource_record(hostname, client=client)
 
-        # Test a go wrong case where the returned result is truncated
+        # The result is truncated whenever other records follow this one
         truncated_result = client._resource_records_response(hostname, 1)
         truncated_result['IsTruncated'] = True
 
         with patch.object(client, 'list_resource_record_sets') as mocked:
             mocked.return_value = truncated_result
 
-            with self.assertRaises(AssertionError):
-                find_resource_record(hostname, client=client)
+            resource_record = find_resource_record(hostname, client=client)
+            self.assertEqual(resource_record['Name'], hostname)
 
         # Test a go wrong case where there are multiple resource record results
         multi_result = client._resource_records_response(hostname, 1)
@@ -102,6 +123,58 @@ class BackendTestCase(unittest.TestCase):
             with self.assertRaises(AssertionError):
                 find_resource_record(hostname, client=client)
 
+    def test_find_resource_record_type(self):
+        client = MockRoute53Client()
+
+        resource_record = find_resource_record("www.google.com", client,
+                                               'AAAA')
+        self.assertEqual(resource_record['Type'], 'AAAA')
+
+        # The listing starts at the first record of that type or after it
+        self.assertIsNone(find_resource_record("www.google.com", client,
+                                               'MX'))
+
+    @patch.object(route53, 'shared_cache', MemoryBackend())
+    def test_find_resource_record_shared(self):
+        client = MockRoute53Client()
+
+        with patch.object(client, 'list_resource_record_sets',
+                          wraps=client.list_resource_record_sets) as mocked:
+            for _ in range(3):
+                resource_record = find_resource_record("www.google.com",
+                                                       client, 'A')
+                self.assertEqual(resource_record['Name'], "www.google.com")
+
+            self.assertEqual(mocked.call_count, 1)
+
+            # An update replaces the shared record
+            self.assertTrue(update_resource_record(resource_record,
+                                                   '10.0.0.9', client=client))
+            resource_record = find_resource_record("www.google.com", client,
+                                                   'A')
+            self.assertEqual(resource_record['ResourceRecords'],
+                             [{'Value': '10.0.0.9'}])
+            self.assertEqual(mocked.call_count, 1)
+
+    def test_update_resource_record_values(self):
+        client = MockRoute53Client()
+        record = new_resource_record("www.google.com",
+                                     ['10.0.0.2', '10.0.0.1'])
+
+        with patch.object(client, 'change_resource_record_sets',
+                          wraps=client.change_resource_record_sets) as mocked:
+            # The same values in another order are already up-to-date
+            self.assertTrue(update_resource_record(
+                record, ['10.0.0.1', '10.0.0.2'], client=client))
+            self.assertFalse(mocked.called)
+
+            self.assertTrue(update_resource_record(
+                record, ['10.0.0.1', '10.0.0.3'], client=client))
+
+            change, = mocked.call_args[1]['ChangeBatch']['Changes']
+            self.assertEqual(change['ResourceRecordSet']['ResourceRecords'],
+                             [{'Value': '10.0.0.1'}, {'Value': '10.0.0.3'}])
+
     def test_update_resource_record(self):
         """ Test update_resource_record functionality """
 
@@ -124,3 +197,76 @@ class BackendTestCase(unittest.TestCase):
 
             with self.assertRaises(Route53Exception):
                 update_resource_record(record, '192.168.1.1', client=client)
+
+        # Test a go wrong case where the record isn't in a hosted zone
+        record = new_resource_record("www.example.org", value)
+
+        with self.assertRaises(Route53Exception):
+            update_resource_record(record, '192.168.1.1', client=client)
+
+    def test_find_resource_records(self):
+        """ Test find_resource_records functionality """
+
+        client = MockRoute53Client()
+        hostnames = ["www.google.com", "mail.google.com", "www.example.org"]
+
+        lookups = find_resource_records(hostnames, client=client)
+        self.assertEqual(len(lookups), 3)
+        self.assertEqual(lookups[0].result()['Name'], hostnames[0])
+        self.assertEqual(lookups[1].result()['Name'], hostnames[1])
+        self.assertIsNone(lookups[2].result())
+
+        # Test a go wrong case when there's a Route 53 error
+        with patch.object(client, 'list_resource_record_sets') as mocked:
+            mocked.side_effect = RuntimeError("Route 53 Error")
+
+            lookups = find_resource_records(hostnames[:1], client=client)
+
+            with self.assertRaises(Route53Exception):
+                lookups[0].result()
+
+    def test_update_resource_records(self):
+        """ Test update_resource_records functionality """
+
+        client = MockRoute53Client()
+        value = '127.0.0.1'
+        records = [new_resource_record("www.google.com", value),
+                   new_resource_record("mail.google.com", value),
+                   new_resource_record("www.example.com", value),
+                   new_resource_record("www.example.org", value)]
+
+        # Go right case, with a single change batch for each zone
+        with patch.object(client, 'change_resource_record_sets',
+                          wraps=client.change_resource_record_sets) as mocked:
+            results = update_resource_records(
+                [(records[0], '10.0.0.1'), (records[1], '10.0.0.2'),
+                 (records[2], '10.0.0.3'), (records[3], '10.0.0.4'),
+                 (records[0], value)], client=client)
+
+            self.assertEqual(mocked.call_count, 2)
+
+            batches = dict((kwargs['HostedZoneId'], kwargs['ChangeBatch'])
+                           for _, kwargs in mocked.call_args_list)
+            self.assertEqual(len(batches['Z0']['Changes']), 2)
+            self.assertEqual(len(batches['Z1']['Changes']), 1)
+
+        self.assertTrue(results[0].result())
+        self.assertTrue(results[1].result())
+        self.assertTrue(results[2].result())
+        self.assertTrue(results[4].result())
+
+        # The record which isn't in a hosted zone fails on its own
+        with self.assertRaises(Route53Exception):
+            results[3].result()
+
+        # Test a go wrong case when there's a Route 53 error
+        with patch.object(client, 'change_resource_record_sets') as mocked:
+            mocked.side_effect = RuntimeError("Route 53 Error")
+
+            results = update_resource_records(
+                [(records[0], '10.0.0.1'), (records[1], '10.0.0.2')],
+                client=client)
+
+            for result in results:
+                with self.assertRaises(Route53Exception):
+                    result.result()
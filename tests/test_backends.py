@@ -0,0 +1,258 @@
+from __future__ import unicode_literals
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from route53_dyndns.backends import (
+    MemoryBackend, RedisBackend, RedisClient, RedisError, SharedMemoryBackend)
+
+from mock import Mock
+
+from .helpers import Clock
+
+
+class FakeRedisClient(object):
+    """ Just enough of GET, SET and DEL, with expiry """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.values = {}
+
+    def execute(self, command, key, *args):
+        entry = self.values.get(key)
+
+        if entry is not None and entry[0] <= self.clock():
+            del self.values[key]
+            entry = None
+
+        if command == 'GET':
+            return entry[1] if entry else None
+
+        if command == 'DEL':
+            return int(self.values.pop(key, None) is not None)
+
+        if 'NX' in args and entry:
+            return None
+
+        self.values[key] = (self.clock() + args[2] / 1000.0, args[0])
+
+        return 'OK'
+
+
+class BackendTests(object):
+    """ Tests run against each of the backends """
+
+    def test_get_set(self):
+        self.assertIsNone(self.backend.get('a'))
+        self.assertEqual(self.backend.get('a', 'default'), 'default')
+
+        self.backend.set('a', {'Name': 'www.google.com.'}, 10)
+        self.assertEqual(self.backend.get('a'), {'Name': 'www.google.com.'})
+
+        self.backend.set('a', [1, 2], 10)
+        self.assertEqual(self.backend.get('a'), [1, 2])
+
+        self.backend.delete('a')
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_expiry(self):
+        self.backend.set('a', 1, 10)
+        self.clock.now += 9
+        self.assertEqual(self.backend.get('a'), 1)
+
+        self.clock.now += 1
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_add(self):
+        self.assertTrue(self.backend.add('a', 1, 10))
+        self.assertFalse(self.backend.add('a', 2, 10))
+        self.assertEqual(self.backend.get('a'), 1)
+
+        self.clock.now += 10
+        self.assertTrue(self.backend.add('a', 3, 10))
+        self.assertEqual(self.backend.get('a'), 3)
+
+    def test_get_or_load(self):
+        load = Mock(return_value={'Name': 'www.google.com.'})
+
+        for _ in range(3):
+            self.assertEqual(self.backend.get_or_load('a', load, 10),
+                             {'Name': 'www.google.com.'})
+
+        self.assertEqual(load.call_count, 1)
+
+        # Not found is cached too
+        load = Mock(return_value=None)
+
+        for _ in range(3):
+            self.assertIsNone(self.backend.get_or_load('b', load, 10))
+
+        self.assertEqual(load.call_count, 1)
+
+    def test_get_or_load_error(self):
+        load = Mock(side_effect=[ValueError, 1])
+
+        with self.assertRaises(ValueError):
+            self.backend.get_or_load('a', load, 10)
+
+        # The next lookup loads it, rather than waiting on the failed one
+        self.assertEqual(self.backend.get_or_load('a', load, 10), 1)
+        self.assertEqual(self.sleep.call_count, 0)
+
+    def test_get_or_load_coalesced(self):
+        # Another worker is loading the key
+        self.backend.add('a\0loading', 1234, 10)
+
+        def sleep(seconds):
+            self.clock.now += seconds
+            self.backend.set('a', 'loaded', 10)
+
+        self.sleep.side_effect = sleep
+        load = Mock(return_value='mine')
+
+        self.assertEqual(self.backend.get_or_load('a', load, 10), 'loaded')
+        self.assertFalse(load.called)
+
+    def test_get_or_load_timeout(self):
+        # Another worker is loading the key, and never finishes
+        self.backend.add('a\0loading', 1234, 60)
+
+        def sleep(seconds):
+            self.clock.now += seconds
+
+        self.sleep.side_effect = sleep
+        load = Mock(return_value='mine')
+
+        self.assertEqual(self.backend.get_or_load('a', load, 10), 'mine')
+        self.assertEqual(self.clock.now, 1010.0)
+
+
+class MemoryBackendTestCase(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.sleep = Mock()
+        self.backend = MemoryBackend(max_size=3, poll_interval=5,
+                                     clock=self.clock, sleep=self.sleep)
+
+    def test_max_size(self):
+        for key in 'abc':
+            self.backend.set(key, key, 10)
+
+        self.backend.get('a')
+        self.backend.set('d', 'd', 10)
+
+        # The least recently used is evicted
+        self.assertEqual(len(self.backend), 3)
+        self.assertIsNone(self.backend.get('b'))
+        self.assertEqual(self.backend.get('a'), 'a')
+
+
+class SharedMemoryBackendTestCase(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache')
+        self.clock = Clock()
+        self.sleep = Mock()
+        self.backend = self.new_backend()
+
+    def tearDown(self):
+        self.backend.close()
+        shutil.rmtree(self.directory)
+
+    def new_backend(self):
+        return SharedMemoryBackend(self.path, slots=16, slot_size=64,
+                                   poll_interval=5, clock=self.clock,
+                                   sleep=self.sleep)
+
+    def test_shared(self):
+        other = self.new_backend()
+        self.addCleanup(other.close)
+
+        self.backend.set('a', [1, 2], 10)
+        self.assertEqual(other.get('a'), [1, 2])
+
+        other.delete('a')
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_too_large(self):
+        self.backend.set('a', 'small', 10)
+        self.backend.set('a', 'x' * 100, 10)
+
+        self.assertIsNone(self.backend.get('a'))
+
+    def test_collision(self):
+        # With one slot, every key replaces the last
+        backend = SharedMemoryBackend(os.path.join(self.directory, 'one'),
+                                      slots=1, slot_size=64, clock=self.clock)
+        self.addCleanup(backend.close)
+
+        backend.set('a', 1, 10)
+        backend.set('b', 2, 10)
+
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(backend.get('b'), 2)
+
+
+class RedisBackendTestCase(BackendTests, unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.sleep = Mock()
+        self.client = FakeRedisClient(self.clock)
+        self.backend = RedisBackend(prefix='test:', client=self.client,
+                                    poll_interval=5, clock=self.clock,
+                                    sleep=self.sleep)
+
+    def test_prefix(self):
+        self.backend.set('a', [1, 2], 1.5)
+
+        self.assertEqual(self.client.values['test:a'], (1001.5, b'[1,2]'))
+
+    def test_unavailable(self):
+        self.backend.client = Mock()
+        self.backend.client.execute.side_effect = ConnectionError
+        load = Mock(return_value=1)
+
+        # Every lookup is a miss, and the values are loaded directly
+        self.assertIsNone(self.backend.get('a'))
+        self.assertEqual(self.backend.get_or_load('a', load, 10), 1)
+        self.assertEqual(self.backend.get_or_load('a', load, 10), 1)
+        self.assertEqual(load.call_count, 2)
+
+        self.backend.put('a', 1, 10)
+        self.backend.discard('a')
+
+
+class RedisClientTestCase(unittest.TestCase):
+    def test_encode(self):
+        self.assertEqual(
+            RedisClient._encode(('SET', 'key', b'{"a":1}', 'PX', 1000)),
+            b'*5\r\n$3\r\nSET\r\n$3\r\nkey\r\n$7\r\n{"a":1}\r\n'
+            b'$2\r\nPX\r\n$4\r\n1000\r\n')
+
+    def test_read_reply(self):
+        def read(data):
+            return RedisClient._read_reply(io.BytesIO(data))
+
+        self.assertEqual(read(b'+OK\r\n'), 'OK')
+        self.assertEqual(read(b':1\r\n'), 1)
+        self.assertEqual(read(b'$5\r\nhello\r\n'), b'hello')
+        self.assertIsNone(read(b'$-1\r\n'))
+        self.assertEqual(read(b'*2\r\n$1\r\na\r\n:2\r\n'), [b'a', 2])
+
+        with self.assertRaises(RedisError):
+            read(b'-ERR unknown command\r\n')
+
+        with self.assertRaises(ConnectionError):
+            read(b'')
+
+    def test_url(self):
+        client = RedisClient('redis://cache.local:6380/2')
+        self.assertEqual(client._address, ('cache.local', 6380))
+        self.assertEqual(client._db, 2)
+
+        client = RedisClient('unix:///run/redis.sock?db=1')
+        self.assertEqual(client._address, '/run/redis.sock')
+        self.assertEqual(client._db, 1)
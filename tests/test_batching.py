@@ -0,0 +1,147 @@
+import threading
+import unittest
+
+from botocore.exceptions import ClientError
+
+from route53_dyndns import app
+from route53_dyndns.batching import ChangeBatcher, split_changes
+from route53_dyndns.route53 import (
+    hosted_zones, Route53Exception, update_resource_record)
+
+from mock import MagicMock, patch
+
+from .helpers import hosted_zones_response, new_resource_record
+
+
+def route53_error(code):
+    """ A Route53Exception raised for a client error, as the backend does """
+
+    try:
+        raise ClientError({'Error': {'Code': code, 'Message': code}},
+                          'ChangeResourceRecordSets')
+    except ClientError as e:
+        try:
+            raise Route53Exception(e)
+        except Route53Exception as error:
+            return error
+
+
+def upsert(name, value):
+    return {
+        'Action': 'UPSERT',
+        'ResourceRecordSet': new_resource_record(name, value)
+    }
+
+
+class BatchingTestCase(unittest.TestCase):
+    def test_split_changes(self):
+        """ Test that batches respect the size limits """
+
+        changes = [upsert('host%d.com' % i, '10.0.0.1') for i in range(1200)]
+
+        # Each UPSERT counts twice towards the 1000 record limit
+        batches = list(split_changes(changes))
+        self.assertEqual([len(batch) for batch in batches], [500, 500, 200])
+
+        batches = list(split_changes(changes[:10], max_changes=4))
+        self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+
+        # Long values are limited by the total number of characters
+        changes = [upsert('host%d.com' % i, 'x' * 4000) for i in range(5)]
+        batches = list(split_changes(changes))
+        self.assertEqual([len(batch) for batch in batches], [4, 1])
+
+    def test_submit(self):
+        """ Test that changes in the window are merged into a single batch """
+
+        send = MagicMock(return_value={'ChangeInfo': {'Id': 'change'}})
+        batcher = ChangeBatcher(send, window=60, max_changes=3)
+        client = object()
+
+        first = batcher.submit('zone', upsert('foo.com', '10.0.0.1'), client)
+        second = batcher.submit('zone', upsert('foo.com', '10.0.0.2'), client)
+        other = batcher.submit('zone', upsert('bar.com', '10.0.0.3'), client)
+        self.assertFalse(send.called)
+
+        # Filling the batch sends it right away, the last write wins
+        batcher.submit('zone', upsert('baz.com', '10.0.0.4'), client)
+        self.assertEqual(send.call_count, 1)
+
+        zone, changes, _ = send.call_args[0]
+        self.assertEqual(zone, 'zone')
+        self.assertEqual([c['ResourceRecordSet']['Name'] for c in changes],
+                         ['foo.com', 'bar.com', 'baz.com'])
+        self.assertEqual(changes[0]['ResourceRecordSet']['ResourceRecords'],
+                         [{'Value': '10.0.0.2'}])
+
+        for future in (first, second, other):
+            self.assertEqual(future.result(), send.return_value)
+
+    def test_submit_window(self):
+        """ Test that a partial batch is sent once the window has passed """
+
+        sent = threading.Event()
+        batcher = ChangeBatcher(lambda *args: sent.set(), window=0.01)
+
+        future = batcher.submit('zone', upsert('foo.com', '10.0.0.1'), None)
+        future.result(timeout=5)
+        self.assertTrue(sent.is_set())
+
+    def test_submit_error(self):
+        """ Test that one bad change doesn't fail the rest of the batch """
+
+        def send(zone, changes, client):
+            if any(c['ResourceRecordSet']['Name'] == 'bad.com'
+                   for c in changes):
+                raise route53_error('InvalidChangeBatch')
+
+        batcher = ChangeBatcher(send, window=60, max_changes=2)
+
+        good = batcher.submit('zone', upsert('good.com', '10.0.0.1'), None)
+        bad = batcher.submit('zone', upsert('bad.com', '10.0.0.2'), None)
+
+        self.assertIsNone(good.result())
+
+        with self.assertRaises(Route53Exception):
+            bad.result()
+
+    def test_submit_throttled(self):
+        """ Test that a throttled batch isn't resent a change at a time """
+
+        send = MagicMock(side_effect=route53_error('Throttling'))
+        batcher = ChangeBatcher(send, window=60, max_changes=2)
+
+        first = batcher.submit('zone', upsert('foo.com', '10.0.0.1'), None)
+        second = batcher.submit('zone', upsert('bar.com', '10.0.0.2'), None)
+
+        for future in (first, second):
+            with self.assertRaises(Route53Exception):
+                future.result()
+
+        self.assertEqual(send.call_count, 1)
+
+    def test_update_resource_record(self):
+        """ Test that updates go through the batcher when enabled """
+
+        hosted_zones.clear()
+        self.addCleanup(hosted_zones.clear)
+
+        client = MagicMock()
+        client.list_hosted_zones.return_value = hosted_zones_response('com')
+        record = new_resource_record('foo.com', '10.0.0.1')
+
+        with patch.dict(app.config, {'BATCH_UPDATES': True}):
+            self.assertTrue(
+                update_resource_record(record, '10.0.0.2', client=client))
+
+        kwargs = client.change_resource_record_sets.call_args[1]
+        self.assertEqual(kwargs['HostedZoneId'], 'Z0')
+        change = kwargs['ChangeBatch']['Changes'][0]
+        self.assertEqual(change['ResourceRecordSet']['ResourceRecords'],
+                         [{'Value': '10.0.0.2'}])
+
+        client.change_resource_record_sets.side_effect = RuntimeError("Error")
+
+        with patch.dict(app.config, {'BATCH_UPDATES': True}):
+            with self.assertRaises(Route53Exception):
+                update_resource_record(record, '10.0.0.3', client=client)
@@ -0,0 +1,96 @@
+import unittest
+
+from route53_dyndns import app, route53, views
+from route53_dyndns.benchmark import percentile, run_benchmark
+from route53_dyndns.fakeroute53 import FakeRoute53, FakeRoute53Server
+
+from mock import patch
+
+
+class FakeRoute53TestCase(unittest.TestCase):
+    def setUp(self):
+        self.fake = FakeRoute53()
+        self.fake.add_zone('Z1', 'example.com', [
+            {'Name': 'host%d.example.com' % i, 'Type': 'A', 'TTL': 60,
+             'ResourceRecords': [{'Value': '10.0.0.%d' % i}]}
+            for i in range(5)])
+
+        self.server = FakeRoute53Server(self.fake).start()
+        self.addCleanup(self.server.stop)
+
+        patcher = patch.dict(app.config, {
+            'AWS_ENDPOINT_URL': self.server.endpoint_url,
+            'RECORD_CACHE_ENABLED': True,
+        })
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        for cache in (route53.hosted_zones, route53.record_cache):
+            cache.clear()
+            self.addCleanup(cache.clear)
+
+    def test_round_trip(self):
+        """ Test the backend against the fake with a real client """
+
+        record = route53.find_resource_record('host3.example.com')
+        self.assertEqual(record['ResourceRecords'], [{'Value': '10.0.0.3'}])
+        self.assertIsNone(route53.find_resource_record('www.example.com'))
+        self.assertIsNone(route53.find_resource_record('host3.example.org'))
+
+        self.assertTrue(route53.update_resource_record(record, '10.0.1.3'))
+        self.assertEqual(self.fake.calls['ChangeResourceRecordSets'], 1)
+
+        route53.record_cache.clear()
+        record = route53.find_resource_record('host3.example.com')
+        self.assertEqual(record['ResourceRecords'], [{'Value': '10.0.1.3'}])
+        self.assertEqual(record['TTL'], 60)
+
+    def test_injected_failures(self):
+        """ Test that calls are throttled and fail at the injected rates """
+
+        fake = FakeRoute53(throttle_rate=2)
+        statuses = [fake.handle('Test', lambda: '')[0] for _ in range(3)]
+        self.assertEqual(statuses, [200, 200, 400])
+
+        fake = FakeRoute53(error_rate=1)
+        self.assertEqual(fake.handle('Test', lambda: '')[0], 500)
+        self.assertEqual(fake.calls['Test'], 1)
+
+
+class BenchmarkTestCase(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertIsNone(percentile([], 0.5))
+        self.assertEqual(percentile(values, 0.5), 50)
+        self.assertEqual(percentile(values, 0.99), 99)
+        self.assertEqual(percentile(values, 0.999), 100)
+
+    def test_run_benchmark(self):
+        credential_store = views.credential_store
+        results = run_benchmark(requests=30, concurrency=3, routers=10,
+                                config={'RECORD_CACHE_ENABLED': True},
+                                seed=1)
+
+        self.assertEqual(results['latency']['count'], 30)
+        self.assertEqual(sum(results['responses'].values()), 30)
+        self.assertNotIn('911', results['responses'])
+        self.assertGreater(results['aws_calls']['ListResourceRecordSets'], 0)
+        self.assertGreater(results['requests_per_second'], 0)
+
+        # The app is left as it was
+        self.assertFalse(app.config['RECORD_CACHE_ENABLED'])
+        self.assertIsNone(app.config['AWS_ENDPOINT_URL'])
+        self.assertIs(views.credential_store, credential_store)
+
+    def test_run_benchmark_credentials_file(self):
+        """ Test that the benchmark user doesn't need USERNAME and PASSWORD """
+
+        config = dict(app.config)
+        del config['USERNAME'], config['PASSWORD']
+
+        with patch.dict(app.config, config, clear=True):
+            results = run_benchmark(requests=10, concurrency=2, routers=4,
+                                    mix=(('nochg', 1),), seed=1)
+
+        self.assertEqual(results['responses'], {'nochg': 10})
@@ -0,0 +1,222 @@
+import unittest
+
+from route53_dyndns import app, route53
+from route53_dyndns.backends import MemoryBackend
+from route53_dyndns.cache import RecordCache
+from route53_dyndns.route53 import (
+    find_resource_record, find_resource_records, hosted_zones, record_cache,
+    update_resource_record)
+
+from mock import patch
+
+from .helpers import Clock, hosted_zones_response, new_resource_record
+
+
+class MockZoneClient(object):
+    """ Mock client which pages through a zone two records at a time """
+
+    def __init__(self, records):
+        self.records = records
+        self.calls = 0
+
+    def list_hosted_zones(self):
+        return hosted_zones_response('com')
+
+    def list_resource_record_sets(self, HostedZoneId=None,
+                                  StartRecordName=None, StartRecordType=None,
+                                  MaxItems=None):
+        assert HostedZoneId
+        self.calls += 1
+
+        names = [record['Name'] for record in self.records]
+        start = names.index(StartRecordName) if StartRecordName else 0
+        size = int(MaxItems or 2)
+        page = self.records[start:start + size]
+        response = {
+            'ResourceRecordSets': page,
+            'IsTruncated': start + size < len(self.records),
+        }
+
+        if response['IsTruncated']:
+            response['NextRecordName'] = names[start + size]
+            response['NextRecordType'] = 'A'
+
+        return response
+
+    def change_resource_record_sets(self, HostedZoneId=None,
+                                    ChangeBatch=None):
+        self.calls += 1
+
+        return {'ChangeInfo': {'Id': 'string', 'Status': 'PENDING'}}
+
+
+class RecordCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.cache = RecordCache(ttl=60, max_size=3, clock=lambda: self.now)
+
+    def test_lookup(self):
+        """ Test looking up records before and after a zone is loaded """
+
+        record = new_resource_record('foo.com', '10.0.0.1')
+
+        self.assertIsNone(self.cache.get('zone', 'foo.com'))
+        self.assertFalse(self.cache.is_loaded('zone'))
+
+        self.cache.load_zone('zone', [record])
+        self.assertTrue(self.cache.is_loaded('zone'))
+        self.assertEqual(self.cache.get('zone', 'FOO.com.'), [record])
+
+        # Names which aren't in a loaded zone are known not to exist
+        self.assertEqual(self.cache.get('zone', 'bar.com'), [])
+        self.assertEqual(self.cache.stats()['hits'], 2)
+        self.assertEqual(self.cache.stats()['misses'], 1)
+
+        # Everything expires after the TTL
+        self.now += 61
+        self.assertIsNone(self.cache.get('zone', 'foo.com'))
+        self.assertIsNone(self.cache.get('zone', 'bar.com'))
+
+    def test_eviction(self):
+        """ Test that the cache is bounded and evicts the oldest record """
+
+        records = [new_resource_record('host%d.com' % i, '10.0.0.1')
+                   for i in range(4)]
+
+        self.cache.load_zone('zone', records[:3])
+        self.cache.lookup('zone', 'host0.com')  # Recently used
+        self.cache.put('zone', records[3])
+
+        self.assertEqual(len(self.cache), 3)
+        self.assertIsNone(self.cache.lookup('zone', 'host1.com'))
+        self.assertEqual(self.cache.lookup('zone', 'host0.com'), records[:1])
+
+        # The zone is no longer completely cached
+        self.assertFalse(self.cache.is_loaded('zone'))
+
+    def test_too_large(self):
+        """ Test that a zone which doesn't fit leaves the cache alone """
+
+        record = new_resource_record('other.com', '10.0.0.1')
+        self.cache.load_zone('other', [record])
+
+        self.cache.load_zone('zone', [
+            new_resource_record('host%d.com' % i, '10.0.0.1')
+            for i in range(4)])
+
+        self.assertFalse(self.cache.is_loaded('zone'))
+        self.assertTrue(self.cache.is_too_large('zone'))
+        self.assertEqual(self.cache.lookup('other', 'other.com'), [record])
+
+        # Listed again once the TTL runs out, in case it has shrunk
+        self.now += 61
+        self.assertFalse(self.cache.is_too_large('zone'))
+
+
+class CachedBackendTestCase(unittest.TestCase):
+    def setUp(self):
+        record_cache.clear()
+        hosted_zones.clear()
+
+        patcher = patch.dict(app.config, {'RECORD_CACHE_ENABLED': True})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(record_cache.clear)
+        self.addCleanup(hosted_zones.clear)
+
+    def test_find_resource_record(self):
+        """ Test that lookups are served from a single listing of the zone """
+
+        records = [new_resource_record('host%d.com' % i, '10.0.0.1')
+                   for i in range(5)]
+        client = MockZoneClient(records)
+
+        self.assertEqual(find_resource_record('host3.com', client=client),
+                         records[3])
+        self.assertEqual(client.calls, 3)  # Three pages
+
+        self.assertEqual(find_resource_record('host0.com', client=client),
+                         records[0])
+        self.assertIsNone(find_resource_record('missing.com', client=client))
+        self.assertEqual(client.calls, 3)
+
+    def test_find_resource_record_large_zone(self):
+        """ Test that a zone too large to cache is only listed once """
+
+        records = [new_resource_record('host%d.com' % i, '10.0.0.1')
+                   for i in range(5)]
+        client = MockZoneClient(records)
+
+        with patch.object(record_cache, 'max_size', 3):
+            self.assertEqual(find_resource_record('host3.com', client=client),
+                             records[3])
+            self.assertEqual(client.calls, 4)  # Three pages, then the record
+
+            self.assertEqual(find_resource_record('host1.com', client=client),
+                             records[1])
+            self.assertEqual(client.calls, 5)
+
+    def test_find_resource_records(self):
+        """ Test that only lookups the cache can't answer use threads """
+
+        records = [new_resource_record('host%d.com' % i, '10.0.0.1')
+                   for i in range(5)]
+        client = MockZoneClient(records)
+        names = ['host1.com', 'host3.com', 'missing.com']
+
+        with patch.object(route53, '_get_executor') as mocked_executor:
+            # Listing the zone doesn't fit, so each record is looked up
+            with patch.object(record_cache, 'max_size', 3):
+                find_resource_record('host0.com', client=client)
+                find_resource_records(names, client=client)
+
+            self.assertEqual(mocked_executor.return_value.submit.call_count,
+                             3)
+
+            record_cache.clear()
+            find_resource_record('host0.com', client=client)
+            mocked_executor.reset_mock()
+
+            lookups = find_resource_records(names, client=client)
+            self.assertEqual([lookup.result() for lookup in lookups],
+                             [records[1], records[3], None])
+            self.assertFalse(mocked_executor.called)
+
+    def test_find_resource_record_workers(self):
+        """ Test that a worker doesn't miss another's change to a record """
+
+        clock = Clock()
+        shared_cache = MemoryBackend(clock=clock)
+        workers = [RecordCache(ttl=300, clock=clock) for _ in range(2)]
+        record = new_resource_record('foo.com', '10.0.0.1')
+        client = MockZoneClient([record])
+
+        def find(worker):
+            with patch.object(route53, 'record_cache', workers[worker]):
+                return find_resource_record('foo.com', client=client)
+
+        with patch.object(route53, 'shared_cache', shared_cache):
+            self.assertEqual(find(0), record)
+
+            # The second worker changes it, and the first has it cached
+            with patch.object(route53, 'record_cache', workers[1]):
+                update_resource_record(record, '10.0.0.2', client=client)
+
+            client.records = [new_resource_record('foo.com', '10.0.0.2')]
+
+            # Still the new value once the shared record has expired
+            clock.now += app.config['CACHE_TTL']
+            self.assertEqual(find(0), client.records[0])
+
+    def test_update_resource_record(self):
+        """ Test that the cache is updated after a successful change """
+
+        record = new_resource_record('foo.com', '10.0.0.1')
+        client = MockZoneClient([record])
+
+        find_resource_record('foo.com', client=client)
+        update_resource_record(record, '10.0.0.2', client=client)
+
+        updated = find_resource_record('foo.com', client=client)
+        self.assertEqual(updated['ResourceRecords'], [{'Value': '10.0.0.2'}])
+        self.assertEqual(client.calls, 2)
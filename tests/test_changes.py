@@ -0,0 +1,170 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from route53_dyndns import route53
+from route53_dyndns.changes import (
+    change_id, ChangeTracker, INSYNC, PENDING, TRACK_ERRORS)
+
+from mock import Mock, patch
+
+from .helpers import Clock, new_resource_record
+from .test_backend import MockRoute53Client
+
+
+def change_info(change, status=PENDING):
+    return {'Id': '/change/' + change, 'Status': status}
+
+
+class ChangeTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'changes.db')
+        self.clock = Clock()
+        self.statuses = {}
+        self.get_change = Mock(side_effect=lambda change: self.statuses.get(
+            change, PENDING))
+        self.tracker = ChangeTracker(self.path, self.get_change,
+                                     min_interval=2, max_interval=10,
+                                     max_age=3600, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_change_id(self):
+        self.assertEqual(change_id(change_info('C1')), 'C1')
+        self.assertEqual(change_id({'Id': 'C1'}), 'C1')
+
+    def test_status(self):
+        self.tracker.track(change_info('C1'), ['www.google.com',
+                                               'mail.google.com.'])
+
+        self.assertEqual(
+            self.tracker.status(['WWW.google.com.', 'mail.google.com',
+                                 'ftp.google.com']),
+            [(PENDING, 'C1'), (PENDING, 'C1'), None])
+        self.assertEqual(self.tracker.pending(), 1)
+
+        # The latest change to a record is the one reported
+        self.tracker.track(change_info('C2', INSYNC), ['www.google.com'])
+        self.assertEqual(self.tracker.status(['www.google.com']),
+                         [(INSYNC, 'C2')])
+
+    def test_batch_shares_poll(self):
+        self.tracker.track(change_info('C1'), ['www.google.com',
+                                               'mail.google.com'])
+
+        self.assertEqual(self.tracker.poll_once(), 0)  # Not due yet
+
+        self.clock.now += 2
+        self.assertEqual(self.tracker.poll_once(), 1)
+        self.get_change.assert_called_once_with('C1')
+
+        self.statuses['C1'] = INSYNC
+        self.clock.now += 4
+        self.tracker.poll_once()
+
+        self.assertEqual(self.tracker.status(['www.google.com',
+                                              'mail.google.com']),
+                         [(INSYNC, 'C1'), (INSYNC, 'C1')])
+        self.assertEqual(self.tracker.pending(), 0)
+
+        # In sync changes aren't polled again
+        self.clock.now += 100
+        self.assertEqual(self.tracker.poll_once(), 0)
+
+    def test_interval_backs_off(self):
+        self.tracker.track(change_info('C1'), ['www.google.com'])
+        polls = []
+
+        for _ in range(30):
+            self.clock.now += 1
+
+            if self.tracker.poll_once():
+                polls.append(self.clock.now - 1000)
+
+        self.assertEqual(polls, [2, 4, 8, 16, 26])
+
+    def test_poll_error(self):
+        self.tracker.track(change_info('C1'), ['www.google.com'])
+        self.get_change.side_effect = RuntimeError("Error")
+
+        self.clock.now += 2
+        self.assertEqual(self.tracker.poll_once(), 1)
+        self.assertEqual(self.tracker.status(['www.google.com']),
+                         [(PENDING, 'C1')])
+
+    def test_shared(self):
+        self.tracker.track(change_info('C1'), ['www.google.com'])
+        other = ChangeTracker(self.path, self.get_change, min_interval=2,
+                              clock=self.clock)
+
+        self.assertEqual(other.status(['www.google.com']), [(PENDING, 'C1')])
+
+        # Only one of the trackers polls each change
+        self.clock.now += 2
+        self.assertEqual(self.tracker.poll_once() + other.poll_once(), 1)
+
+    def test_expire(self):
+        self.tracker.track(change_info('C1'), ['www.google.com'])
+        self.clock.now += 3000
+        self.tracker.track(change_info('C2'), ['mail.google.com'])
+        self.clock.now += 1000
+        self.tracker.expire()
+
+        self.assertEqual(self.tracker.status(['www.google.com',
+                                              'mail.google.com']),
+                         [None, (PENDING, 'C2')])
+
+
+class ChangeResourceRecordsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.tracker = ChangeTracker(
+            os.path.join(self.directory, 'changes.db'), Mock())
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_tracked(self):
+        client = MockRoute53Client()
+        changes = [{'Action': 'UPSERT',
+                    'ResourceRecordSet': new_resource_record(name, '10.0.0.1')}
+                   for name in ('www.google.com', 'mail.google.com')]
+
+        with patch.object(route53, 'change_tracker', self.tracker):
+            response = route53.change_resource_records('Z0', changes, client)
+
+        change = change_id(response['ChangeInfo'])
+        self.assertEqual(self.tracker.status(['www.google.com',
+                                              'mail.google.com']),
+                         [(PENDING, change), (PENDING, change)])
+
+    def test_track_error(self):
+        """ Test that a change which can't be tracked is still made """
+
+        client = MockRoute53Client()
+        changes = [{'Action': 'UPSERT',
+                    'ResourceRecordSet': new_resource_record('www.google.com',
+                                                             '10.0.0.1')}]
+        before = TRACK_ERRORS.values().get(None, 0)
+
+        with patch.object(route53, 'change_tracker', self.tracker), \
+                patch.object(self.tracker, 'track',
+                             side_effect=RuntimeError("Database Error")), \
+                self.assertLogs(route53.logger, 'ERROR'):
+            response = route53.change_resource_records('Z0', changes, client)
+
+        self.assertEqual(response['ChangeInfo']['Id'], 'string')
+        self.assertEqual(TRACK_ERRORS.values()[None], before + 1)
+
+    def test_get_change_status(self):
+        client = Mock()
+        client.get_change.return_value = {'ChangeInfo': change_info('C1',
+                                                                    INSYNC)}
+
+        self.assertEqual(route53.get_change_status('C1', client), INSYNC)
+        client.get_change.assert_called_once_with(Id='C1')
@@ -0,0 +1,56 @@
+import unittest
+
+from route53_dyndns.app import load_config
+from route53_dyndns.client import ClientManager
+
+from mock import Mock, patch
+
+app = load_config()
+
+
+@patch('boto3.client')
+class ClientManagerTestCase(unittest.TestCase):
+    def test_get_client(self, mocked_client):
+        """ Test that the client is built once and then reused """
+
+        manager = ClientManager()
+        mocked_client.side_effect = lambda *args, **kwargs: Mock()
+
+        client = manager.get_client()
+        self.assertIs(client, manager.get_client())
+        self.assertEqual(mocked_client.call_count, 1)
+
+        # Pool settings are passed through to botocore
+        config = mocked_client.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections,
+                         app.config['AWS_MAX_POOL_CONNECTIONS'])
+
+    def test_get_client_credentials_changed(self, mocked_client):
+        """ Test that the client is rebuilt when the credentials change """
+
+        manager = ClientManager()
+        mocked_client.side_effect = lambda *args, **kwargs: Mock()
+
+        client = manager.get_client()
+
+        with patch.dict(app.config, {'AWS_SECRET_ACCESS_KEY': 'changed'}):
+            new_client = manager.get_client()
+            self.assertIsNot(client, new_client)
+            self.assertIs(new_client, manager.get_client())
+
+        self.assertEqual(mocked_client.call_count, 2)
+
+    def test_reset(self, mocked_client):
+        """ Test that a reset, like in a forked child, drops the client """
+
+        manager = ClientManager()
+        mocked_client.side_effect = lambda *args, **kwargs: Mock()
+
+        client = manager.get_client()
+        manager.reset()
+        self.assertIsNot(client, manager.get_client())
+
+        # A changed PID is also noticed without the at-fork hook
+        client = manager.get_client()
+        manager._pid = -1
+        self.assertIsNot(client, manager.get_client())
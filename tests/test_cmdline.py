@@ -0,0 +1,78 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from route53_dyndns import app, cmdline
+
+from mock import Mock, patch
+
+
+@patch('route53_dyndns.cmdline.configure_logging')
+class CmdlineTestCase(unittest.TestCase):
+    @patch('route53_dyndns.cmdline.Server')
+    def test_main(self, mocked_server, mocked_logging):
+        """ Test that the production server is used by default """
+
+        cmdline.main(['--bind', '127.0.0.1:8000', '--workers', '3',
+                      '--preload'])
+
+        load_application, options = mocked_server.call_args[0]
+        self.assertIs(load_application(), app)
+        self.assertEqual(options['bind'], '127.0.0.1:8000')
+        self.assertEqual(options['workers'], 3)
+        self.assertEqual(options['threads'], 4)
+        self.assertTrue(options['preload_app'])
+        self.assertNotIn('worker_class', options)
+        self.assertTrue(mocked_server.return_value.run.called)
+
+    @patch('route53_dyndns.cmdline.Server')
+    def test_main_asgi(self, mocked_server, mocked_logging):
+        """ Test serving the asyncio app """
+
+        from route53_dyndns.asgi import application
+
+        cmdline.main(['--asgi'])
+
+        self.assertIs(mocked_server.call_args[0][0](), application)
+        self.assertEqual(mocked_server.call_args[0][1]['worker_class'],
+                         cmdline.ASGI_WORKER_CLASS)
+
+    def test_server_load(self, mocked_logging):
+        """ Test that the app is built when the server loads it """
+
+        mocked_create_app = Mock()
+        server = cmdline.Server(mocked_create_app, {'preload_app': False})
+        self.assertFalse(mocked_create_app.called)
+
+        self.assertIs(server.load(), mocked_create_app.return_value)
+
+        with patch('route53_dyndns.route53.get_client') as mocked_client:
+            server = cmdline.Server(mocked_create_app, {'preload_app': True})
+            server.load()
+
+            self.assertTrue(mocked_client.called)
+
+    @patch.object(app, 'run')
+    def test_main_debug(self, mocked_run, mocked_logging):
+        """ Test that the debug server needs an explicit flag """
+
+        cmdline.main(['--debug'])
+        mocked_run.assert_called_once_with(debug=True)
+
+    @patch('route53_dyndns.client.client_manager')
+    @patch('route53_dyndns.views.start_background_tasks')
+    def test_post_fork(self, mocked_start, mocked_manager, mocked_logging):
+        cmdline.post_fork(None, None)
+        self.assertTrue(mocked_manager.reset.called)
+        self.assertTrue(mocked_start.called)
+
+    def test_version_without_config(self, mocked_logging):
+        """ Test that the version is shown without loading the config """
+
+        environ = dict(os.environ, ROUTE53_DYNDNS_CONFIG='/nonexistent.cfg')
+        output = subprocess.check_output(
+            [sys.executable, '-c', 'from route53_dyndns import cmdline; '
+             'cmdline.main(["--version"])'], env=environ)
+
+        self.assertIn(cmdline.__version__, output.decode('utf-8'))
@@ -0,0 +1,158 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from route53_dyndns.credentials import (
+    CredentialStore, User, check_password, hash_password, parse_credentials)
+
+from mock import patch
+
+from .helpers import Clock
+
+ITERATIONS = 1000  # Much faster than the default, for tests
+
+
+class PasswordTestCase(unittest.TestCase):
+    def test_hash_password(self):
+        encoded = hash_password('secret', iterations=ITERATIONS)
+
+        self.assertTrue(encoded.startswith('pbkdf2_sha256$1000$'))
+        self.assertNotEqual(encoded, hash_password('secret',
+                                                   iterations=ITERATIONS))
+        self.assertTrue(check_password('secret', encoded))
+        self.assertFalse(check_password('Secret', encoded))
+
+    def test_check_password_bad_hash(self):
+        self.assertFalse(check_password('secret', 'secret'))
+        self.assertFalse(check_password('secret', 'md5$1$salt$hash'))
+        self.assertFalse(check_password('secret', 'pbkdf2_sha256$x$salt$h'))
+
+
+class UserTestCase(unittest.TestCase):
+    def test_may_update(self):
+        user = User('alice', None, ['Home.example.com', '*.lab.example.com'])
+
+        self.assertTrue(user.may_update('home.example.com.'))
+        self.assertTrue(user.may_update('nas.lab.example.com'))
+        self.assertFalse(user.may_update('lab.example.com'))
+        self.assertFalse(user.may_update('work.example.com'))
+        self.assertFalse(user.may_update('evillab.example.com'))
+
+    def test_may_update_anything(self):
+        self.assertTrue(User('admin', None).may_update('foo.example.com'))
+        self.assertTrue(User('admin', None, ['*']).may_update('foo.com'))
+
+    def test_parse_credentials(self):
+        users = parse_credentials([
+            '# Comment',
+            '',
+            'alice:hash:home.example.com, *.lab.example.com',
+            'admin:hash2:*',
+        ])
+
+        self.assertEqual(sorted(users), ['admin', 'alice'])
+        self.assertEqual(users['alice'].password_hash, 'hash')
+        self.assertTrue(users['alice'].may_update('nas.lab.example.com'))
+        self.assertTrue(users['admin'].any_hostname)
+
+        for line in ('alice:hash', 'alice:hash:', 'alice:hash:a.com:b'):
+            with self.assertRaises(ValueError):
+                parse_credentials([line])
+
+
+class CredentialStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'credentials')
+        self.clock = Clock()
+        self.write('alice', 'secret', 'home.example.com')
+        self.store = CredentialStore(self.path, cache_ttl=60, cache_max_size=2,
+                                     reload_interval=5, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, *users):
+        lines = []
+
+        for index in range(0, len(users), 3):
+            username, password, hostnames = users[index:index + 3]
+            lines.append('{}:{}:{}\n'.format(username, hash_password(
+                password, iterations=ITERATIONS), hostnames))
+
+        with open(self.path, 'w') as credentials_file:
+            credentials_file.writelines(lines)
+
+        # Make sure the change is noticed even within the mtime resolution
+        self.clock.now += 10
+        os.utime(self.path, (self.clock.now, self.clock.now))
+
+    def test_verify(self):
+        user = self.store.verify('alice', 'secret')
+
+        self.assertEqual(user.username, 'alice')
+        self.assertTrue(user.may_update('home.example.com'))
+        self.assertIsNone(self.store.verify('alice', 'wrong'))
+        self.assertIsNone(self.store.verify('bob', 'secret'))
+
+    @patch('route53_dyndns.credentials.check_password')
+    def test_verify_cached(self, mocked_check):
+        mocked_check.return_value = True
+
+        self.store.verify('alice', 'secret')
+        self.store.verify('alice', 'secret')
+        self.assertEqual(mocked_check.call_count, 1)
+
+        # A different password is always checked
+        mocked_check.return_value = False
+        self.assertIsNone(self.store.verify('alice', 'wrong'))
+        self.assertEqual(mocked_check.call_count, 2)
+
+        # Expired
+        self.clock.now += 61
+        self.store.verify('alice', 'secret')
+        self.assertEqual(mocked_check.call_count, 3)
+
+    @patch('route53_dyndns.credentials.check_password')
+    def test_verify_unknown_user(self, mocked_check):
+        self.store.verify('bob', 'secret')
+
+        # A hash is still checked, so it takes as long as a real user
+        self.assertEqual(mocked_check.call_count, 1)
+
+    def test_reload(self):
+        self.assertTrue(self.store.verify('alice', 'secret'))
+
+        self.write('alice', 'changed', 'home.example.com',
+                   'bob', 'secret', '*')
+
+        self.assertIsNone(self.store.verify('alice', 'secret'))
+        self.assertTrue(self.store.verify('alice', 'changed'))
+        self.assertTrue(self.store.verify('bob', 'secret'))
+        self.assertEqual(len(self.store), 2)
+
+    def test_reload_interval(self):
+        self.write('bob', 'secret', '*')
+        self.clock.now = self.store._checked + 1
+
+        # Not checked for changes until the interval has passed
+        self.assertIsNone(self.store.verify('bob', 'secret'))
+
+        self.clock.now += 5
+        self.assertTrue(self.store.verify('bob', 'secret'))
+
+    def test_reload_bad_file(self):
+        with open(self.path, 'w') as credentials_file:
+            credentials_file.write('garbage\n')
+
+        self.clock.now += 10
+
+        # The last good credentials are kept
+        self.assertTrue(self.store.verify('alice', 'secret'))
+
+        os.remove(self.path)
+        self.clock.now += 10
+        self.assertTrue(self.store.verify('alice', 'secret'))
@@ -1,11 +1,22 @@
 from __future__ import unicode_literals
 
 from base64 import b64encode
+from concurrent.futures import Future
+import os
+import shutil
+import sys
+import tempfile
 import unittest
 
 from flask import Response
 
 from route53_dyndns import app, route53, views
+from route53_dyndns.addresses import AddressParser
+from route53_dyndns.credentials import User
+from route53_dyndns.history import UpdateHistory
+from route53_dyndns.profiling import PHASE_SECONDS, Profiler
+from route53_dyndns.proxies import ClientResolver, NetworkSet
+from route53_dyndns.ratelimit import TokenBuckets
 
 from mock import patch
 
@@ -59,6 +70,21 @@ class FrontendTestCase(unittest.TestCase):
 
                 self.assertTrue(setting in app.config)
 
+    def test_load_config_error(self):
+        app_module = sys.modules['route53_dyndns.app']
+        environ = {app_module.CONFIG_ENVIRONMENT_VAR: '/nonexistent.cfg'}
+
+        with patch.object(app_module, '_config_loaded', False), \
+                patch.dict(os.environ, environ):
+            with self.assertRaises(RuntimeError) as context:
+                app_module.load_config()
+
+        self.assertIn('/nonexistent.cfg', str(context.exception))
+
+    def test_health(self):
+        rv = self.app.get('/health')
+        self.assertResponseEqual('OK', rv)
+
     def test_app_response(self):
         response = "Hello World!"
 
@@ -82,6 +108,10 @@ class FrontendTestCase(unittest.TestCase):
 
         verified = views.verify_auth('admin', 'secret')
         self.assertTrue(verified)
+        self.assertTrue(verified.may_update('www.google.com'))
+
+        verified = views.verify_auth('root', 'secret')
+        self.assertFalse(verified)
 
     def test_nic_update_http(self):
         # Check that the trailing slash on the URL is optional
@@ -205,3 +235,350 @@ class FrontendTestCase(unittest.TestCase):
             rv = self.get_with_auth(url,
                                     environ_base={'REMOTE_ADDR': new_value})
             self.assertResponseEqual(views.IP_CHANGED % new_value, rv)
+
+    @patch('route53_dyndns.route53.update_resource_records')
+    @patch('route53_dyndns.route53.find_resource_record')
+    @patch('route53_dyndns.views.verify_auth', **{'method.return_value': True})
+    def test_nic_update_multiple_hosts(self, mocked_auth, mocked_find_record,
+                                       mocked_update_records):
+        value = "10.1.10.1"
+        new_value = "192.168.1.1"
+        records = {
+            "www.google.com": new_resource_record("www.google.com", value),
+            "mail.google.com": new_resource_record("mail.google.com",
+                                                   new_value),
+            "ftp.google.com": new_resource_record("ftp.google.com", value),
+        }
+        mocked_find_record.side_effect = (
+            lambda name, client, record_type: records.get(name))
+
+        def update_records(updates, user=None):
+            results = []
+
+            for resource_record, _ in updates:
+                result = Future()
+
+                if resource_record['Name'] == "ftp.google.com":
+                    result.set_exception(route53.Route53Exception("Error"))
+                else:
+                    result.set_result(True)
+
+                results.append(result)
+
+            return results
+
+        mocked_update_records.side_effect = update_records
+
+        # One line per host in the order given, with one call for all updates
+        url = (self.url + '?hostname=www.google.com, mail.google.com,'
+               'missing.google.com,ftp.google.com&myip=' + new_value)
+        rv = self.get_with_auth(url)
+        self.assertResponseEqual('\n'.join([views.IP_CHANGED % new_value,
+                                            views.NO_CHANGE % new_value,
+                                            views.NO_HOST,
+                                            views.GENERAL_ERROR]), rv)
+        self.assertEqual(mocked_update_records.call_count, 1)
+
+        # Too many hosts in a single request
+        with patch.dict(app.config, {'MAX_HOSTNAMES': 2}):
+            url = self.url + '?hostname=a.google.com,b.google.com,c.google.com'
+            rv = self.get_with_auth(url)
+            self.assertResponseEqual(views.TOO_MANY_HOSTS, rv)
+
+    @patch('route53_dyndns.route53.find_resource_record')
+    @patch('route53_dyndns.views.verify_auth')
+    def test_nic_update_user_hostnames(self, mocked_auth, mocked_find_record):
+        value = "10.1.10.1"
+        mocked_auth.return_value = User('alice', None, ['*.google.com'])
+        mocked_find_record.side_effect = (
+            lambda name, client, record_type: new_resource_record(name,
+                                                                  value))
+
+        # Hostnames the user may not update don't exist as far as they know
+        url = (self.url + '?hostname=www.google.com,www.example.com&myip=' +
+               value)
+        rv = self.get_with_auth(url)
+        self.assertResponseEqual('\n'.join([views.NO_CHANGE % value,
+                                            views.NO_HOST]), rv)
+        self.assertEqual(mocked_find_record.call_count, 1)
+
+    @patch('route53_dyndns.route53.find_resource_record')
+    @patch('route53_dyndns.views.verify_auth', **{'method.return_value': True})
+    def test_nic_update_rate_limited(self, mocked_auth, mocked_find_record):
+        value = "10.1.10.1"
+        mocked_find_record.side_effect = (
+            lambda name, client, record_type: new_resource_record(name,
+                                                                  value))
+        url = (self.url + '?hostname=www.google.com&myip=' + value)
+
+        with patch.object(views, 'rate_limiter', TokenBuckets(0, 1)):
+            rv = self.get_with_auth(url)
+            self.assertResponseEqual(views.NO_CHANGE % value, rv)
+
+            # Refused before looking up the record again
+            rv = self.get_with_auth(url)
+            self.assertResponseEqual(views.ABUSE, rv)
+            self.assertEqual(mocked_find_record.call_count, 1)
+
+    @patch('route53_dyndns.route53.update_resource_record')
+    @patch('route53_dyndns.route53.find_resource_record')
+    @patch('route53_dyndns.views.verify_auth', **{'method.return_value': True})
+    def test_nic_update_flapping(self, mocked_auth, mocked_find_record,
+                                 mocked_update_record):
+        records = {"www.google.com": "10.1.10.1"}
+        mocked_find_record.side_effect = lambda name, client, record_type: (
+            new_resource_record(name, records[name]))
+
+        def update_record(resource_record, values, client, user=None):
+            records[resource_record['Name']], = values
+            return True
+
+        mocked_update_record.side_effect = update_record
+
+        with patch.object(views, 'update_history', UpdateHistory(2, 600)):
+            for value in ("192.168.1.1", "10.1.10.1"):
+                url = self.url + '?hostname=www.google.com&myip=' + value
+                rv = self.get_with_auth(url)
+                self.assertResponseEqual(views.IP_CHANGED % value, rv)
+
+            # Held down, so the client is told the current value
+            url = self.url + '?hostname=www.google.com&myip=192.168.1.1'
+            rv = self.get_with_auth(url)
+            self.assertResponseEqual(views.NO_CHANGE % "10.1.10.1", rv)
+            self.assertEqual(mocked_update_record.call_count, 2)
+
+    @patch('route53_dyndns.route53.update_resource_records')
+    @patch('route53_dyndns.route53.find_resource_record')
+    @patch('route53_dyndns.views.verify_auth')
+    def test_nic_update_logs(self, mocked_auth, mocked_find_record,
+                             mocked_update_records):
+        mocked_auth.return_value = User('alice', None)
+        mocked_find_record.side_effect = lambda name, client, record_type: (
+            new_resource_record(name, '10.0.0.1')
+            if name != 'mail.google.com' else None)
+
+        def update_records(updates, user=None):
+            result = Future()
+            result.set_exception(route53.Route53Exception("Throttled"))
+
+            return [result for _ in updates]
+
+        mocked_update_records.side_effect = update_records
+        url = (self.url + '?hostname=www.google.com,mail.google.com&'
+               'myip=10.0.0.2')
+
+        with self.assertLogs('route53_dyndns.views', 'INFO') as logs:
+            self.get_with_auth(url)
+            self.get_with_auth(url, environ_base={'HTTP_USER_AGENT': ''})
+
+        update, missing, refused = logs.records
+        self.assertEqual(update.user, 'alice')
+        self.assertEqual(update.hostname, 'www.google.com')
+        self.assertEqual(update.decision, views.GENERAL_ERROR)
+        self.assertEqual(update.old, '10.0.0.1')
+        self.assertIsNone(update.new)
+        self.assertEqual(update.error, 'Route53Exception')
+        self.assertGreaterEqual(update.backend_ms, 0)
+
+        self.assertEqual(missing.decision, views.NO_HOST)
+        self.assertIsNone(missing.old)
+        self.assertIsNone(missing.error)
+
+        self.assertEqual(refused.decision, views.BAD_USER_AGENT)
+        self.assertEqual(refused.hostname, 'www.google.com,mail.google.com')
+
+        # Only a sample of the hosts which didn't change are logged
+        url = self.url + '?hostname=www.google.com&myip=10.0.0.1'
+
+        with patch.object(views.nochg_sampler, 'rate', 0.1), \
+                self.assertLogs('route53_dyndns.views', 'INFO') as logs:
+            for sample in (0.5, 0.05):
+                with patch.object(views.nochg_sampler, '_random',
+                                  lambda: sample):
+                    rv = self.get_with_auth(url)
+                    self.assertResponseEqual(views.NO_CHANGE % '10.0.0.1',
+                                             rv)
+
+        nochg, = logs.records
+        self.assertEqual(nochg.new, '10.0.0.1')
+        self.assertEqual(nochg.sample_rate, 0.1)
+
+    @patch('route53_dyndns.route53.find_resource_record')
+    @patch('route53_dyndns.views.verify_auth')
+    def test_nic_update_phases(self, mocked_auth, mocked_find_record):
+        mocked_auth.return_value = User('alice', None)
+        mocked_find_record.return_value = new_resource_record(
+            'www.google.com', '10.0.0.1')
+
+        def counts():
+            return dict((phase, sum(counts[:-1])) for phase, counts
+                        in PHASE_SECONDS.values().items())
+
+        before = counts()
+
+        with patch.object(views, 'profiler', Profiler(enabled=True)):
+            self.get_with_auth(self.url + '?hostname=www.google.com&'
+                               'myip=10.0.0.1')
+
+        after = counts()
+
+        for phase in ('auth', 'request', 'client', 'find', 'log'):
+            self.assertEqual(after[phase], before.get(phase, 0) + 1, phase)
+
+        # Nothing needed updating
+        self.assertEqual(after.get('update'), before.get('update'))
+
+    @patch('route53_dyndns.views.verify_auth')
+    def test_admin_profiling(self, mocked_auth):
+        mocked_auth.return_value = User('alice', None)
+        url = '/admin/profiling'
+        headers = self.make_auth_header('alice', 'secret')
+
+        # Only available with somewhere to put the profiles
+        rv = self.app.get(url, headers=headers)
+        self.assertEqual(rv.status_code, 404)
+
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+
+        with patch.object(views, 'profiler', Profiler(directory=directory)):
+            rv = self.app.get(url, headers=headers)
+            self.assertEqual(rv.status_code, 403)
+
+            with patch.dict(app.config, {'ADMIN_USERS': ['alice']}):
+                rv = self.app.get(url, headers=headers)
+                self.assertResponseEqual('off', rv)
+
+                rv = self.app.post(url, headers=headers,
+                                   data={'enabled': '1'})
+                self.assertResponseEqual('on', rv)
+                self.assertTrue(views.profiler.is_profiling())
+
+                rv = self.app.post(url, headers=headers,
+                                   data={'enabled': '0'})
+                self.assertResponseEqual('off', rv)
+
+    @patch('route53_dyndns.views.verify_auth')
+    def test_nic_status(self, mocked_auth):
+        mocked_auth.return_value = User('alice', None, ['*.google.com'])
+        url = ('/nic/status?hostname=www.google.com,mail.google.com,'
+               'www.bing.com')
+
+        with patch.object(route53, 'change_tracker', None):
+            rv = self.get_with_auth(url)
+            self.assertEqual(rv.status_code, 404)
+
+        with patch.object(route53, 'change_tracker') as tracker:
+            tracker.status.return_value = [('INSYNC', 'C1'), None, None]
+            rv = self.get_with_auth(url)
+            self.assertResponseEqual('\n'.join([
+                'INSYNC C1', views.UNKNOWN_CHANGE, views.NO_HOST]), rv)
+
+            rv = self.get_with_auth('/nic/status')
+            self.assertResponseEqual(views.NO_HOST, rv)
+
+    @patch('route53_dyndns.route53.update_resource_records')
+    @patch('route53_dyndns.route53.find_resource_record')
+    @patch('route53_dyndns.views.verify_auth', **{'method.return_value': True})
+    def test_nic_update_addresses(self, mocked_auth, mocked_find_record,
+                                  mocked_update_records):
+        records = {
+            ('www.google.com', 'A'): new_resource_record(
+                'www.google.com', ['10.0.0.2', '10.0.0.1']),
+            ('www.google.com', 'AAAA'): new_resource_record(
+                'www.google.com', '2001:DB8:0::1', 'AAAA'),
+            ('mail.google.com', 'A'): new_resource_record(
+                'mail.google.com', '10.0.0.1'),
+        }
+        mocked_find_record.side_effect = (
+            lambda name, client, record_type: records.get((name,
+                                                           record_type)))
+
+        def update_records(updates, user=None):
+            results = [Future() for _ in updates]
+
+            for result in results:
+                result.set_result(True)
+
+            return results
+
+        mocked_update_records.side_effect = update_records
+
+        # Invalid addresses are refused before any lookups
+        for myip in ('foo', '10.0.0.1;10.0.0.2', '10.0.0.300'):
+            rv = self.get_with_auth(self.url + '?hostname=www.google.com&'
+                                    'myip=' + myip)
+            self.assertResponseEqual(views.BAD_IP, rv)
+
+        self.assertFalse(mocked_find_record.called)
+
+        with patch.object(views, 'address_parser',
+                          AddressParser(reject_bogons=True)):
+            rv = self.get_with_auth(self.url + '?hostname=www.google.com&'
+                                    'myip=192.168.1.1')
+            self.assertResponseEqual(views.BAD_IP, rv)
+
+        # Order and formatting don't matter, and records of a type a host
+        # doesn't have are left alone
+        url = (self.url + '?hostname=www.google.com,mail.google.com&'
+               'myip=2001:db8::1,10.0.0.1,10.0.0.2')
+        rv = self.get_with_auth(url)
+        self.assertResponseEqual('\n'.join([
+            views.NO_CHANGE % '10.0.0.1,10.0.0.2,2001:db8::1',
+            views.IP_CHANGED % '10.0.0.1,10.0.0.2,2001:db8::1']), rv)
+
+        updates, = mocked_update_records.call_args[0]
+        self.assertEqual(updates, [(records[('mail.google.com', 'A')],
+                                    ['10.0.0.1', '10.0.0.2'])])
+        self.assertEqual(mocked_update_records.call_args[1],
+                         {'user': mocked_auth().username})
+
+        # Each address goes in the record set of its type
+        url = self.url + '?hostname=www.google.com&myip=10.0.0.1,2001:db8::2'
+        rv = self.get_with_auth(url)
+        self.assertResponseEqual(views.IP_CHANGED % '10.0.0.1,2001:db8::2', rv)
+
+        updates, = mocked_update_records.call_args[0]
+        self.assertEqual(updates, [
+            (records[('www.google.com', 'A')], ['10.0.0.1']),
+            (records[('www.google.com', 'AAAA')], ['2001:db8::2'])])
+
+        # Only hosts without any record of the types given don't exist
+        url = self.url + '?hostname=mail.google.com&myip=2001:db8::1'
+        rv = self.get_with_auth(url)
+        self.assertResponseEqual(views.NO_HOST, rv)
+
+    @patch('route53_dyndns.route53.update_resource_record')
+    @patch('route53_dyndns.route53.find_resource_record')
+    @patch('route53_dyndns.views.verify_auth', **{'method.return_value': True})
+    def test_nic_update_forwarded(self, mocked_auth, mocked_find_record,
+                                  mocked_update_record):
+        mocked_find_record.return_value = new_resource_record(
+            "www.google.com", "203.0.113.1")
+        mocked_update_record.return_value = True
+        url = self.url + '?hostname=www.google.com'
+        forwarded = {'HTTP_X_FORWARDED_FOR': '203.0.113.2, 10.0.0.1',
+                     'REMOTE_ADDR': '10.0.0.2'}
+
+        # The header is ignored unless the proxy is trusted
+        rv = self.get_with_auth(url, environ_base=dict(forwarded))
+        self.assertResponseEqual(views.IP_CHANGED % '10.0.0.2', rv)
+
+        with patch.object(views, 'client_resolver',
+                          ClientResolver(['10.0.0.0/8'])):
+            rv = self.get_with_auth(url, environ_base=dict(forwarded))
+            self.assertResponseEqual(views.IP_CHANGED % '203.0.113.2', rv)
+
+            with patch.object(views, 'client_networks',
+                              NetworkSet(['198.51.100.0/24'])):
+                # Only logged by default
+                with self.assertLogs('route53_dyndns.views', 'WARNING'):
+                    rv = self.get_with_auth(url, environ_base=dict(forwarded))
+
+                self.assertResponseEqual(views.IP_CHANGED % '203.0.113.2',
+                                         rv)
+
+                with patch.dict(app.config, {'CLIENT_POLICY': 'reject'}):
+                    rv = self.get_with_auth(url,
+                                            environ_base=dict(forwarded))
+                    self.assertResponseEqual(views.ABUSE, rv)
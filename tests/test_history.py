@@ -0,0 +1,99 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from route53_dyndns.backends import MemoryBackend
+from route53_dyndns.history import UpdateHistory
+
+from .helpers import Clock, new_resource_record
+
+
+class UpdateHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock(1000000.0)
+        self.history = UpdateHistory(2, 60, max_size=2, clock=self.clock)
+        self.record = new_resource_record('www.google.com', '10.1.10.1')
+
+    def test_held_down(self):
+        self.assertFalse(self.history.held_down(self.record))
+
+        self.history.record(self.record)
+        self.clock.now += 10
+        self.assertFalse(self.history.held_down(self.record))
+
+        self.history.record(self.record)
+        self.assertTrue(self.history.held_down(self.record))
+
+        # Same record, whatever the case of the name
+        self.assertTrue(self.history.held_down(
+            new_resource_record('WWW.google.com.', '10.1.10.1')))
+
+        # Released once the first update is out of the window
+        self.clock.now += 51
+        self.assertFalse(self.history.held_down(self.record))
+
+        self.history.record(self.record)
+        self.assertTrue(self.history.held_down(self.record))
+
+    def test_max_size(self):
+        for name in ('a.google.com', 'b.google.com', 'c.google.com'):
+            self.history.record(new_resource_record(name, '10.1.10.1'))
+
+        self.assertEqual(len(self.history), 2)
+
+    def test_backend(self):
+        backend = MemoryBackend(clock=self.clock)
+        history = UpdateHistory(2, 60, backend=backend, clock=self.clock)
+        other = UpdateHistory(2, 60, backend=backend, clock=self.clock)
+
+        history.record(self.record)
+        other.record(self.record)
+
+        # Both workers see the updates the other made
+        self.assertTrue(history.held_down(self.record))
+        self.assertTrue(other.held_down(self.record))
+        self.assertEqual(len(history), 0)
+
+        self.clock.now += 60
+        self.assertFalse(history.held_down(self.record))
+
+
+class PersistentUpdateHistoryTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'history')
+        self.clock = Clock(1000000.0)
+        self.record = new_resource_record('www.google.com', '10.1.10.1')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_history(self):
+        history = UpdateHistory(1, 60, path=self.path, clock=self.clock)
+        history._saver = os.getpid()  # No background saving in tests
+
+        return history
+
+    def test_save_load(self):
+        history = self.new_history()
+        history.record(self.record)
+        history.save()
+
+        self.assertTrue(self.new_history().held_down(self.record))
+
+    def test_load_bad_file(self):
+        history = self.new_history()
+        history.record(self.record)
+        history.save()
+
+        with open(self.path, 'rb') as history_file:
+            data = history_file.read()
+
+        for bad_data in (data[:-1], b'garbage'):
+            with open(self.path, 'wb') as history_file:
+                history_file.write(bad_data)
+
+            self.assertEqual(len(self.new_history()), 0)
@@ -0,0 +1,185 @@
+import io
+import json
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+from route53_dyndns import route53
+from route53_dyndns.logs import (
+    AuditLog, JsonFormatter, NoChangeSampler, QueueingHandler)
+
+from mock import patch
+
+from .helpers import new_resource_record
+from .test_backend import MockRoute53Client
+
+
+def log_record(message='Update', **fields):
+    record = logging.makeLogRecord(dict(name='route53_dyndns.views',
+                                        levelname='INFO', msg=message,
+                                        created=0))
+    record.__dict__.update(fields)
+
+    return record
+
+
+class JsonFormatterTestCase(unittest.TestCase):
+    def test_format(self):
+        line = JsonFormatter().format(log_record(
+            user='alice', hostname='www.google.com', decision='good',
+            backend_ms=12.5))
+
+        self.assertEqual(json.loads(line), {
+            'time': '1970-01-01T00:00:00Z', 'level': 'INFO',
+            'logger': 'route53_dyndns.views', 'message': 'Update',
+            'user': 'alice', 'hostname': 'www.google.com',
+            'decision': 'good', 'backend_ms': 12.5})
+
+    def test_format_exception(self):
+        try:
+            raise ValueError("Bad value")
+        except ValueError:
+            record = log_record()
+            record.exc_info = sys.exc_info()
+
+        fields = json.loads(JsonFormatter().format(record))
+        self.assertEqual(fields['error'], 'ValueError')
+        self.assertIn("Bad value", fields['traceback'])
+
+
+class NoChangeSamplerTestCase(unittest.TestCase):
+    def test_filter(self):
+        samples = iter([0.5, 0.05])
+        sampler = NoChangeSampler(0.1, random=lambda: next(samples))
+
+        self.assertTrue(sampler.filter(log_record(decision='good')))
+        self.assertTrue(sampler.filter(log_record()))
+
+        self.assertFalse(sampler.filter(log_record(decision='nochg')))
+
+        record = log_record(decision='nochg')
+        self.assertTrue(sampler.filter(record))
+        self.assertEqual(record.sample_rate, 0.1)
+
+
+class QueueingHandlerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stream = io.StringIO()
+        self.handler = QueueingHandler(self.stream, max_queued=3,
+                                       batch_size=2)
+        self.handler.setFormatter(logging.Formatter('%(message)s'))
+
+    @patch.object(QueueingHandler, 'start')
+    def test_batches(self, mocked_start):
+        with patch.object(self.stream, 'flush',
+                          wraps=self.stream.flush) as mocked_flush:
+            for message in ('a', 'b', 'c'):
+                self.handler.handle(log_record(message))
+
+            self.assertEqual(self.stream.getvalue(), '')
+
+            self.handler.flush()
+
+            self.assertEqual(self.stream.getvalue(), 'a\nb\nc\n')
+            self.assertEqual(mocked_flush.call_count, 2)
+
+    @patch.object(QueueingHandler, 'start')
+    def test_full(self, mocked_start):
+        for message in ('a', 'b', 'c', 'd'):
+            self.handler.handle(log_record(message))
+
+        # Dropped rather than waiting for the writer
+        self.handler.flush()
+        self.assertEqual(self.stream.getvalue(), 'a\nb\nc\n')
+
+    def test_writer(self):
+        self.handler.flush_interval = 0
+        self.handler.handle(log_record('a'))
+
+        # The writer thread writes it without being flushed
+        for _ in range(100):
+            if self.stream.getvalue():
+                break
+
+            time.sleep(0.01)
+
+        self.assertEqual(self.stream.getvalue(), 'a\n')
+
+
+class AuditLogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'audit.log')
+        self.audit_log = AuditLog(self.path, clock=lambda: 0)
+
+    def tearDown(self):
+        self.audit_log.close()
+        shutil.rmtree(self.directory)
+
+    def read(self):
+        with open(self.path) as audit_file:
+            return [json.loads(line) for line in audit_file]
+
+    def test_record(self):
+        changes = [{'Action': 'UPSERT',
+                    'ResourceRecordSet': new_resource_record(
+                        'www.google.com', ['10.0.0.1', '10.0.0.2'])}]
+
+        self.audit_log.record('Z0', changes, {'Id': '/change/C1'})
+        self.audit_log.record('Z0', changes, {'Id': '/change/C2'})
+
+        first, second = self.read()
+        self.assertEqual(first, {
+            'time': '1970-01-01T00:00:00Z', 'zone': 'Z0', 'change': 'C1',
+            'action': 'UPSERT', 'name': 'www.google.com', 'type': 'A',
+            'ttl': 123, 'user': None, 'values': ['10.0.0.1', '10.0.0.2']})
+        self.assertEqual(second['change'], 'C2')
+
+        self.audit_log.record('Z0', changes, {'Id': '/change/C3'}, ['user'])
+        self.assertEqual(self.read()[2]['user'], 'user')
+
+    def test_change_resource_records(self):
+        """ Test that only changes Route 53 accepted are audited """
+
+        client = MockRoute53Client()
+        change = {'Action': 'UPSERT',
+                  'ResourceRecordSet': new_resource_record('www.google.com',
+                                                           '10.0.0.1')}
+
+        with patch.object(route53, 'audit_log', self.audit_log):
+            route53.change_resource_records('Z0', [change], client)
+
+            with patch.object(client, 'change_resource_record_sets') as m:
+                m.side_effect = RuntimeError("Route 53 Error")
+
+                with self.assertRaises(route53.Route53Exception):
+                    route53.change_resource_records('Z0', [change], client)
+
+        entry, = self.read()
+        self.assertEqual(entry['change'], 'string')
+        self.assertEqual(entry['values'], ['10.0.0.1'])
+
+    def test_update_resource_records_user(self):
+        """ Test that the user is audited but not sent to Route 53 """
+
+        client = MockRoute53Client()
+        resource_record = new_resource_record('www.google.com', '10.0.0.1')
+
+        with patch.object(route53, 'audit_log', self.audit_log), \
+                patch.object(client, 'change_resource_record_sets',
+                             wraps=client.change_resource_record_sets) as m, \
+                patch.object(route53, 'find_hosted_zone',
+                             return_value='Z0'):
+            route53.update_resource_records([(resource_record, '10.0.0.2')],
+                                            client, user='user')
+
+        change, = m.call_args[1]['ChangeBatch']['Changes']
+        self.assertNotIn(route53.REQUESTED_BY, change)
+
+        entry, = self.read()
+        self.assertEqual(entry['user'], 'user')
+        self.assertEqual(entry['values'], ['10.0.0.2'])
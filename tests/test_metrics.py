@@ -0,0 +1,151 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from route53_dyndns.app import create_app
+from route53_dyndns.metrics import Registry
+
+from mock import patch
+
+
+class MetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('requests_total', "Requests", 'code')
+        counter.inc('good')
+        counter.inc('good')
+        counter.inc('nochg', 3)
+
+        def increment():
+            counter.inc('good')
+
+        thread = threading.Thread(target=increment)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(counter.values(), {'good': 3, 'nochg': 3})
+
+    def test_exited_threads(self):
+        """ Test that the shards of exited threads are folded together """
+
+        counter = self.registry.counter('calls_total', "Calls")
+        histogram = self.registry.histogram('seconds', "Time", buckets=[1])
+
+        def work():
+            counter.inc()
+            histogram.observe(0.5)
+
+        for _ in range(10):
+            thread = threading.Thread(target=work)
+            thread.start()
+            thread.join()
+
+        self.assertEqual(counter.values(), {None: 10})
+        self.assertEqual(histogram.values(), {None: [10, 0, 5.0]})
+        self.assertEqual(len(counter._shards), 0)
+        self.assertEqual(len(histogram._shards), 0)
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('seconds', "Time",
+                                            buckets=(0.1, 1.0))
+        histogram.observe(0.05)
+        histogram.observe(0.5)
+        histogram.observe(5)
+
+        self.assertEqual(histogram.values(), {None: [1, 1, 1, 5.55]})
+
+        with histogram.time():
+            pass
+
+        self.assertEqual(histogram.values()[None][0], 2)
+
+    def test_render(self):
+        counter = self.registry.counter('requests_total', "Requests", 'code')
+        counter.inc('good')
+        self.registry.gauge('cache_size', "Cache size", lambda: 7)
+        histogram = self.registry.histogram('seconds', "Time",
+                                            buckets=(0.1,))
+        histogram.observe(0.05)
+
+        self.assertEqual(self.registry.render().splitlines(), [
+            '# HELP requests_total Requests',
+            '# TYPE requests_total counter',
+            'requests_total{code="good"} 1',
+            '# HELP cache_size Cache size',
+            '# TYPE cache_size gauge',
+            'cache_size 7',
+            '# HELP seconds Time',
+            '# TYPE seconds histogram',
+            'seconds_bucket{le="0.1"} 1',
+            'seconds_bucket{le="+Inf"} 1',
+            'seconds_sum 0.05',
+            'seconds_count 1',
+        ])
+
+    def test_reset(self):
+        counter = self.registry.counter('requests_total', "Requests")
+        counter.inc()
+        self.registry.reset()
+
+        self.assertEqual(counter.values(), {})
+
+
+class MultiProcessMetricsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.registry = Registry(self.directory)
+        self.counter = self.registry.counter('requests_total', "Requests")
+        self.gauge = self.registry.gauge('cache_size', "Cache size",
+                                         lambda: 5)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_collect(self):
+        parent = os.getppid()
+
+        with patch('route53_dyndns.metrics.os.getpid') as mocked_getpid:
+            self.flush_as(mocked_getpid, (parent, 2 ** 22 + 1))
+
+        self.counter.inc()
+
+        totals = self.registry.collect()
+        self.assertEqual(totals['requests_total'], {None: 3})
+        self.assertEqual(totals['cache_size'], {None: 10})
+        self.assertTrue(os.path.exists(os.path.join(
+            self.directory, 'metrics_%d.json' % parent)))
+
+    def flush_as(self, mocked_getpid, pids):
+        # Pretend to be two other worker processes, one of which has exited
+        for pid in pids:
+            mocked_getpid.return_value = pid
+            self.counter.inc()
+            self.registry.flush()
+            self.registry.reset()
+
+    def test_collect_ignores_bad_files(self):
+        with open(os.path.join(self.directory, 'metrics_1.json'), 'w') as f:
+            f.write('{')
+
+        self.counter.inc()
+
+        self.assertEqual(self.registry.collect()['requests_total'], {None: 1})
+
+
+class MetricsEndpointTestCase(unittest.TestCase):
+    def test_metrics(self):
+        rv = create_app().test_client().get('/metrics')
+
+        self.assertEqual(rv.status_code, 200)
+        self.assertEqual(rv.mimetype, 'text/plain')
+
+        body = rv.get_data(as_text=True)
+        self.assertIn('# TYPE dyndns_responses_total counter', body)
+        self.assertIn('# TYPE route53_find_seconds histogram', body)
+        self.assertFalse(body.endswith('\r\n'))
@@ -0,0 +1,126 @@
+import json
+import os
+import pstats
+import shutil
+import tempfile
+import time
+import unittest
+
+from route53_dyndns.profiling import Profiler, PHASE_SECONDS
+
+from .helpers import Clock
+
+
+class ProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.clock = Clock()
+
+    def profiler(self, **kwargs):
+        kwargs.setdefault('clock', self.clock)
+
+        return Profiler(**kwargs)
+
+    def test_disabled(self):
+        """ Test that nothing is timed or profiled when it's all off """
+
+        profiler = self.profiler()
+
+        with profiler.request() as request, profiler.phase('find') as phase:
+            pass
+
+        self.assertIs(request, phase)
+        self.assertFalse(hasattr(request, 'timings'))
+
+    def test_phases(self):
+        profiler = self.profiler(enabled=True)
+        before = sum(PHASE_SECONDS.values().get('find', [0])[:-1])
+
+        with profiler.request() as request:
+            with profiler.phase('find'):
+                time.sleep(0.01)
+
+            with profiler.phase('find'):
+                pass
+
+            with profiler.phase('update'):
+                pass
+
+        self.assertEqual(sorted(request.timings), ['find', 'update'])
+        self.assertGreaterEqual(request.timings['find'], 0.01)
+        self.assertEqual(sum(PHASE_SECONDS.values()['find'][:-1]),
+                         before + 2)
+
+        # Phases outside of a request are only counted
+        with profiler.phase('auth'):
+            pass
+
+    def test_switch(self):
+        profiler = self.profiler(directory=self.directory, check_interval=10)
+        other = self.profiler(directory=self.directory, check_interval=10)
+
+        self.assertFalse(profiler.is_profiling())
+        self.assertFalse(other.is_profiling())
+
+        profiler.switch(True)
+        self.assertTrue(profiler.is_profiling())
+
+        # Other workers see it once they check the flag again
+        self.assertFalse(other.is_profiling())
+        self.clock.now += 10
+        self.assertTrue(other.is_profiling())
+
+        profiler.switch(False)
+        self.assertFalse(profiler.is_profiling())
+        self.assertFalse(os.path.exists(profiler.flag_path))
+
+    def test_profile(self):
+        """ Test that only sampled requests over the threshold are dumped """
+
+        samples = iter([0.05, 0.5, 0.05])
+        profiler = self.profiler(enabled=True, directory=self.directory,
+                                 threshold=0.01, sample_rate=0.1,
+                                 random=lambda: next(samples))
+
+        def handle(seconds):
+            with profiler.request():
+                with profiler.phase('find'):
+                    time.sleep(seconds)
+
+        handle(0.02)  # Not switched on yet
+        profiler.switch(True)
+        handle(0.02)
+        handle(0.02)  # Not sampled
+        handle(0)  # Too fast
+
+        dumps = sorted(os.listdir(self.directory))
+        self.assertEqual(len(dumps), 3)
+        self.assertEqual(dumps[2], 'enabled')
+
+        path = os.path.join(self.directory, dumps[0][:-len('.json')])
+
+        with open(path + '.json') as timings_file:
+            timings = json.load(timings_file)
+
+        self.assertGreaterEqual(timings['seconds'], 0.02)
+        self.assertEqual(list(timings['phases']), ['find'])
+
+        stats = pstats.Stats(path + '.prof')
+        self.assertTrue(any('sleep' in function for _, _, function
+                            in stats.stats))
+
+    def test_max_dumps(self):
+        profiler = self.profiler(directory=self.directory, threshold=0,
+                                 sample_rate=1, max_dumps=2)
+        profiler.switch(True)
+
+        for _ in range(3):
+            self.clock.now += 1
+
+            with profiler.request():
+                pass
+
+        dumps = sorted(os.listdir(self.directory))
+        self.assertEqual(len(dumps), 5)
+        self.assertTrue(dumps[0].startswith('1002.'))
@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+
+import ipaddress
+import unittest
+
+from route53_dyndns.proxies import (
+    ClientResolver, NetworkSet, parse_forwarded, parse_x_forwarded_for)
+
+
+class NetworkSetTestCase(unittest.TestCase):
+    def test_contains(self):
+        networks = NetworkSet(['10.0.0.0/8', '192.168.1.0/24',
+                               '192.168.2.0/24', '2001:db8::/32',
+                               '172.16.0.1'])
+
+        # Adjacent networks are merged into a single range
+        self.assertEqual(len(networks), 4)
+
+        for address in ('10.0.0.1', '10.255.255.255', '192.168.1.1',
+                        '192.168.2.255', '2001:db8::1', '172.16.0.1',
+                        '::ffff:10.0.0.1'):
+            self.assertIn(address, networks)
+
+        for address in ('9.255.255.255', '11.0.0.0', '192.168.3.0',
+                        '2001:db9::1', '172.16.0.2', 'foo', '', '::1'):
+            self.assertNotIn(address, networks)
+
+        self.assertIn(ipaddress.ip_address('10.1.2.3'), networks)
+
+    def test_many_networks(self):
+        networks = NetworkSet('10.{}.{}.0/24'.format(i // 256, i % 256)
+                              for i in range(0, 20000, 2))
+
+        self.assertIn('10.0.2.1', networks)
+        self.assertNotIn('10.0.3.1', networks)
+        self.assertIn('10.78.30.1', networks)
+        self.assertNotIn('10.78.31.1', networks)
+
+    def test_empty(self):
+        networks = NetworkSet([])
+
+        self.assertEqual(len(networks), 0)
+        self.assertNotIn('10.0.0.1', networks)
+
+
+class ClientResolverTestCase(unittest.TestCase):
+    def setUp(self):
+        self.resolver = ClientResolver(['10.0.0.0/8', '2001:db8::/32'])
+
+    def test_parse_headers(self):
+        self.assertEqual(parse_x_forwarded_for('203.0.113.1, 10.0.0.1:8080'),
+                         ['203.0.113.1', '10.0.0.1'])
+        self.assertEqual(
+            parse_forwarded('for=203.0.113.1;proto=https, '
+                            'For="[2001:db8::1]:4711", by=10.0.0.2'),
+            ['203.0.113.1', '2001:db8::1', ''])
+
+    def test_untrusted(self):
+        # Headers from anyone but a trusted proxy are ignored
+        self.assertEqual(self.resolver.resolve('203.0.113.1', None,
+                                               '198.51.100.1'),
+                         '203.0.113.1')
+        self.assertEqual(ClientResolver([]).resolve('10.0.0.1', None,
+                                                    '198.51.100.1'),
+                         '10.0.0.1')
+
+    def test_x_forwarded_for(self):
+        self.assertEqual(self.resolver.resolve('10.0.0.1'), '10.0.0.1')
+
+        # The client is the first hop from the right which isn't trusted
+        self.assertEqual(self.resolver.resolve(
+            '10.0.0.1', None, '198.51.100.1, 203.0.113.1, 10.0.0.2'),
+            '203.0.113.1')
+
+        # Every hop is trusted, so it's the leftmost
+        self.assertEqual(self.resolver.resolve('10.0.0.1', None,
+                                               '10.0.0.3, 10.0.0.2'),
+                         '10.0.0.3')
+
+        self.assertIsNone(self.resolver.resolve('10.0.0.1', None,
+                                                '203.0.113.1, foo'))
+
+    def test_forwarded(self):
+        # Forwarded is preferred over X-Forwarded-For
+        self.assertEqual(self.resolver.resolve(
+            '10.0.0.1', 'for="[2001:DB8::2]", for=10.0.0.2',
+            '203.0.113.1'), '2001:db8::2')
+        self.assertEqual(self.resolver.resolve(
+            '10.0.0.1', 'for=203.0.113.5:1234;proto=http', None),
+            '203.0.113.5')
+        self.assertIsNone(self.resolver.resolve('10.0.0.1', 'for=unknown'))
+
+    def test_max_hops(self):
+        resolver = ClientResolver(['10.0.0.0/8'], max_hops=2)
+
+        self.assertEqual(resolver.resolve(
+            '10.0.0.1', None, '203.0.113.1, 10.0.0.3, 10.0.0.2'), '10.0.0.3')
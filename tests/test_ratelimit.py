@@ -0,0 +1,83 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from route53_dyndns.ratelimit import SharedTokenBuckets, TokenBuckets
+
+from .helpers import Clock
+
+
+class TokenBucketsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.buckets = self.new_buckets(rate=0.5, burst=2)
+
+    def new_buckets(self, rate, burst):
+        return TokenBuckets(rate, burst, max_size=2, clock=self.clock)
+
+    def test_allow(self):
+        # The burst is allowed straight away, then it's limited to the rate
+        self.assertTrue(self.buckets.allow('a'))
+        self.assertTrue(self.buckets.allow('a'))
+        self.assertFalse(self.buckets.allow('a'))
+
+        self.clock.now += 1
+        self.assertFalse(self.buckets.allow('a'))
+
+        self.clock.now += 1
+        self.assertTrue(self.buckets.allow('a'))
+        self.assertFalse(self.buckets.allow('a'))
+
+        # Other keys have their own bucket
+        self.assertTrue(self.buckets.allow('b'))
+
+    def test_refill_limited_to_burst(self):
+        self.buckets.allow('a')
+        self.clock.now += 3600
+
+        for _ in range(2):
+            self.assertTrue(self.buckets.allow('a'))
+
+        self.assertFalse(self.buckets.allow('a'))
+
+
+class BoundedTokenBucketsTestCase(TokenBucketsTestCase):
+    def test_max_size(self):
+        for key in ('a', 'b', 'c'):
+            self.buckets.allow(key)
+
+        self.assertEqual(len(self.buckets), 2)
+
+
+class SharedTokenBucketsTestCase(TokenBucketsTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        super(SharedTokenBucketsTestCase, self).setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_buckets(self, rate, burst):
+        path = os.path.join(self.directory, 'buckets')
+
+        return SharedTokenBuckets(path, rate, burst, slots=64,
+                                  clock=self.clock)
+
+    def test_shared(self):
+        # Buckets opened from the same file, like in two worker processes
+        other = self.new_buckets(rate=0.5, burst=2)
+
+        self.assertTrue(self.buckets.allow('a'))
+        self.assertTrue(other.allow('a'))
+        self.assertFalse(self.buckets.allow('a'))
+
+        other.close()
+
+    def test_file_size(self):
+        self.buckets.allow('a')
+
+        self.assertEqual(os.path.getsize(self.buckets.path),
+                         64 * SharedTokenBuckets.SLOT.size)
@@ -0,0 +1,148 @@
+from __future__ import unicode_literals
+
+import unittest
+
+from botocore.exceptions import ClientError, EndpointConnectionError
+
+from route53_dyndns.resilience import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, Resilience,
+    ResilientClient)
+
+from mock import Mock
+
+from .helpers import Clock
+
+
+def client_error(code):
+    return ClientError({'Error': {'Code': code, 'Message': code}},
+                       'ChangeResourceRecordSets')
+
+
+class CircuitBreakerTestCase(unittest.TestCase):
+    def test_open_and_close(self):
+        clock = Clock()
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10,
+                                 clock=clock)
+
+        breaker.failure()
+        self.assertEqual(breaker.state, CLOSED)
+        breaker.failure()
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+        # A single trial call after the timeout
+        clock.now += 10
+        self.assertEqual(breaker.state, HALF_OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertFalse(breaker.allow())
+
+        # Which opens it again if it fails
+        breaker.failure()
+        self.assertEqual(breaker.state, OPEN)
+
+        clock.now += 10
+        self.assertTrue(breaker.allow())
+        breaker.success()
+        self.assertEqual(breaker.state, CLOSED)
+        self.assertTrue(breaker.allow())
+
+
+class ResilienceTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.sleep = Mock()
+        self.resilience = Resilience(
+            max_attempts=3, backoff_base=0.1, backoff_max=1.0,
+            fatal_errors=['InternalError'], budget_rate=0, budget_burst=4,
+            failure_threshold=5, reset_timeout=10, sleep=self.sleep,
+            clock=self.clock)
+
+    def test_retry(self):
+        function = Mock(side_effect=[client_error('Throttling'),
+                                     EndpointConnectionError(endpoint_url='x'),
+                                     'result'])
+
+        self.assertEqual(self.resilience.call(function, 'Z1'), 'result')
+        self.assertEqual(function.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+        # Exponential backoff with jitter
+        first, second = [call[0][0] for call in self.sleep.call_args_list]
+        self.assertTrue(0 <= first <= 0.1)
+        self.assertTrue(0 <= second <= 0.2)
+
+    def test_max_attempts(self):
+        function = Mock(side_effect=client_error('Throttling'))
+
+        with self.assertRaises(ClientError):
+            self.resilience.call(function, 'Z1')
+
+        self.assertEqual(function.call_count, 3)
+
+    def test_fatal(self):
+        for error in (client_error('InvalidChangeBatch'),
+                      client_error('InternalError'), RuntimeError()):
+            function = Mock(side_effect=error)
+
+            with self.assertRaises(type(error)):
+                self.resilience.call(function, 'Z1')
+
+            self.assertEqual(function.call_count, 1)
+
+    def test_budget(self):
+        self.resilience.breaker.failure_threshold = 100
+        function = Mock(side_effect=client_error('Throttling'))
+
+        # Two calls use up the budget of four retries for the zone
+        for _ in range(3):
+            with self.assertRaises(ClientError):
+                self.resilience.call(function, 'Z1')
+
+        self.assertEqual(function.call_count, 3 + 3 + 1)
+
+        # Other zones have their own budget
+        function.reset_mock()
+
+        with self.assertRaises(ClientError):
+            self.resilience.call(function, 'Z2')
+
+        self.assertEqual(function.call_count, 3)
+
+    def test_circuit_breaker(self):
+        function = Mock(side_effect=client_error('ServiceUnavailable'))
+
+        with self.assertRaises(ClientError):
+            self.resilience.call(function, 'Z1')
+
+        # Opens on the fifth failure, in the middle of the retries
+        with self.assertRaises(CircuitOpenError):
+            self.resilience.call(function, 'Z1')
+
+        self.assertEqual(function.call_count, 5)
+
+        # Then fails fast without calling AWS
+        function.reset_mock()
+
+        with self.assertRaises(CircuitOpenError):
+            self.resilience.call(function, 'Z1')
+
+        self.assertEqual(function.call_count, 0)
+
+        # Closes once AWS is healthy again
+        self.clock.now += 10
+        function.side_effect = None
+        function.return_value = 'result'
+        self.assertEqual(self.resilience.call(function, 'Z1'), 'result')
+        self.assertEqual(self.resilience.breaker.state, CLOSED)
+
+    def test_resilient_client(self):
+        client = Mock(meta='meta')
+        client.change_resource_record_sets.side_effect = [
+            client_error('PriorRequestNotComplete'), 'result']
+
+        resilient = ResilientClient(client, self.resilience)
+        result = resilient.change_resource_record_sets(HostedZoneId='Z1')
+
+        self.assertEqual(result, 'result')
+        self.assertEqual(client.change_resource_record_sets.call_count, 2)
+        self.assertEqual(resilient.meta, 'meta')
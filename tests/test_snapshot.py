@@ -0,0 +1,159 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from route53_dyndns.cache import RecordCache
+from route53_dyndns.snapshot import (
+    LastSeen, StateSnapshot, read_snapshot, write_snapshot)
+from route53_dyndns.storage import HostLock
+from route53_dyndns.zones import HostedZones
+
+from mock import Mock
+
+from .helpers import new_resource_record
+
+
+class LastSeenTestCase(unittest.TestCase):
+    def test_seen(self):
+        last_seen = LastSeen(max_size=2, clock=lambda: 100.0)
+        last_seen.seen('A.google.com.', '10.1.10.1')
+        last_seen.seen('b.google.com', '10.1.10.2')
+        last_seen.seen('a.google.com', '10.1.10.3')
+        last_seen.seen('c.google.com', '10.1.10.4')
+
+        # The least recently seen is dropped
+        self.assertEqual(len(last_seen), 2)
+        self.assertIsNone(last_seen.get('b.google.com'))
+        self.assertEqual(last_seen.get('a.google.com'), ('10.1.10.3', 100.0))
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_write_read(self):
+        record = new_resource_record('www.google.com', '10.1.10.1')
+        write_snapshot(self.path, [('google.com.', 'Z0')], {'Z0': [record]},
+                       [('www.google.com', '10.1.10.1', 100.0)], saved_at=5.0)
+
+        self.assertEqual(read_snapshot(self.path), {
+            'saved_at': 5.0,
+            'zones': [('google.com.', 'Z0')],
+            'records': {'Z0': [record]},
+            'clients': [('www.google.com', '10.1.10.1', 100.0)],
+        })
+
+        # Only the snapshot itself is left behind
+        self.assertEqual(os.listdir(self.directory), ['snapshot.db'])
+
+    def test_read_bad_snapshot(self):
+        self.assertIsNone(read_snapshot(self.path))
+
+        with open(self.path, 'w') as snapshot_file:
+            snapshot_file.write('garbage' * 100)
+
+        self.assertIsNone(read_snapshot(self.path))
+
+
+class StateSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'snapshot.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def new_state(self, record_cache=None):
+        if record_cache is None:
+            record_cache = RecordCache()
+
+        state = StateSnapshot(self.path, HostedZones(), record_cache,
+                              LastSeen(), Mock(), revalidate_rate=10)
+
+        return state
+
+    def test_save_load(self):
+        state = self.new_state()
+        state.hosted_zones.load([('google.com.', 'Z0'),
+                                 ('example.com.', 'Z1')])
+        state.record_cache.load_zone('Z0', [
+            new_resource_record('www.google.com', '10.1.10.1')])
+        state.record_cache.load_zone('Z1', [
+            new_resource_record('www.example.com', '10.1.10.2')])
+        state.last_seen.seen('www.example.com', '10.1.10.2')
+        state.save()
+
+        restored = self.new_state()
+        self.assertTrue(restored.load())
+
+        # Starts warm, without waiting on Route 53
+        self.assertEqual(restored.hosted_zones.get_index(None).find(
+            'www.google.com'), 'Z0')
+        self.assertTrue(restored.record_cache.is_loaded('Z0'))
+        self.assertEqual(restored.record_cache.lookup(
+            'Z0', 'www.google.com')[0]['ResourceRecords'][0]['Value'],
+            '10.1.10.1')
+        self.assertEqual(restored.last_seen.get('www.example.com')[0],
+                         '10.1.10.2')
+
+        # Zones with recently seen clients are revalidated first
+        sleep = Mock()
+        restored.revalidate_all(sleep=sleep)
+
+        self.assertEqual([call[0][0] for call in
+                          restored.revalidate.call_args_list], ['Z1', 'Z0'])
+        sleep.assert_called_once_with(0.1)
+
+    def test_load_expired(self):
+        """ Test that records from an old snapshot aren't restored """
+
+        state = self.new_state()
+        state.hosted_zones.load([('google.com.', 'Z0')])
+        state.record_cache.load_zone('Z0', [
+            new_resource_record('www.google.com', '10.1.10.1')])
+        state.save()
+
+        # Restored after the records' TTL has run out
+        restored = self.new_state(RecordCache(
+            ttl=300, clock=lambda: time.time() + 301))
+        self.assertTrue(restored.load())
+
+        self.assertFalse(restored.record_cache.is_loaded('Z0'))
+        self.assertIsNone(restored.record_cache.lookup('Z0', 'www.google.com'))
+
+        restored.revalidate_all(sleep=Mock())
+        self.assertFalse(restored.revalidate.called)
+
+    def test_start_elected(self):
+        """ Test that only the worker holding the lock revalidates """
+
+        state = self.new_state()
+        state.hosted_zones.load([('google.com.', 'Z0')])
+        state.record_cache.load_zone('Z0', [
+            new_resource_record('www.google.com', '10.1.10.1')])
+        state.save()
+
+        lock_path = self.path + '.lock'
+        self.assertTrue(HostLock(lock_path).acquire())
+
+        restored = self.new_state()
+        restored.lock = HostLock(lock_path)
+        restored.load()
+        restored.start()
+
+        time.sleep(0.1)
+        self.assertFalse(restored.revalidate.called)
+
+    def test_save_nothing_known(self):
+        self.new_state().save()
+
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(self.new_state().load())
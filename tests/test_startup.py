@@ -0,0 +1,33 @@
+import sys
+import unittest
+
+from route53_dyndns import startup
+
+from mock import patch
+
+
+class StartupTestCase(unittest.TestCase):
+    def test_measure(self):
+        timings = startup.measure((('json', 'import json'),
+                                   ('sum', 'sum(range(10))')))
+
+        self.assertEqual([name for name, _ in timings], ['json', 'sum'])
+        self.assertTrue(all(seconds >= 0 for _, seconds in timings))
+
+    def test_format_report(self):
+        report = startup.format_report([('package', 0.0125), ('views', 0.5)])
+
+        self.assertEqual(report.splitlines(), [
+            'package        12.5 ms',
+            'views         500.0 ms',
+            'total         512.5 ms',
+        ])
+
+    @patch('route53_dyndns.startup.measure')
+    def test_main(self, mocked_measure):
+        mocked_measure.return_value = [('package', 0.01)]
+
+        with patch.object(sys, 'stdout') as stdout:
+            startup.main(['--json'])
+
+        self.assertIn('"package": 0.01', stdout.write.call_args_list[0][0][0])
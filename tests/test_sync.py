@@ -0,0 +1,215 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from route53_dyndns import cmdline, sync
+from route53_dyndns.route53 import hosted_zones
+
+from mock import patch
+
+from .helpers import hosted_zones_response
+
+
+def resource_record(name, values, record_type='A', ttl=300):
+    return {'Name': name + '.', 'Type': record_type, 'TTL': ttl,
+            'ResourceRecords': [{'Value': value} for value in values]}
+
+
+class MockZonesClient(object):
+    """ Mock client with a zone per name, paging one record at a time """
+
+    def __init__(self, zones):
+        self.zones = zones  # zone name -> records
+        self.ids = dict(('/hostedzone/Z%d' % i, name)
+                        for i, name in enumerate(zones))
+        self.listed = []
+        self.batches = []
+
+    def list_hosted_zones(self):
+        return hosted_zones_response(*self.zones)
+
+    def list_resource_record_sets(self, HostedZoneId=None,
+                                  StartRecordName=None, StartRecordType=None,
+                                  StartRecordIdentifier=None, MaxItems=None):
+        records = self.zones[self.ids['/hostedzone/' + HostedZoneId]]
+        start = int(StartRecordName) if StartRecordName else 0
+        self.listed.append(HostedZoneId)
+
+        response = {'ResourceRecordSets': records[start:start + 1],
+                    'IsTruncated': start + 1 < len(records)}
+
+        if response['IsTruncated']:
+            response['NextRecordName'] = str(start + 1)
+            response['NextRecordType'] = 'A'
+
+        return response
+
+    def change_resource_record_sets(self, HostedZoneId=None,
+                                    ChangeBatch=None):
+        self.batches.append((HostedZoneId, ChangeBatch['Changes']))
+
+        return {'ChangeInfo': {'Id': 'string', 'Status': 'PENDING'}}
+
+
+class SyncTestCase(unittest.TestCase):
+    def setUp(self):
+        hosted_zones.clear()
+        self.addCleanup(hosted_zones.clear)
+
+        self.client = MockZonesClient({
+            'google.com': [resource_record('www.google.com', ['10.0.0.1']),
+                           resource_record('mail.google.com', ['10.0.0.2']),
+                           resource_record('mail.google.com', ['::1'],
+                                           'AAAA')],
+            'example.com': [resource_record('www.example.com', ['10.0.0.3'],
+                                            ttl=60)],
+        })
+
+    def test_read_csv(self):
+        lines = ['name,type,ttl,value\n', '# Comment\n', '\n',
+                 'WWW.google.com.,a,,10.0.0.1,10.0.0.2\n',
+                 'mail.google.com,,60,10.0.0.3\n']
+
+        self.assertEqual(list(sync.read_csv(lines)), [
+            ('www.google.com', 'A', None, ['10.0.0.1', '10.0.0.2']),
+            ('mail.google.com', 'A', 60, ['10.0.0.3'])])
+
+        with self.assertRaises(sync.SyncError):
+            list(sync.read_csv(['www.google.com,A,soon,10.0.0.1\n']))
+
+        with self.assertRaises(sync.SyncError):
+            list(sync.read_csv(['www.google.com,A,60\n']))
+
+    def test_read_jsonl(self):
+        lines = ['{"name": "www.google.com", "values": ["10.0.0.1"]}\n',
+                 '\n',
+                 '{"name": "www.google.com", "type": "AAAA", "ttl": 60, '
+                 '"value": "::1"}\n']
+
+        self.assertEqual(list(sync.read_jsonl(lines)), [
+            ('www.google.com', 'A', None, ['10.0.0.1']),
+            ('www.google.com', 'AAAA', 60, ['::1'])])
+
+        with self.assertRaises(sync.SyncError):
+            list(sync.read_jsonl(['{"name": \n']))
+
+    def test_plan_sync(self):
+        desired = [('www.google.com', 'A', None, ['10.0.0.1']),
+                   ('mail.google.com', 'A', None, ['10.0.0.9']),
+                   ('mail.google.com', 'AAAA', None, ['0::1']),
+                   ('new.google.com', 'A', None, ['10.0.0.4']),
+                   ('www.example.com', 'A', 300, ['10.0.0.3']),
+                   ('www.example.org', 'A', None, ['10.0.0.5'])]
+
+        plan = sync.plan_sync(desired, self.client)
+
+        # Each zone is listed once, a page at a time
+        self.assertEqual(sorted(self.client.listed),
+                         ['Z0', 'Z0', 'Z0', 'Z1'])
+        self.assertEqual(plan.unchanged, 2)
+        self.assertEqual(len(plan), 3)
+        self.assertEqual(plan.errors, ["No hosted zone for 'www.example.org'"])
+
+        (mail, existing), (new, missing) = plan.changes['Z0']
+        self.assertEqual(mail['ResourceRecordSet'],
+                         resource_record('mail.google.com', ['10.0.0.9']))
+        self.assertEqual(existing['ResourceRecords'],
+                         [{'Value': '10.0.0.2'}])
+        self.assertEqual(new['ResourceRecordSet'],
+                         resource_record('new.google.com', ['10.0.0.4']))
+        self.assertIsNone(missing)
+
+        # Only the TTL changed
+        (ttl, _), = plan.changes['Z1']
+        self.assertEqual(ttl['ResourceRecordSet']['TTL'], 300)
+
+        self.assertFalse(self.client.batches)
+
+    def test_apply_plan(self):
+        desired = [('host%d.google.com' % i, 'A', None, ['10.0.0.1'])
+                   for i in range(5)]
+        desired.append(('www.example.com', 'A', None, ['10.0.0.9']))
+
+        plan = sync.plan_sync(desired, self.client)
+        applied = sync.apply_plan(plan, self.client, max_changes=2)
+
+        self.assertEqual(applied, 6)
+        self.assertEqual(plan.errors, [])
+        self.assertEqual(sorted((zone, len(changes))
+                                for zone, changes in self.client.batches),
+                         [('Z0', 1), ('Z0', 2), ('Z0', 2), ('Z1', 1)])
+
+    def test_apply_plan_error(self):
+        plan = sync.plan_sync([('www.google.com', 'A', None, ['10.0.0.9'])],
+                              self.client)
+
+        with patch.object(self.client, 'change_resource_record_sets') as m:
+            m.side_effect = RuntimeError("Route 53 Error")
+
+            self.assertEqual(sync.apply_plan(plan, self.client), 0)
+
+        self.assertEqual(len(plan.errors), 1)
+        self.assertIn("Route 53 Error", plan.errors[0])
+
+
+class SyncMainTestCase(unittest.TestCase):
+    def setUp(self):
+        hosted_zones.clear()
+        self.addCleanup(hosted_zones.clear)
+
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.client = MockZonesClient({
+            'google.com': [resource_record('www.google.com', ['10.0.0.1'])]})
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+
+        with open(path, 'w') as desired:
+            desired.write(text)
+
+        return path
+
+    def test_dry_run(self):
+        path = self.write('desired.csv', 'www.google.com,A,,10.0.0.2\n')
+        stdout = io.StringIO()
+
+        self.assertEqual(sync.main(['--dry-run', path], self.client, stdout),
+                         0)
+        self.assertFalse(self.client.batches)
+        self.assertEqual(stdout.getvalue(), (
+            "Z0: 1 changes in 1 batches\n"
+            "  UPSERT www.google.com. A: 10.0.0.1 TTL 300 -> "
+            "10.0.0.2 TTL 300\n"
+            "1 to change, 0 unchanged, 0 errors\n"))
+
+    def test_main(self):
+        path = self.write('desired.jsonl',
+                          '{"name": "www.google.com", "value": "10.0.0.2"}\n'
+                          '{"name": "www.example.org", "value": "10.0.0.2"}\n')
+        stdout = io.StringIO()
+
+        self.assertEqual(sync.main([path], self.client, stdout), 1)
+        self.assertEqual(len(self.client.batches), 1)
+        self.assertIn("Error: No hosted zone for 'www.example.org'",
+                      stdout.getvalue())
+        self.assertIn("Applied 1 of 1 changes", stdout.getvalue())
+
+    def test_main_bad_file(self):
+        path = self.write('desired.csv', 'www.google.com,A,soon,10.0.0.2\n')
+        stdout = io.StringIO()
+
+        self.assertEqual(sync.main([path], self.client, stdout), 2)
+        self.assertEqual(stdout.getvalue(), "Line 1: invalid TTL 'soon'\n")
+
+    @patch('route53_dyndns.cmdline.configure_logging')
+    @patch('route53_dyndns.sync.main', return_value=0)
+    def test_cmdline(self, mocked_main, mocked_logging):
+        with self.assertRaises(SystemExit) as raised:
+            cmdline.main(['sync', '--dry-run', 'desired.csv'])
+
+        self.assertEqual(raised.exception.code, 0)
+        mocked_main.assert_called_once_with(['--dry-run', 'desired.csv'])
@@ -0,0 +1,116 @@
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from route53_dyndns.useragents import (
+    UserAgentBlocklist, UserAgentMatcher, compile_rules)
+
+from .helpers import Clock
+
+
+class UserAgentMatcherTestCase(unittest.TestCase):
+    def test_is_blocked(self):
+        matcher = UserAgentMatcher([
+            'BrokenRouter/1.0',
+            'glob:AcmeFirmware/2.[0-3]*',
+            're:Foo.*bar',
+        ])
+
+        self.assertTrue(matcher.is_blocked('BrokenRouter/1.0'))
+        self.assertFalse(matcher.is_blocked('BrokenRouter/1.01'))
+        self.assertTrue(matcher.is_blocked('AcmeFirmware/2.3.1 (MIPS)'))
+        self.assertFalse(matcher.is_blocked('AcmeFirmware/2.4'))
+        self.assertFalse(matcher.is_blocked('Not AcmeFirmware/2.3'))
+        self.assertTrue(matcher.is_blocked('Mozilla Foo/1 bar'))
+        self.assertFalse(matcher.is_blocked('Client'))
+
+    def test_cache(self):
+        matcher = UserAgentMatcher(['glob:Bad*'], cache_size=2)
+
+        for user_agent in ('Bad/1', 'Good/1', 'Good/2'):
+            matcher.is_blocked(user_agent)
+
+        self.assertLessEqual(len(matcher._verdicts), 2)
+        self.assertTrue(matcher.is_blocked('Bad/1'))
+
+    def test_compile_rules(self):
+        exact, pattern = compile_rules(['Foo'])
+        self.assertEqual(exact, frozenset(['Foo']))
+        self.assertIsNone(pattern)
+
+        with self.assertRaises(ValueError):
+            compile_rules(['re:(unclosed'])
+
+    def test_compile_rules_flags(self):
+        """ Test that flags at the start of a rule only apply to it """
+
+        _, pattern = compile_rules(['re:(?i)curl', 're:^Wget'])
+        self.assertTrue(pattern.search('CURL/7.0'))
+        self.assertFalse(pattern.search('WGET/1.0'))
+
+        with self.assertRaises(ValueError):
+            compile_rules(['re:curl(?i)', 're:^Wget'])
+
+    def test_compile_rules_groups(self):
+        """ Test that rules which can't be combined are refused """
+
+        for rule in (r're:(a)\1', 're:(?P<a>a)(?P=a)'):
+            with self.assertRaises(ValueError):
+                compile_rules(['re:(b)', rule])
+
+        with self.assertRaises(ValueError):
+            compile_rules(['re:(?P<a>a)', 're:(?P<a>b)'])
+
+        # An escaped backslash followed by a digit isn't a backreference
+        _, pattern = compile_rules([r're:a\\1'])
+        self.assertTrue(pattern.search('a\\1'))
+
+
+class UserAgentBlocklistTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'user-agents')
+        self.clock = Clock()
+        self.rules = ['Config/1.0']
+        self.write('# Comment', '', 'glob:File/*')
+        self.blocklist = UserAgentBlocklist(lambda: self.rules, self.path,
+                                            reload_interval=5,
+                                            clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, *lines):
+        with open(self.path, 'w') as rules_file:
+            rules_file.write('\n'.join(lines) + '\n')
+
+        self.clock.now += 10
+        os.utime(self.path, (self.clock.now, self.clock.now))
+
+    def test_is_blocked(self):
+        self.assertTrue(self.blocklist.is_blocked('Config/1.0'))
+        self.assertTrue(self.blocklist.is_blocked('File/2.0'))
+        self.assertFalse(self.blocklist.is_blocked('Client'))
+
+    def test_config_changed(self):
+        self.assertFalse(self.blocklist.is_blocked('Client'))
+
+        self.rules = ['Client']
+        self.assertTrue(self.blocklist.is_blocked('Client'))
+
+    def test_file_changed(self):
+        self.assertFalse(self.blocklist.is_blocked('Client'))
+
+        self.write('Client')
+        self.assertTrue(self.blocklist.is_blocked('Client'))
+        self.assertFalse(self.blocklist.is_blocked('File/2.0'))
+
+        # Bad rules are ignored until they're fixed
+        self.write('re:(unclosed')
+        self.assertTrue(self.blocklist.is_blocked('Client'))
+
+        self.write('re:(?P<a>a)', 're:(?P<a>b)')
+        self.assertTrue(self.blocklist.is_blocked('Client'))
@@ -0,0 +1,114 @@
+import unittest
+
+from route53_dyndns.cache import RecordCache
+from route53_dyndns.watcher import ZoneWatcher
+
+from mock import Mock
+
+from .helpers import Clock, new_resource_record
+
+
+class ZoneWatcherTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.cache = RecordCache(ttl=3600, clock=self.clock)
+        self.records = [new_resource_record('www.google.com', '10.0.0.1'),
+                        new_resource_record('mail.google.com', '10.0.0.2')]
+        self.cache.load_zone('Z0', self.records)
+
+        self.list_zone = Mock(side_effect=lambda zone_id: list(self.records))
+        self.changed = Mock()
+        self.watcher = ZoneWatcher(self.cache, self.list_zone,
+                                   min_interval=10, max_interval=40,
+                                   changed=self.changed, clock=self.clock)
+
+        # Seen as soon as it is loaded
+        self.watcher.due()
+
+    def test_backoff(self):
+        """ Test that a quiet zone is listed less and less often """
+
+        self.assertEqual(self.watcher.due(), [])
+
+        listed = []
+
+        for _ in range(100):
+            self.clock.now += 1
+
+            if self.watcher.refresh_once():
+                listed.append(self.clock.now)
+
+        self.assertEqual(listed, [1010.0, 1030.0, 1070.0])
+        self.assertEqual(self.watcher.last_sync, {'Z0': 1070.0})
+        self.assertEqual(self.watcher.external_changes, 0)
+        self.assertFalse(self.changed.called)
+
+    def test_external_change(self):
+        """ Test that only the changed records are replaced """
+
+        self.clock.now += 10
+        self.watcher.refresh_once()
+        self.clock.now += 20
+        self.watcher.refresh_once()
+
+        self.records = [new_resource_record('www.google.com', '10.0.0.9'),
+                        new_resource_record('new.google.com', '10.0.0.3')]
+
+        self.clock.now += 40
+        self.assertEqual(self.watcher.refresh_once(), 1)
+        self.assertEqual(self.watcher.external_changes, 3)
+        self.assertEqual(self.changed.call_count, 3)
+
+        self.assertEqual(self.cache.lookup('Z0', 'www.google.com'),
+                         [self.records[0]])
+        self.assertEqual(self.cache.lookup('Z0', 'new.google.com'),
+                         [self.records[1]])
+        self.assertEqual(self.cache.lookup('Z0', 'mail.google.com'), [])
+
+        # Back to the shortest interval once the zone has changed
+        self.assertEqual(self.watcher.due(), [])
+        self.clock.now += 10
+        self.assertEqual(self.watcher.due(), ['Z0'])
+
+    def test_keeps_zone_fresh(self):
+        self.clock.now += 3000
+        self.watcher.refresh_once()
+
+        self.clock.now += 3000
+        self.assertTrue(self.cache.is_loaded('Z0'))
+
+    def test_updated_while_listing(self):
+        """ Test that a record updated since the listing began is kept """
+
+        updated = new_resource_record('www.google.com', '10.0.0.5')
+
+        def list_zone(zone_id):
+            self.clock.now += 1
+            self.cache.put('Z0', updated)
+
+            return list(self.records)
+
+        self.list_zone.side_effect = list_zone
+
+        self.assertEqual(self.watcher.refresh('Z0'), 0)
+        self.assertEqual(self.cache.lookup('Z0', 'www.google.com'), [updated])
+
+    def test_error(self):
+        self.list_zone.side_effect = RuntimeError("Route 53 Error")
+
+        self.clock.now += 10
+        self.assertEqual(self.watcher.refresh_once(), 1)
+        self.assertEqual(self.watcher.last_sync, {})
+
+        # Retried after the shortest interval
+        self.clock.now += 9
+        self.assertEqual(self.watcher.due(), [])
+        self.clock.now += 1
+        self.assertEqual(self.watcher.due(), ['Z0'])
+
+    def test_forgotten_zone(self):
+        self.clock.now += 10
+        self.assertEqual(self.watcher.due(), ['Z0'])
+
+        self.cache.clear()
+        self.assertEqual(self.watcher.due(), [])
@@ -0,0 +1,237 @@
+from __future__ import unicode_literals
+
+from concurrent.futures import Future
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from route53_dyndns import route53
+from route53_dyndns.backends import MemoryBackend
+from route53_dyndns.storage import HostLock
+from route53_dyndns.workqueue import QueueApplier, WorkQueue
+
+from mock import Mock, patch
+
+from .helpers import Clock, new_resource_record
+from .test_backend import MockRoute53Client
+
+
+def upsert(name, value):
+    return {'Action': 'UPSERT',
+            'ResourceRecordSet': new_resource_record(name, value)}
+
+
+def completed(exception=None):
+    future = Future()
+
+    if exception:
+        future.set_exception(exception)
+    else:
+        future.set_result({})
+
+    return future
+
+
+class QueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'queue.db')
+        self.clock = Clock()
+        self.queue = WorkQueue(self.path, lease=60, clock=self.clock)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+
+class WorkQueueTestCase(QueueTestCase):
+    def test_enqueue_merges(self):
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.1'))
+        self.clock.now += 5
+        self.queue.enqueue('Z0', upsert('WWW.google.com.', '10.0.0.2'))
+        self.queue.enqueue('Z0', upsert('mail.google.com', '10.0.0.3'))
+
+        self.assertEqual(self.queue.depth(), 2)
+        self.assertEqual(self.queue.lag(), 5)
+
+        # The latest value, in the place of the first change
+        claimed = self.queue.claim(10)
+        self.assertEqual(
+            [change['ResourceRecordSet']['ResourceRecords'][0]['Value']
+             for _, _, _, change, _ in claimed], ['10.0.0.2', '10.0.0.3'])
+
+    def test_claim_lease(self):
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.1'))
+
+        self.assertEqual(len(self.queue.claim(10)), 1)
+        self.assertEqual(self.queue.claim(10), [])
+
+        # Claimed again once the lease runs out, as if the applier died
+        self.clock.now += 60
+        self.assertEqual(len(self.queue.claim(10)), 1)
+
+    def test_claim_idle(self):
+        """ Test that nothing is locked when there's nothing to claim """
+
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.1'))
+        self.queue.claim(10)
+
+        writer = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(writer.close)
+        writer.execute('BEGIN IMMEDIATE')
+
+        self.assertEqual(self.queue.claim(10), [])
+        writer.execute('ROLLBACK')
+
+    def test_complete(self):
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.1'))
+        key, version, _, _, _ = self.queue.claim(10)[0]
+
+        # Replaced while it was being applied, so the new change stays
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.2'))
+        self.assertFalse(self.queue.complete(key, version))
+        self.assertEqual(self.queue.depth(), 1)
+
+        key, version, _, _, _ = self.queue.claim(10)[0]
+        self.assertTrue(self.queue.complete(key, version))
+        self.assertEqual(self.queue.depth(), 0)
+        self.assertEqual(self.queue.lag(), 0)
+
+    def test_durable(self):
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.1'))
+
+        # A new queue for the same file, like after a restart
+        self.assertEqual(len(WorkQueue(self.path, clock=self.clock).claim(10)),
+                         1)
+
+
+class QueueApplierTestCase(QueueTestCase):
+    def test_start_elected(self):
+        """ Test that only the worker holding the lock applies changes """
+
+        lock_path = self.path + '.lock'
+        leader = HostLock(lock_path)
+        self.assertTrue(leader.acquire())
+        self.assertTrue(leader.acquire())
+        self.assertFalse(HostLock(lock_path).acquire(blocking=False))
+
+        apply = Mock(side_effect=lambda zone_id, changes: [
+            completed() for _ in changes])
+        applier = QueueApplier(self.queue, apply, concurrency=1,
+                               poll_interval=0.01,
+                               lock=HostLock(lock_path))
+        applier.start()
+
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.1'))
+        time.sleep(0.1)
+        self.assertFalse(apply.called)
+
+        # Applied by a worker which can take the lock
+        elected = QueueApplier(self.queue, apply, concurrency=1,
+                               poll_interval=0.01,
+                               lock=HostLock(lock_path + '2'))
+        elected.start()
+
+        for _ in range(100):
+            if apply.called:
+                break
+
+            time.sleep(0.01)
+
+        self.assertTrue(apply.called)
+
+    def test_apply(self):
+        apply = Mock(side_effect=lambda zone_id, changes: [
+            completed() for _ in changes])
+        applied = Mock()
+        applier = QueueApplier(self.queue, apply, applied=applied)
+
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.1'))
+        self.queue.enqueue('Z0', upsert('mail.google.com', '10.0.0.2'))
+        self.queue.enqueue('Z1', upsert('www.example.com', '10.0.0.3'))
+
+        self.assertEqual(applier.run_once(), 3)
+        self.assertEqual(apply.call_count, 2)
+        self.assertEqual(applied.call_count, 3)
+        self.assertEqual(self.queue.depth(), 0)
+
+    def test_apply_failure(self):
+        apply = Mock(side_effect=lambda zone_id, changes: [
+            completed(RuntimeError()) for _ in changes])
+        dropped = Mock()
+        applier = QueueApplier(self.queue, apply, max_attempts=2,
+                               dropped=dropped)
+
+        self.queue.enqueue('Z0', upsert('www.google.com', '10.0.0.1'))
+
+        # Retried after a backoff, then dropped
+        self.assertEqual(applier.run_once(), 1)
+        self.assertEqual(applier.run_once(), 0)
+        self.assertEqual(self.queue.depth(), 1)
+
+        self.clock.now += 1
+        self.assertEqual(applier.run_once(), 1)
+        self.assertEqual(self.queue.depth(), 0)
+        dropped.assert_called_once_with(
+            'Z0', upsert('www.google.com', '10.0.0.1'))
+
+
+class AsyncUpdatesTestCase(unittest.TestCase):
+    def setUp(self):
+        route53.hosted_zones.clear()
+        self.addCleanup(route53.hosted_zones.clear)
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_update_resource_records(self):
+        client = MockRoute53Client()
+        queue = WorkQueue(os.path.join(self.directory, 'queue.db'))
+        records = [new_resource_record("www.google.com", '127.0.0.1'),
+                   new_resource_record("www.example.org", '127.0.0.1')]
+
+        with patch.object(route53, 'work_queue', queue), patch.object(
+                client, 'change_resource_record_sets') as mocked:
+            results = route53.update_resource_records(
+                [(records[0], '10.0.0.1'), (records[1], '10.0.0.2')],
+                client=client)
+
+            # Accepted without waiting on Route 53
+            self.assertTrue(results[0].result())
+            self.assertEqual(mocked.call_count, 0)
+            self.assertEqual(queue.depth(), 1)
+
+            # The record which isn't in a hosted zone fails straight away
+            with self.assertRaises(route53.Route53Exception):
+                results[1].result()
+
+    def test_dropped(self):
+        """ Test that a dropped change is forgotten by the caches """
+
+        self.addCleanup(route53.record_cache.clear)
+        client = MockRoute53Client()
+        queue = WorkQueue(os.path.join(self.directory, 'queue.db'))
+        record = new_resource_record("www.google.com", '127.0.0.1')
+
+        with patch.object(route53, 'work_queue', queue), \
+                patch.object(route53, 'shared_cache', MemoryBackend()), \
+                patch.dict(route53.app.config, {'RECORD_CACHE_ENABLED': True}):
+            route53.update_resource_records([(record, '10.0.0.1')],
+                                            client=client)
+
+            hosted_zone_id = route53.find_hosted_zone('www.google.com',
+                                                      client)
+            key = route53._shared_key(hosted_zone_id, 'www.google.com', 'A')
+            change = upsert('www.google.com', '10.0.0.1')
+
+            self.assertTrue(route53.shared_cache.lookup(key)[0])
+            self.assertTrue(route53.record_cache.lookup(hosted_zone_id,
+                                                        'www.google.com'))
+
+            with self.assertLogs(route53.logger, 'ERROR'):
+                route53._forget_dropped(hosted_zone_id, change)
+
+            self.assertFalse(route53.shared_cache.lookup(key)[0])
+            self.assertIsNone(route53.record_cache.lookup(hosted_zone_id,
+                                                          'www.google.com'))
@@ -0,0 +1,82 @@
+import unittest
+
+from route53_dyndns.zones import HostedZones, ZoneIndex
+
+from mock import MagicMock
+
+from .helpers import hosted_zones_response
+
+
+class ZoneIndexTestCase(unittest.TestCase):
+    def test_find(self):
+        """ Test that hostnames map to the most specific zone """
+
+        index = ZoneIndex([('example.com.', 'Z1'), ('dyn.example.com', 'Z2'),
+                           ('example.org', 'Z3')])
+
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.find('example.com'), 'Z1')
+        self.assertEqual(index.find('www.example.com'), 'Z1')
+        self.assertEqual(index.find('Home.Dyn.Example.com.'), 'Z2')
+        self.assertEqual(index.find('dyn.example.com'), 'Z2')
+        self.assertEqual(index.find('home.example.org'), 'Z3')
+        self.assertIsNone(index.find('example.net'))
+        self.assertIsNone(index.find('com'))
+
+
+class HostedZonesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.client = MagicMock()
+        self.client.list_hosted_zones.return_value = hosted_zones_response(
+            'example.com', 'example.org')
+
+    def test_find_zone(self):
+        """ Test that zones are listed once and refreshed when stale """
+
+        zones = HostedZones(refresh_interval=60, clock=lambda: self.now)
+
+        self.assertEqual(zones.find_zone('www.example.com', self.client), 'Z0')
+        self.assertEqual(zones.find_zone('www.example.org', self.client), 'Z1')
+        self.assertEqual(self.client.list_hosted_zones.call_count, 1)
+
+        self.now += 61
+        zones.find_zone('www.example.com', self.client)
+        self.assertEqual(self.client.list_hosted_zones.call_count, 2)
+
+        # A failed refresh keeps using the stale index
+        self.now += 61
+        self.client.list_hosted_zones.side_effect = RuntimeError("Error")
+        self.assertEqual(zones.find_zone('www.example.com', self.client), 'Z0')
+        self.assertEqual(zones.find_zone('www.example.com', self.client), 'Z0')
+        self.assertEqual(self.client.list_hosted_zones.call_count, 3)
+
+        # And is retried after a short while
+        self.now += 30
+        zones.find_zone('www.example.com', self.client)
+        self.assertEqual(self.client.list_hosted_zones.call_count, 4)
+
+    def test_find_zone_paged(self):
+        """ Test that all pages of zones are listed, skipping private ones """
+
+        first = hosted_zones_response('example.com')
+        first.update({'IsTruncated': True, 'NextMarker': 'Z1'})
+        second = hosted_zones_response('example.org', 'internal.net')
+        second['HostedZones'][1]['Config']['PrivateZone'] = True
+        self.client.list_hosted_zones.side_effect = [first, second]
+
+        zones = HostedZones()
+        self.assertEqual(zones.find_zone('www.example.org', self.client), 'Z0')
+        self.assertIsNone(zones.find_zone('www.internal.net', self.client))
+        self.client.list_hosted_zones.assert_called_with(Marker='Z1')
+
+    def test_allowed(self):
+        """ Test that only zones in the allow-list are used """
+
+        zones = HostedZones(allowed=['example.org.'])
+        self.assertIsNone(zones.find_zone('www.example.com', self.client))
+        self.assertEqual(zones.find_zone('www.example.org', self.client), 'Z1')
+
+        zones = HostedZones(allowed=['Z0'])
+        self.assertEqual(zones.find_zone('www.example.com', self.client), 'Z0')
+        self.assertIsNone(zones.find_zone('www.example.org', self.client))